@@ -0,0 +1,83 @@
+# This file contains the routines to answer batches of routing queries with a pool of processes.
+#
+# _________________________________________________________________________________________
+# Intel.ligencia Artificial
+# Curs 2023 - 2024
+# Universitat Autonoma de Barcelona
+# _______________________________________________________________________________________
+
+from SearchAlgorithm import SEARCH_ALGORITHMS, run_search
+from MapSnapshot import load_city, compile_city, is_fresh
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+import itertools
+import os
+
+# Map of the worker process, loaded once by init_worker
+WORKER_MAP = None
+
+
+def init_worker(city_folder):
+    global WORKER_MAP
+    WORKER_MAP = load_city(city_folder)
+
+
+def route_chunk(chunk, algorithm):
+    """
+        Runs a chunk of queries in a worker process with the map loaded by init_worker
+        Format of the parameter is:
+        Args:
+            chunk (list): tuples (query_id, origin_id, destination_id, type_preference)
+            algorithm (str): Name of the search in SEARCH_ALGORITHMS
+        Returns:
+            (list): tuples (query_id, path) in the order of the chunk
+    """
+    return [(query_id, run_search(algorithm, origin, destination, WORKER_MAP, type_preference))
+            for query_id, origin, destination, type_preference in chunk]
+
+
+def route_batch(queries, city_folder, algorithm='Astar', max_workers=None, chunksize=256, ordered=True):
+    """
+        Spreads a batch of station to station queries over a ProcessPoolExecutor. Every worker loads the map of
+        city_folder once, and the queries are sent to the workers in chunks while the results are consumed, so the
+        batch does not need to fit in memory.
+        Format of the parameter is:
+        Args:
+            queries (iterable): tuples (origin_id, destination_id, type_preference)
+            city_folder (str): CityInformation folder of the map
+            algorithm (str): Name of the search in SEARCH_ALGORITHMS
+            max_workers (int): Number of worker processes, by default the number of CPUs
+            chunksize (int): Number of queries sent to a worker at a time
+            ordered (bool): If True, the results are returned in the order of the queries. If False, they are
+                            returned as soon as their chunk finishes
+        Returns:
+            (generator): tuples (query_id, path), where query_id is the position of the query in queries and path
+                         is the Path returned by the search ([] when there is no route)
+    """
+    if algorithm not in SEARCH_ALGORITHMS:
+        raise ValueError('Unknown algorithm {}, use one of {}'.format(algorithm, sorted(SEARCH_ALGORITHMS)))
+    max_workers = max_workers or os.cpu_count() or 1
+    # The snapshot is compiled here once instead of by every worker
+    if not is_fresh(city_folder):
+        compile_city(city_folder)
+
+    numbered = ((query_id, int(origin), int(destination), int(type_preference))
+                for query_id, (origin, destination, type_preference) in enumerate(queries))
+    chunks = iter(lambda: list(itertools.islice(numbered, chunksize)), [])
+    # Chunks sent to the workers and not yet returned
+    max_pending = 2 * max_workers
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker, initargs=(city_folder,)) as executor:
+        submit = lambda chunk: executor.submit(route_chunk, chunk, algorithm)
+        pending = deque(submit(chunk) for chunk in itertools.islice(chunks, max_pending))
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+            for future in done:
+                for chunk in itertools.islice(chunks, 1):
+                    pending.append(submit(chunk))
+                yield from future.result()
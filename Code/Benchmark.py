@@ -0,0 +1,279 @@
+# This file contains a benchmark of the searches over seeded queries on the cities of CityInformation.
+#
+# _________________________________________________________________________________________
+# Intel.ligencia Artificial
+# Curs 2023 - 2024
+# Universitat Autonoma de Barcelona
+# _______________________________________________________________________________________
+
+from SearchAlgorithm import (depth_first_search, breadth_first_search, uniform_cost_search, Astar, Astar_improved,
+                             distance_to_stations, iter_depth_first_search, iter_breadth_first_search,
+                             iter_uniform_cost_search, iter_Astar)
+from MapSnapshot import load_city, SNAPSHOT_NAME
+from utils import read_station_information, read_cost_table, read_information
+from collections import namedtuple
+import numpy as np
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+CITY_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CityInformation')
+CITIES = ['Lyon_smallCity', 'Lyon_bigCity']
+PERCENTILES = [50, 90, 99]
+# 'dict' is the map of the text files used by default by the searches, 'snapshot' the memory-mapped CSR map of
+# MapSnapshot
+BACKENDS = ['dict', 'snapshot']
+
+# run(map, query) calls the search as a user would, events(map, query) is its SearchEvent generator (None when the
+# search has none). query is (origin_id, destination_id) for 'stations' and (origin_coord, destination_coord)
+# for 'coordinates'
+BenchmarkCase = namedtuple('BenchmarkCase', ['queries', 'run', 'events'])
+
+
+def benchmark_cases():
+    cases = {
+        'depth_first_search': BenchmarkCase('stations', lambda m, q: depth_first_search(q[0], q[1], m),
+                                            lambda m, q: iter_depth_first_search(q[0], q[1], m)),
+        'breadth_first_search': BenchmarkCase('stations', lambda m, q: breadth_first_search(q[0], q[1], m),
+                                              lambda m, q: iter_breadth_first_search(q[0], q[1], m)),
+    }
+    for type_preference in [0, 1, 2, 3]:
+        cases['uniform_cost_search/{}'.format(type_preference)] = BenchmarkCase(
+            'stations', lambda m, q, p=type_preference: uniform_cost_search(q[0], q[1], m, p),
+            lambda m, q, p=type_preference: iter_uniform_cost_search(q[0], q[1], m, p))
+    for type_preference in [0, 1, 2, 3]:
+        cases['Astar/{}'.format(type_preference)] = BenchmarkCase(
+            'stations', lambda m, q, p=type_preference: Astar(q[0], q[1], m, p),
+            lambda m, q, p=type_preference: iter_Astar(q[0], q[1], m, p))
+    cases['Astar_improved'] = BenchmarkCase('coordinates', lambda m, q: Astar_improved(q[0], q[1], m), None)
+    cases['distance_to_stations'] = BenchmarkCase('coordinates', lambda m, q: distance_to_stations(q[0], m), None)
+    return cases
+
+
+def load_map(folder, backend='dict', snapshot_folder=None):
+    """
+     The map of a CityInformation folder
+     Format of the parameter is:
+        Args:
+            folder (str): CityInformation folder with Stations.txt, Time.txt and InfoVelocity.txt
+            backend (str): 'dict' for the dictionary of connections read from the text files, 'snapshot' for the
+                           map loaded from a binary snapshot
+            snapshot_folder (str): Folder where the snapshot is compiled, needed for 'snapshot' so that nothing
+                                   is written in the folder of the city
+        Returns:
+            map (object of Map class): All the map information
+    """
+    if backend == 'snapshot':
+        return load_city(folder, os.path.join(snapshot_folder, SNAPSHOT_NAME))
+    if backend != 'dict':
+        raise ValueError('Unknown backend {}, use one of {}'.format(backend, BACKENDS))
+    map = read_station_information(os.path.join(folder, 'Stations.txt'))
+    map.add_connection(read_cost_table(os.path.join(folder, 'Time.txt')))
+    map.add_velocity(read_information(os.path.join(folder, 'InfoVelocity.txt')))
+    return map
+
+
+def make_queries(map, count, seed):
+    """
+     Seeded queries of a map, the same seed always gives the same queries
+     Format of the parameter is:
+        Args:
+            map (object of Map class): All the map information
+            count (int): Number of queries of every kind
+            seed (int): Seed of the random generator
+        Returns:
+            (dict): {'stations': [(origin_id, destination_id)], 'coordinates': [(origin_coord, destination_coord)]}
+                    Coordinates are drawn inside the bounding box of the stations
+    """
+    generator = random.Random(seed)
+    ids = sorted(map.stations)
+    stations = [tuple(generator.sample(ids, 2)) for _ in range(count)]
+    xs, ys = map.stations.column('x'), map.stations.column('y')
+    point = lambda: [round(generator.uniform(xs.min(), xs.max()), 2), round(generator.uniform(ys.min(), ys.max()), 2)]
+    coordinates = [(point(), point()) for _ in range(count)]
+    return {'stations': stations, 'coordinates': coordinates}
+
+
+def summary(values):
+    values = np.asarray(values, dtype=np.float64)
+    result = {'p{}'.format(p): float(np.percentile(values, p)) for p in PERCENTILES}
+    result.update({'mean': float(values.mean()), 'max': float(values.max())})
+    return result
+
+
+def measure(case, map, queries, repeat=5):
+    """
+     Runs the queries of a case timed, as a user would run them, and once more with the SearchEvent generator of
+     the search and tracemalloc to count the expansions, the peak frontier size and the peak memory
+     Format of the parameter is:
+        Args:
+            case (BenchmarkCase): The search
+            map (object of Map class): All the map information
+            queries (list): Queries of the kind of the case
+            repeat (int): Times every query is timed, its time is the fastest one
+        Returns:
+            (dict): Summaries of 'time' (seconds), 'expanded' and 'frontier' (None without events) and 'memory'
+                    (bytes)
+    """
+    # Warm up the data kept in map.precomputed, so the first query does not pay for it
+    case.run(map, queries[0])
+    times = [np.inf] * len(queries)
+    for _ in range(repeat):
+        for i, query in enumerate(queries):
+            start = time.perf_counter()
+            case.run(map, query)
+            times[i] = min(times[i], time.perf_counter() - start)
+
+    expanded, frontier, memory = [], [], []
+    tracemalloc.start()
+    try:
+        for query in queries:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            if case.events is None:
+                case.run(map, query)
+            else:
+                peak = 0
+                for event in case.events(map, query):
+                    peak = max(peak, event.frontier)
+                expanded.append(event.expanded)
+                frontier.append(peak)
+            memory.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+
+    return {'queries': len(queries), 'time': summary(times),
+            'expanded': summary(expanded) if expanded else None,
+            'frontier': summary(frontier) if frontier else None,
+            'memory': summary(memory)}
+
+
+def run_benchmark(cities=CITIES, count=100, seed=0, algorithms=None, city_folder=CITY_FOLDER, repeat=5, log=None,
+                  backend='dict'):
+    """
+     Benchmark of the searches on every city. Snapshots are compiled in a temporary folder, nothing is written in
+     city_folder.
+     Format of the parameter is:
+        Args:
+            cities (list): Folder names of the cities inside city_folder
+            count (int): Number of queries of every search on every city
+            seed (int): Seed of the queries
+            algorithms (list): Names of the cases of benchmark_cases to run, all of them by default
+            city_folder (str): Folder with the cities
+            repeat (int): Times every query is timed
+            log (file): If given, a line is written there after every case
+            backend (str): How the maps are loaded, one of BACKENDS (see load_map)
+        Returns:
+            (dict): {'meta': {...}, 'results': {'city|case': measure(...)}}
+    """
+    cases = benchmark_cases()
+    if algorithms:
+        unknown = set(algorithms) - set(cases)
+        if unknown:
+            raise ValueError('Unknown algorithm {}, use some of {}'.format(sorted(unknown), list(cases)))
+        cases = {name: case for name, case in cases.items() if name in algorithms}
+
+    results = {}
+    for city in cities:
+        with tempfile.TemporaryDirectory() as snapshot_folder:
+            map = load_map(os.path.join(city_folder, city), backend, snapshot_folder)
+            queries = make_queries(map, count, seed)
+            for name, case in cases.items():
+                key = '{}|{}'.format(city, name)
+                results[key] = measure(case, map, queries[case.queries], repeat)
+                if log is not None:
+                    print('{}: p50 {:.6f}s'.format(key, results[key]['time']['p50']), file=log)
+            # The arrays of a snapshot are memory-mapped, the file can only be removed once they are released
+            del map
+    meta = {'seed': seed, 'queries': count, 'repeat': repeat, 'cities': list(cities), 'backend': backend,
+            'python': platform.python_version(),
+            'platform': platform.platform(), 'date': datetime.datetime.now().isoformat(timespec='seconds')}
+    return {'meta': meta, 'results': results}
+
+
+def compare_benchmarks(base, new, threshold=0.25, min_time=5e-5):
+    """
+     Regressions of a benchmark run against a base run. The expansions and frontier sizes of the searches are
+     deterministic, so any increase is reported. Times and memory are reported when they grow more than threshold,
+     and times below min_time seconds are ignored because they are mostly noise.
+     Format of the parameter is:
+        Args:
+            base (dict): Result of run_benchmark
+            new (dict): Result of run_benchmark
+            threshold (float): Relative increase allowed in time and memory
+            min_time (float): Seconds under which a time is not compared
+        Returns:
+            (list): tuples (key, metric, base value, new value) of every regression
+    """
+    regressions = []
+    for key, result in new['results'].items():
+        if key not in base['results']:
+            continue
+        previous = base['results'][key]
+        for metric in ['expanded', 'frontier']:
+            if previous[metric] is not None and result[metric] is not None:
+                if result[metric]['mean'] > previous[metric]['mean']:
+                    regressions.append((key, metric + '.mean', previous[metric]['mean'], result[metric]['mean']))
+        for statistic in ['p50', 'p90']:
+            old, current = previous['time'][statistic], result['time'][statistic]
+            if current > min_time and current > old * (1 + threshold):
+                regressions.append((key, 'time.' + statistic, old, current))
+        old, current = previous['memory']['max'], result['memory']['max']
+        if current > old * (1 + threshold):
+            regressions.append((key, 'memory.max', old, current))
+    return regressions
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the searches of SearchAlgorithm.py')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='Runs the benchmark and writes its results as JSON')
+    run.add_argument('--cities', nargs='+', default=CITIES)
+    run.add_argument('--queries', type=int, default=100, help='Queries of every search on every city')
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--repeat', type=int, default=5, help='Times every query is timed, the fastest one is kept')
+    run.add_argument('--algorithms', nargs='+', help='Some of: ' + ', '.join(benchmark_cases()))
+    run.add_argument('--city-folder', default=CITY_FOLDER)
+    run.add_argument('--backend', choices=BACKENDS, default='dict',
+                     help='dict: the maps of the text files (default), snapshot: the memory-mapped CSR maps')
+    run.add_argument('--output', default='-', help='JSON file, - for the standard output')
+    compare = commands.add_parser('compare', help='Reports the regressions of a run against a base run')
+    compare.add_argument('base')
+    compare.add_argument('new')
+    compare.add_argument('--threshold', type=float, default=0.25, help='Relative increase allowed in time and memory')
+    compare.add_argument('--min-time', type=float, default=5e-5, help='Seconds under which times are not compared')
+    arguments = parser.parse_args(arguments)
+
+    if arguments.command == 'run':
+        report = run_benchmark(arguments.cities, arguments.queries, arguments.seed, arguments.algorithms,
+                               arguments.city_folder, arguments.repeat, log=sys.stderr, backend=arguments.backend)
+        if arguments.output == '-':
+            json.dump(report, sys.stdout, indent=1)
+        else:
+            with open(arguments.output, 'w') as file:
+                json.dump(report, file, indent=1)
+        return 0
+
+    with open(arguments.base) as file:
+        base = json.load(file)
+    with open(arguments.new) as file:
+        new = json.load(file)
+    regressions = compare_benchmarks(base, new, arguments.threshold, arguments.min_time)
+    for key, metric, old, current in regressions:
+        print('REGRESSION {} {}: {:.6g} -> {:.6g}'.format(key, metric, old, current))
+    if not regressions:
+        print('No regressions')
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    # python Benchmark.py run --output base.json
+    # python Benchmark.py run --output new.json && python Benchmark.py compare base.json new.json
+    sys.exit(main())
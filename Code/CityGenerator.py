@@ -0,0 +1,170 @@
+# This file contains a generator of synthetic cities in the formats of the CityInformation folders.
+#
+# _________________________________________________________________________________________
+# Intel.ligencia Artificial
+# Curs 2023 - 2024
+# Universitat Autonoma de Barcelona
+# _______________________________________________________________________________________
+
+from utils import euclidean_dist
+import argparse
+import math
+import os
+import random
+
+# Format of the costs in Time.txt, as in the Lyon files
+COST_FORMAT = '{:.5f}'
+NO_CONNECTION = COST_FORMAT.format(0)
+MIN_COST = 1e-5
+
+
+def line_stations(generator, stations_per_line, extent, start):
+    # Random walk across the city from start, inside [0, extent] x [0, extent]
+    step = 1.5 * extent / stations_per_line
+    x, y = start
+    heading = generator.uniform(0, 2 * math.pi)
+    for _ in range(stations_per_line):
+        yield x, y
+        heading += generator.gauss(0, 0.3)
+        length = step * generator.uniform(0.5, 1.5)
+        dx, dy = length * math.cos(heading), length * math.sin(heading)
+        if not 0 <= x + dx <= extent:
+            dx, heading = -dx, math.pi - heading
+        if not 0 <= y + dy <= extent:
+            dy, heading = -dy, -heading
+        x, y = min(max(x + dx, 0), extent), min(max(y + dy, 0), extent)
+
+
+def generate_city(city_folder, lines=10, stations_per_line=50, transfer_density=0.2, extent=1000, seed=0,
+                  velocities=(10, 45), transfer_time=(5, 20), edge_list=False):
+    """
+     Writes a synthetic city in city_folder, as Stations.txt, Time.txt and InfoVelocity.txt in the formats read by
+     read_station_information, read_cost_table and read_information.
+     Every line is a random walk across the city. At every new station of a line, with probability
+     transfer_density the line goes through a nearby station of another line instead: the new station gets its
+     name and coordinates, and it is connected to all the stations with that name with a transfer. Every line
+     but the first one starts at a transfer with a random station of the previous lines, so the city is connected.
+     The time between two stations of a line is their distance divided by the velocity of the line.
+     The stations and connections are kept as lists (memory linear in their number). Time.txt is written as the
+     dense matrix of the Lyon cities, row by row, or as an edge list (see read_cost_edges), which is linear in the
+     number of connections and is the one to use for large cities.
+     Format of the parameter is:
+        Args:
+            city_folder (str): Folder where the files are written, it is created if needed
+            lines (int): Number of lines
+            stations_per_line (int): Number of stations of every line
+            transfer_density (float): Probability that a station is a transfer with a nearby line
+            extent (int): The coordinates are integers in [0, extent]
+            seed (int): Seed of the random generator, the same arguments always write the same city
+            velocities (tuple): Range of the integer velocity of every line
+            transfer_time (tuple): Range of the time of a transfer
+            edge_list (bool): If True, Time.txt is written as an edge list instead of a dense matrix
+        Returns:
+            (dict): Number of 'stations', 'connections' and 'transfers' written
+    """
+    generator = random.Random(seed)
+    names, coords, line_of = [], [], []
+    connections = []
+    # Stations of every cell of a grid, to find the stations of other lines near a point
+    cell = max(1.5 * extent / stations_per_line, 1)
+    grid = {}
+    group = {}
+    velocity = [generator.randint(*velocities) for _ in range(lines)]
+
+    for line in range(1, lines + 1):
+        previous = None
+        used = set()
+        if names:
+            start = coords[generator.randrange(len(names))]
+        else:
+            start = (generator.uniform(0, extent), generator.uniform(0, extent))
+        for x, y in line_stations(generator, stations_per_line, extent, start):
+            station = len(names)
+            candidates = []
+            if previous is None and names:
+                candidates = [other for other in range(len(names)) if coords[other] == start][:1]
+            elif generator.random() < transfer_density:
+                cx, cy = int(x // cell), int(y // cell)
+                candidates = [other for i in (cx - 1, cx, cx + 1) for j in (cy - 1, cy, cy + 1)
+                              for other in grid.get((i, j), []) if names[other] not in used]
+            connections.append({})
+            if candidates:
+                other = min(candidates, key=lambda other: euclidean_dist(coords[other], (x, y)))
+                name, position = names[other], coords[other]
+                for same in group[name]:
+                    connections[same][station] = connections[station][same] = generator.uniform(*transfer_time)
+            else:
+                name, position = 'STATION {}'.format(station + 1), (round(x), round(y))
+                group[name] = []
+                grid.setdefault((int(x // cell), int(y // cell)), []).append(station)
+            if previous is not None:
+                # A cost of 0 would be read as no connection
+                cost = max(euclidean_dist(position, coords[previous]) / velocity[line - 1], MIN_COST)
+                connections[previous][station] = connections[station][previous] = cost
+            names.append(name)
+            coords.append(position)
+            line_of.append(line)
+            group[name].append(station)
+            used.add(name)
+            previous = station
+
+    write_city(city_folder, names, line_of, coords, connections, velocity, edge_list)
+    transfers = sum(len(stations) * (len(stations) - 1) for stations in group.values())
+    return {'stations': len(names), 'connections': sum(len(row) for row in connections), 'transfers': transfers}
+
+
+def write_city(city_folder, names, line_of, coords, connections, velocity, edge_list=False):
+    """
+     Writes the files of a city, Time.txt is written row by row or as an edge list
+     Format of the parameter is:
+        Args:
+            city_folder (str): Folder where the files are written, it is created if needed
+            names (list): Name of every station, the id of the station in position i is i + 1
+            line_of (list): Line of every station
+            coords (list): Integer coordinates (x, y) of every station
+            connections (list): Dictionary {station position: time} of the connections of every station
+            velocity (list): Velocity of every line
+            edge_list (bool): If True, Time.txt is written as an edge list instead of a dense matrix
+    """
+    os.makedirs(city_folder, exist_ok=True)
+    with open(os.path.join(city_folder, 'Stations.txt'), 'w', encoding='utf-8') as file:
+        for station, (name, line, (x, y)) in enumerate(zip(names, line_of, coords)):
+            file.write('{}\t{}\t{}\t{}\t{}\n'.format(station + 1, name, line, x, y))
+
+    with open(os.path.join(city_folder, 'Time.txt'), 'w', encoding='utf-8') as file:
+        if edge_list:
+            file.write('# from to cost\n# stations: {}\n'.format(len(names)))
+            for station_1, neighbors in enumerate(connections, 1):
+                for station_2, cost in neighbors.items():
+                    file.write('{} {} {}\n'.format(station_1, station_2 + 1, COST_FORMAT.format(cost)))
+        else:
+            row = [NO_CONNECTION] * len(names)
+            for neighbors in connections:
+                for station, cost in neighbors.items():
+                    row[station] = COST_FORMAT.format(cost)
+                file.write(' '.join(row) + '\n')
+                for station in neighbors:
+                    row[station] = NO_CONNECTION
+
+    with open(os.path.join(city_folder, 'InfoVelocity.txt'), 'w', encoding='utf-8') as file:
+        file.write('\n'.join(' Vel. line {} : {}'.format(line, v) for line, v in enumerate(velocity, 1)))
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Writes a synthetic city in the format of CityInformation')
+    parser.add_argument('city_folder')
+    parser.add_argument('--lines', type=int, default=10)
+    parser.add_argument('--stations-per-line', type=int, default=50)
+    parser.add_argument('--transfer-density', type=float, default=0.2)
+    parser.add_argument('--extent', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--edge-list', action='store_true', help='Writes Time.txt as an edge list')
+    arguments = parser.parse_args(arguments)
+    print(generate_city(arguments.city_folder, arguments.lines, arguments.stations_per_line,
+                        arguments.transfer_density, arguments.extent, arguments.seed, edge_list=arguments.edge_list))
+
+
+if __name__ == "__main__":
+    # python CityGenerator.py ../CityInformation/Synthetic_5k --lines 50 --stations-per-line 100
+    # python CityGenerator.py ../CityInformation/Synthetic_100k --lines 500 --stations-per-line 200 --edge-list
+    main()
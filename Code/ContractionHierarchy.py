@@ -0,0 +1,295 @@
+# This file contains a contraction hierarchy of a map and the bidirectional query that runs on it.
+#
+# _________________________________________________________________________________________
+# Intel.ligencia Artificial
+# Curs 2023 - 2024
+# Universitat Autonoma de Barcelona
+# _______________________________________________________________________________________
+
+from SubwayMap import Path
+from SearchAlgorithm import calculate_edge_costs
+import numpy as np
+import heapq
+import math
+
+
+class ContractionHierarchy:
+    """
+    The stations of a map contracted one by one in the order of self.rank. Contracting a station removes it from
+    the graph and adds a shortcut u -> w for every pair of connections u -> v -> w that is the only optimal route
+    between u and w, so the costs between the remaining stations do not change. A query only needs to follow
+    connections towards stations of higher rank, from the origin and (backwards) from the destination.
+
+    self.ids: int32 array with the station id of every index (the indices of map.graph)
+    self.rank: int32 array, rank[i] is the position in which index i has been contracted
+    self.sources, self.targets, self.costs: every connection and shortcut of the hierarchy
+    self.hops: int32 array with the number of connections of the map that form every shortcut. Costs are
+            compared as (cost, hops), so among routes of the same cost the one with less stations is chosen, as
+            in Astar, and the connections of cost 0 between stations of the same name do not form cycles
+    self.first, self.second: int32 arrays, the two connections that form a shortcut (-1 for a connection of the
+            map). A shortcut is unpacked by replacing it by first and second until only connections are left
+    self.active: bool array, False for connections replaced by a cheaper shortcut, which are only kept to unpack
+    Usage:
+        # >>> hierarchy = contraction_hierarchy(map, type_preference=1)
+        # >>> path = hierarchy.route(9, 3)
+    """
+
+    def __init__(self, ids, rank, sources, targets, costs, hops, first, second, active, type_preference):
+        self.ids = np.asarray(ids, dtype=np.int32)
+        self.rank = np.asarray(rank, dtype=np.int32)
+        self.sources = np.asarray(sources, dtype=np.int32)
+        self.targets = np.asarray(targets, dtype=np.int32)
+        self.costs = np.asarray(costs, dtype=np.float64)
+        self.hops = np.asarray(hops, dtype=np.int32)
+        self.first = np.asarray(first, dtype=np.int32)
+        self.second = np.asarray(second, dtype=np.int32)
+        self.active = np.asarray(active, dtype=bool)
+        self.type_preference = type_preference
+        self.index = {station: ix for ix, station in enumerate(self.ids.tolist())}
+
+        # Upward graph of the forward search and of the backward search: (station, cost, connection)
+        rank = self.rank.tolist()
+        self.upward = [[] for _ in range(len(self.ids))]
+        self.downward = [[] for _ in range(len(self.ids))]
+        for edge, (source, target, cost, hops, active) in enumerate(zip(
+                self.sources.tolist(), self.targets.tolist(), self.costs.tolist(), self.hops.tolist(),
+                self.active.tolist())):
+            if not active:
+                continue
+            if rank[source] < rank[target]:
+                self.upward[source].append((target, (cost, hops), edge))
+            else:
+                self.downward[target].append((source, (cost, hops), edge))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def shortcuts(self):
+        return int(np.count_nonzero(self.first >= 0))
+
+    def unpack(self, edge):
+        # Connections of the map that form the connection or shortcut edge, in order
+        stack, edges = [edge], []
+        first, second = self.first.tolist(), self.second.tolist()
+        while stack:
+            edge = stack.pop()
+            if first[edge] < 0:
+                edges.append(edge)
+            else:
+                stack.append(second[edge])
+                stack.append(first[edge])
+        return edges
+
+    def route(self, origin_id, destination_id, stats=None):
+        """
+         Optimal route from origin_id to destination_id. A Dijkstra from the origin over self.upward and another
+         one from the destination over self.downward; each search stops once its frontier is not cheaper than the
+         best route found joining both. The shortcuts of the route are unpacked and its g is accumulated
+         connection by connection from the origin, as calculate_cost does.
+         Format of the parameter is:
+            Args:
+                origin_id (int): Starting station id
+                destination_id (int): Final station id
+                stats (dict): If given, stats['expanded'] is increased by the number of stations expanded
+            Returns:
+                path (Path Class): The route that goes from origin_id to destination_id, [] if there is none
+        """
+        origin, destination = self.index[origin_id], self.index[destination_id]
+        graphs = [self.upward, self.downward]
+        cost = [{origin: (0, 0)}, {destination: (0, 0)}]
+        parent = [{origin: None}, {destination: None}]
+        settled = [set(), set()]
+        frontier = [[((0, 0), origin)], [((0, 0), destination)]]
+        best, meeting = ((0, 0), origin) if origin == destination else (NO_ROUTE, None)
+        expanded = 0
+        while True:
+            sides = [side for side in (0, 1) if frontier[side] and shorter(frontier[side][0][0], best)]
+            if not sides:
+                break
+            side = min(sides, key=lambda s: frontier[s][0][0])
+            g, station = heapq.heappop(frontier[side])
+            if station in settled[side]:
+                continue
+            settled[side].add(station)
+            expanded += 1
+            if station in cost[1 - side] and shorter(add(g, cost[1 - side][station]), best):
+                best, meeting = add(g, cost[1 - side][station]), station
+            for key, edge_cost, edge in graphs[side][station]:
+                new_g = add(g, edge_cost)
+                if shorter(new_g, cost[side].get(key, NO_ROUTE)):
+                    cost[side][key] = new_g
+                    parent[side][key] = (station, edge)
+                    heapq.heappush(frontier[side], (new_g, key))
+        if stats is not None:
+            stats['expanded'] = stats.get('expanded', 0) + expanded
+        if meeting is None:
+            return []
+
+        # Connections from the origin to the meeting station and from there to the destination
+        edges = []
+        station = meeting
+        while parent[0][station] is not None:
+            station, edge = parent[0][station]
+            edges.extend(reversed(self.unpack(edge)))
+        edges.reverse()
+        station = meeting
+        while parent[1][station] is not None:
+            station, edge = parent[1][station]
+            edges.extend(self.unpack(edge))
+
+        path = Path([origin_id])
+        ids, targets, costs = self.ids.tolist(), self.targets.tolist(), self.costs.tolist()
+        for edge in edges:
+            path.add_route(ids[targets[edge]])
+            path.update_g(costs[edge])
+        path.update_f()
+        return path
+
+
+# Costs are tuples (cost, hops). The same route added in another order can differ in the last bits, so costs
+# closer than RELATIVE_TOLERANCE are taken as equal and compared by hops
+NO_ROUTE = (math.inf, 0)
+RELATIVE_TOLERANCE = 1e-12
+
+
+def add(a, b):
+    return a[0] + b[0], a[1] + b[1]
+
+
+def shorter(a, b):
+    tolerance = RELATIVE_TOLERANCE * max(1.0, abs(a[0]))
+    if a[0] < b[0] - tolerance:
+        return True
+    return a[0] <= b[0] + tolerance and a[1] < b[1]
+
+
+def witness_costs(graph, source, excluded, max_cost, max_settled):
+    # Dijkstra from source without the station excluded, up to max_cost and max_settled stations
+    cost = {source: (0, 0)}
+    frontier = [((0, 0), source)]
+    settled = 0
+    while frontier and settled < max_settled:
+        g, station = heapq.heappop(frontier)
+        if g > cost[station]:
+            continue
+        if g > max_cost:
+            break
+        settled += 1
+        for key, (edge_cost, _) in graph[station].items():
+            if key != excluded and shorter(add(g, edge_cost), cost.get(key, NO_ROUTE)):
+                cost[key] = add(g, edge_cost)
+                heapq.heappush(frontier, (cost[key], key))
+    return cost
+
+
+def build_contraction_hierarchy(map, type_preference=1, max_settled=500):
+    """
+     Contracts the stations of map.graph. The next station to contract is the one with the smallest edge
+     difference (shortcuts added minus connections removed) plus number of neighbours already contracted, which
+     keeps the hierarchy small and spreads the contraction over the map. Priorities are updated lazily: a station
+     is contracted only if its priority, computed again, is still the smallest one.
+     A shortcut u -> v -> w is not added when a witness search from u without v finds a route to w that is not
+     more expensive. The witness searches stop after max_settled stations, adding the shortcut when in doubt.
+     Format of the parameter is:
+        Args:
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected:
+                            1 - minimum Time
+                            2 - minimum Distance
+                            (0 - Adjacency and 3 - minimum Transfers are also valid, but with many routes of the
+                            same cost the route returned can be another one of that cost)
+            max_settled (int): Limit of stations settled by every witness search
+        Returns:
+            hierarchy (ContractionHierarchy Class): The contracted map
+    """
+    graph = map.graph
+    n = len(graph)
+    sources = np.repeat(np.arange(n), np.diff(graph.offsets)).tolist()
+    edge_list = [[s, t, (c, 1), -1, -1] for s, t, c in zip(sources, graph.neighbors_index.tolist(),
+                                                      calculate_edge_costs(map, type_preference).tolist())]
+    # Remaining graph: outgoing[u][v] = incoming[v][u] = (cost, edge) of the cheapest connection u -> v
+    outgoing = [{} for _ in range(n)]
+    incoming = [{} for _ in range(n)]
+
+    def add_edge(source, target, edge_cost, edge):
+        if shorter(edge_cost, outgoing[source].get(target, (NO_ROUTE, -1))[0]):
+            outgoing[source][target] = incoming[target][source] = (edge_cost, edge)
+
+    for edge, (source, target, edge_cost, _, _) in enumerate(edge_list):
+        if source != target:
+            add_edge(source, target, edge_cost, edge)
+
+    def shortcuts_of(station):
+        # Shortcuts needed to contract station, (u, w, cost, first, second)
+        needed = []
+        for u, (in_cost, in_edge) in incoming[station].items():
+            targets = [(w, add(in_cost, out_cost), out_edge) for w, (out_cost, out_edge) in outgoing[station].items()
+                       if w != u]
+            if not targets:
+                continue
+            witness = witness_costs(outgoing, u, station, max(c for _, c, _ in targets), max_settled)
+            for w, shortcut_cost, out_edge in targets:
+                if shorter(shortcut_cost, witness.get(w, NO_ROUTE)):
+                    needed.append((u, w, shortcut_cost, in_edge, out_edge))
+        return needed
+
+    contracted_neighbours = [0] * n
+    priority = lambda v: len(shortcuts_of(v)) - len(incoming[v]) - len(outgoing[v]) + contracted_neighbours[v]
+    queue = [(priority(v), v) for v in range(n)]
+    heapq.heapify(queue)
+    rank = [0] * n
+    contracted = 0
+    while queue:
+        _, station = heapq.heappop(queue)
+        current = priority(station)
+        if queue and current > queue[0][0]:
+            heapq.heappush(queue, (current, station))
+            continue
+        for u, w, shortcut_cost, first, second in shortcuts_of(station):
+            edge_list.append([u, w, shortcut_cost, first, second])
+            add_edge(u, w, shortcut_cost, len(edge_list) - 1)
+        neighbours = set(incoming[station]) | set(outgoing[station])
+        for u in incoming[station]:
+            del outgoing[u][station]
+        for w in outgoing[station]:
+            del incoming[w][station]
+        for v in neighbours:
+            contracted_neighbours[v] += 1
+        rank[station] = contracted
+        contracted += 1
+
+    # Only the cheapest connection between two stations is searched, the others are kept to unpack shortcuts
+    active = [False] * len(edge_list)
+    cheapest = {}
+    for edge, (source, target, edge_cost, _, _) in enumerate(edge_list):
+        if source != target and shorter(edge_cost, cheapest.get((source, target), (NO_ROUTE, -1))[0]):
+            cheapest[(source, target)] = (edge_cost, edge)
+    for _, edge in cheapest.values():
+        active[edge] = True
+
+    sources, targets, costs, first, second = zip(*edge_list) if edge_list else ([], [], [], [], [])
+    return ContractionHierarchy(graph.ids, rank, sources, targets, [c for c, _ in costs], [h for _, h in costs],
+                                first, second, active, type_preference)
+
+
+def contraction_hierarchy(map, type_preference=1):
+    """
+        The ContractionHierarchy of a map. It is built the first time and kept in map.precomputed.
+    """
+    key = ('contraction_hierarchy', type_preference)
+    if key not in map.precomputed:
+        map.precomputed[key] = build_contraction_hierarchy(map, type_preference)
+    return map.precomputed[key]
+
+
+def save_contraction_hierarchy(hierarchy, filename):
+    np.savez(filename, ids=hierarchy.ids, rank=hierarchy.rank, sources=hierarchy.sources, targets=hierarchy.targets,
+             costs=hierarchy.costs, hops=hierarchy.hops, first=hierarchy.first, second=hierarchy.second,
+             active=hierarchy.active, type_preference=hierarchy.type_preference)
+
+
+def load_contraction_hierarchy(filename):
+    with np.load(filename) as arrays:
+        return ContractionHierarchy(arrays['ids'], arrays['rank'], arrays['sources'], arrays['targets'],
+                                    arrays['costs'], arrays['hops'], arrays['first'], arrays['second'],
+                                    arrays['active'], int(arrays['type_preference']))
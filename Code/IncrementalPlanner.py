@@ -0,0 +1,183 @@
+# This file contains an incremental planner that repairs a route when the costs of some connections change.
+#
+# _________________________________________________________________________________________
+# Intel.ligencia Artificial
+# Curs 2023 - 2024
+# Universitat Autonoma de Barcelona
+# _______________________________________________________________________________________
+
+from SubwayMap import Path, LinkedPath
+from SearchAlgorithm import calculate_cost, calculate_edge_costs
+import heapq
+import math
+
+# Costs are compared as (cost, number of connections), so among routes of the same cost the shortest one wins
+# and the connections of cost 0 (transfers) can not form cycles of the same cost
+NO_ROUTE = (math.inf, 0)
+
+
+def add(cost, connection_cost):
+    total = cost[0] + connection_cost
+    return (total, cost[1] + 1) if total < math.inf else NO_ROUTE
+
+
+class IncrementalPlanner:
+    """
+    Lifelong Planning A* (LPA*) from origin_id to destination_id, with h = 0. The planner keeps the cost of every
+    station it has searched (g) and the cost given by its predecessors (rhs) between calls. When the cost of some
+    connections changes with map.update_connection (or by writing the cost in map.connections, which does the
+    same), the next route() only searches again the stations whose cost depends on those connections, instead of
+    the whole search. Both ways change one direction of the connection only.
+    Any other change of the map (add_station, add_connection, add_velocity, ...) starts the search from scratch.
+    Usage:
+        # >>> planner = IncrementalPlanner(map, 9, 4, type_preference=1)
+        # >>> path = planner.route()
+        # >>> map.update_connection(8, 12, 30.0)
+        # Only what depends on the connection 8 -> 12 is searched again
+        # >>> path = planner.route()
+    """
+
+    def __init__(self, map, origin_id, destination_id, type_preference=1):
+        self.map = map
+        self.origin = origin_id
+        self.destination = destination_id
+        self.type_preference = type_preference
+        self.expanded = 0
+        self.resets = 0
+        self.repairs = 0
+        self.reset()
+
+    def reset(self):
+        # Connections of the map with their cost according to type preference, by station id
+        graph = self.map.graph
+        ids = graph.ids.tolist()
+        sources = [ids[ix] for ix in range(len(ids)) for _ in range(graph.offsets[ix], graph.offsets[ix + 1])]
+        self.successors = {station: {} for station in ids}
+        self.predecessors = {station: {} for station in ids}
+        for source, target, cost in zip(sources, graph.neighbor_ids.tolist(),
+                                        calculate_edge_costs(self.map, self.type_preference).tolist()):
+            self.successors[source][target] = cost
+            self.predecessors[target][source] = cost
+
+        self.g = {}
+        self.rhs = {self.origin: (0, 0)}
+        self.keys = {}
+        self.queue = []
+        self.push(self.origin)
+        self.version = self.map.version
+        self.resets += 1
+
+    def connection_cost(self, station_1, station_2):
+        # Same cost as calculate_cost for the connection station_1 -> station_2
+        path = LinkedPath(station_1).extend(station_2)
+        calculate_cost([path], self.map, self.type_preference)
+        return path.g
+
+    def push(self, station):
+        key = min(self.g.get(station, NO_ROUTE), self.rhs.get(station, NO_ROUTE))
+        self.keys[station] = key
+        heapq.heappush(self.queue, (key, station))
+
+    def update_station(self, station):
+        if station != self.origin:
+            g = self.g
+            self.rhs[station] = min((add(g.get(previous, NO_ROUTE), cost)
+                                     for previous, cost in self.predecessors[station].items()), default=NO_ROUTE)
+        if self.g.get(station, NO_ROUTE) != self.rhs.get(station, NO_ROUTE):
+            self.push(station)
+        else:
+            self.keys.pop(station, None)
+
+    def update_connections(self, changes):
+        """
+         Repairs the search after a change of the cost of some connections
+         Format of the parameter is:
+            Args:
+                changes (iterable): tuples (station_1, station_2) of the connections whose cost changed in the map,
+                                    or that were removed from it
+        """
+        for station_1, station_2 in changes:
+            if station_2 not in self.predecessors:
+                self.predecessors[station_2] = {}
+                self.successors.setdefault(station_2, {})
+            if station_2 in self.map.connections.get(station_1, {}):
+                cost = self.connection_cost(station_1, station_2)
+                self.successors.setdefault(station_1, {})[station_2] = cost
+                self.predecessors[station_2][station_1] = cost
+            else:
+                # The connection was removed
+                self.successors.get(station_1, {}).pop(station_2, None)
+                self.predecessors[station_2].pop(station_1, None)
+            self.update_station(station_2)
+            self.repairs += 1
+
+    def synchronize(self):
+        # Applies the changes of the map since the last search
+        map = self.map
+        if map.version == self.version:
+            return
+        changes = [(station_1, station_2) for version, station_1, station_2 in map.connection_updates
+                   if version > self.version]
+        if len(changes) == map.version - self.version:
+            self.update_connections(changes)
+            self.version = map.version
+        else:
+            self.reset()
+
+    def compute_shortest_path(self):
+        g, rhs, keys, queue = self.g, self.rhs, self.keys, self.queue
+        destination = self.destination
+        expanded = 0
+        while queue:
+            key, station = queue[0]
+            if keys.get(station) != key:
+                # Stale entry, the station was pushed again or became consistent
+                heapq.heappop(queue)
+                continue
+            goal = g.get(destination, NO_ROUTE)
+            if key >= min(goal, rhs.get(destination, NO_ROUTE)) and goal == rhs.get(destination, NO_ROUTE):
+                break
+            heapq.heappop(queue)
+            del keys[station]
+            expanded += 1
+            if g.get(station, NO_ROUTE) > rhs.get(station, NO_ROUTE):
+                g[station] = rhs[station]
+            else:
+                g[station] = NO_ROUTE
+                self.update_station(station)
+            for following in self.successors[station]:
+                self.update_station(following)
+        return expanded
+
+    def route(self, stats=None):
+        """
+         Optimal route from origin to destination with the current costs of the map
+         Format of the parameter is:
+            Args:
+                stats (dict): If given, stats['expanded'] is increased by the number of stations expanded by this
+                              call, as the searches of SearchAlgorithm.py do
+            Returns:
+                path (Path Class): The route, [] when there is no route
+        """
+        self.synchronize()
+        expanded = self.compute_shortest_path()
+        self.expanded += expanded
+        if stats is not None:
+            stats['expanded'] = stats.get('expanded', 0) + expanded
+        if self.g.get(self.destination, NO_ROUTE) == NO_ROUTE:
+            return []
+
+        # Back from the destination through the predecessor that gives its cost
+        g = self.g
+        route = [self.destination]
+        while route[-1] != self.origin:
+            predecessors = self.predecessors[route[-1]]
+            route.append(min(predecessors, key=lambda previous: add(g.get(previous, NO_ROUTE), predecessors[previous])))
+        route.reverse()
+
+        path = Path(route[0])
+        for station_1, station_2 in zip(route, route[1:]):
+            path.add_route(station_2)
+            path.update_g(self.successors[station_1][station_2])
+        path.update_f()
+        return path
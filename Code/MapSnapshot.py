@@ -0,0 +1,170 @@
+# This file contains the routines to compile a CityInformation folder to a binary snapshot and to load it back.
+#
+# _________________________________________________________________________________________
+# Intel.ligencia Artificial
+# Curs 2023 - 2024
+# Universitat Autonoma de Barcelona
+# _______________________________________________________________________________________
+
+from SubwayMap import Map, CSRGraph, StationTable
+from utils import read_station_information, read_cost_graph, read_information
+import numpy as np
+import hashlib
+import json
+import os
+import sys
+
+SNAPSHOT_NAME = 'city.mapsnap'
+SOURCE_FILES = ('Stations.txt', 'Time.txt', 'InfoVelocity.txt')
+MAGIC = b'MAPSNAP1'
+ALIGNMENT = 64
+
+# Snapshot layout: MAGIC, length of the header (uint64), JSON header, and every array as raw bytes aligned to
+# ALIGNMENT. The header keeps the dtype, shape and offset of every array, so they can be memory-mapped.
+
+
+def file_signature(filename, with_hash=True):
+    stat = os.stat(filename)
+    signature = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+    if with_hash:
+        with open(filename, 'rb') as fp:
+            signature['sha1'] = hashlib.sha1(fp.read()).hexdigest()
+    return signature
+
+
+def compile_city(folder, snapshot=None):
+    """
+        Reads the text files of a CityInformation folder and writes them to a single binary snapshot
+        Format of the parameter is:
+        Args:
+            folder (str): CityInformation folder with Stations.txt, Time.txt and InfoVelocity.txt
+            snapshot (str): Snapshot file, by default SNAPSHOT_NAME inside the folder
+        Returns:
+            snapshot (str): The snapshot file that has been written
+    """
+    snapshot = snapshot or os.path.join(folder, SNAPSHOT_NAME)
+    stations_file, time_file, velocity_file = (os.path.join(folder, f) for f in SOURCE_FILES)
+    subway_map = read_station_information(stations_file)
+    # An edge list does not have the stations without connections, their number is the one of Stations.txt
+    graph = read_cost_graph(time_file, max(subway_map.stations, default=0))
+    velocity = read_information(velocity_file)
+
+    ids = sorted(subway_map.stations)
+    # Stations sharing a name are the same place on different lines: they form a transfer group
+    stations = subway_map.stations
+    names = stations.names
+    arrays = {
+        'ids': np.array(ids, dtype=np.int32),
+        'group': stations.column('group', ids),
+        'line': stations.column('line', ids),
+        'x': stations.column('x', ids),
+        'y': stations.column('y', ids),
+        'graph_ids': graph.ids,
+        'offsets': graph.offsets,
+        'neighbors': graph.neighbors_index,
+        'weights': graph.weights,
+        'velocity': np.array(velocity, dtype=np.int64),
+    }
+
+    header = {'names': names, 'arrays': {},
+              'sources': {f: file_signature(os.path.join(folder, f)) for f in SOURCE_FILES}}
+    offset = 0
+    for key, array in arrays.items():
+        header['arrays'][key] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    encoded = json.dumps(header).encode('utf-8')
+    start = -(-(len(MAGIC) + 8 + len(encoded)) // ALIGNMENT) * ALIGNMENT
+
+    tmp = snapshot + '.tmp'
+    with open(tmp, 'wb') as fp:
+        fp.write(MAGIC)
+        fp.write(np.uint64(len(encoded)).tobytes())
+        fp.write(encoded)
+        for key, array in arrays.items():
+            fp.seek(start + header['arrays'][key]['offset'])
+            fp.write(np.ascontiguousarray(array).tobytes())
+        fp.truncate(start + offset)
+    os.replace(tmp, snapshot)
+    return snapshot
+
+
+def read_header(snapshot):
+    with open(snapshot, 'rb') as fp:
+        if fp.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a map snapshot'.format(snapshot))
+        length = int(np.frombuffer(fp.read(8), dtype=np.uint64)[0])
+        header = json.loads(fp.read(length).decode('utf-8'))
+    header['start'] = -(-(len(MAGIC) + 8 + length) // ALIGNMENT) * ALIGNMENT
+    return header
+
+
+def is_fresh(folder, snapshot=None):
+    """
+        A snapshot is fresh when none of the source text files has changed since it was compiled. Files whose
+        mtime changed but whose content hash did not are still considered unchanged. A source file that does not
+        exist any more makes the snapshot stale.
+    """
+    snapshot = snapshot or os.path.join(folder, SNAPSHOT_NAME)
+    if not os.path.exists(snapshot):
+        return False
+    try:
+        sources = read_header(snapshot)['sources']
+    except ValueError:
+        return False
+    for filename, signature in sources.items():
+        try:
+            current = file_signature(os.path.join(folder, filename), with_hash=False)
+        except FileNotFoundError:
+            return False
+        if current['mtime_ns'] == signature['mtime_ns'] and current['size'] == signature['size']:
+            continue
+        if current['size'] != signature['size'] or \
+                file_signature(os.path.join(folder, filename))['sha1'] != signature['sha1']:
+            return False
+    return True
+
+
+def map_arrays(snapshot, header=None):
+    # Memory-maps every array of the snapshot, nothing is read until the arrays are used
+    header = header or read_header(snapshot)
+    arrays = {}
+    for key, info in header['arrays'].items():
+        shape = tuple(info['shape'])
+        if int(np.prod(shape)) == 0:
+            arrays[key] = np.empty(shape, dtype=info['dtype'])
+        else:
+            arrays[key] = np.memmap(snapshot, dtype=info['dtype'], mode='r',
+                                    offset=header['start'] + info['offset'], shape=shape)
+    return arrays
+
+
+def load_city(folder, snapshot=None):
+    """
+        Loads the Map of a CityInformation folder from its binary snapshot. The snapshot is compiled first when it
+        does not exist or when the text files have changed.
+        Format of the parameter is:
+        Args:
+            folder (str): CityInformation folder with Stations.txt, Time.txt and InfoVelocity.txt
+            snapshot (str): Snapshot file, by default SNAPSHOT_NAME inside the folder
+        Returns:
+            subway_map (object of Map class): The map, with its connections stored as a memory-mapped CSRGraph
+    """
+    snapshot = snapshot or os.path.join(folder, SNAPSHOT_NAME)
+    if not is_fresh(folder, snapshot):
+        compile_city(folder, snapshot)
+    header = read_header(snapshot)
+    arrays = map_arrays(snapshot, header)
+
+    subway_map = Map()
+    subway_map.set_stations(StationTable.from_arrays(arrays['ids'], header['names'], arrays['group'], arrays['line'],
+                                                     arrays['x'], arrays['y']))
+    subway_map.add_connection(CSRGraph(arrays['graph_ids'], arrays['offsets'], arrays['neighbors'],
+                                       arrays['weights']))
+    subway_map.add_velocity(arrays['velocity'].tolist())
+    return subway_map
+
+
+if __name__ == "__main__":
+    # python MapSnapshot.py ../CityInformation/Lyon_smallCity/ ../CityInformation/Lyon_bigCity/
+    for city_folder in sys.argv[1:]:
+        print(compile_city(city_folder))
@@ -0,0 +1,81 @@
+# This file contains a cache of the routes computed on a map.
+#
+# _________________________________________________________________________________________
+# Intel.ligencia Artificial
+# Curs 2023 - 2024
+# Universitat Autonoma de Barcelona
+# _______________________________________________________________________________________
+
+from SubwayMap import Path
+from SearchAlgorithm import run_search
+from collections import OrderedDict
+
+
+class RouteCache:
+    """
+    A bounded LRU cache of the routes of one map, keyed by (origin_id, destination_id, type_preference, algorithm).
+    The cache is emptied as soon as map.version changes (add_station, add_connection, add_velocity), so a route
+    computed with an older version of the map is never returned.
+    Routes are kept as tuples and every call returns a new Path, so the Path returned can be modified
+    (update_g, add_route, ...) without changing the cache.
+    Usage:
+        # >>> cache = RouteCache(map, maxsize=1024)
+        # >>> path = cache.route(9, 3, type_preference=1)
+        # >>> cache.stats()
+    """
+
+    def __init__(self, map, maxsize=1024):
+        self.map = map
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.version = map.version
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+        self.version = self.map.version
+
+    def route(self, origin_id, destination_id, type_preference=0, algorithm='Astar'):
+        """
+         Route from origin_id to destination_id, computed with run_search only when it is not cached
+         Format of the parameter is:
+            Args:
+                origin_id (int): Starting station id
+                destination_id (int): Final station id
+                type_preference: INTEGER Value to indicate the preference selected
+                algorithm (str): Name of the search in SEARCH_ALGORITHMS
+            Returns:
+                path (Path Class): A new copy of the route, [] when there is no route
+        """
+        if self.map.version != self.version:
+            self.invalidations += 1
+            self.clear()
+        key = (origin_id, destination_id, type_preference, algorithm)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            entry = self.entries[key]
+        else:
+            self.misses += 1
+            path = run_search(algorithm, origin_id, destination_id, self.map, type_preference)
+            entry = (tuple(path.route), path.g, path.h, path.f) if isinstance(path, Path) else None
+            self.entries[key] = entry
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        if entry is None:
+            return []
+        route, g, h, f = entry
+        path = Path(list(route))
+        path.g, path.h, path.f = g, h, f
+        return path
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'invalidations': self.invalidations, 'size': len(self.entries), 'maxsize': self.maxsize}
@@ -0,0 +1,143 @@
+# This file contains the routines to precompute the routes between every pair of stations of a map.
+#
+# _________________________________________________________________________________________
+# Intel.ligencia Artificial
+# Curs 2023 - 2024
+# Universitat Autonoma de Barcelona
+# _______________________________________________________________________________________
+
+from SubwayMap import Path
+from SearchAlgorithm import calculate_edge_costs
+import numpy as np
+
+
+class RouteTable:
+    """
+    The optimal routes between every pair of stations of a map for one type preference.
+
+    self.ids: int32 array with the station id of every index (the indices of map.graph)
+    self.cost: N x N float64 matrix, cost[i][j] is the cost of the optimal route from index i to index j
+    self.hops: N x N float64 matrix with the number of connections of that route
+    self.next_hop: N x N int32 matrix, next_hop[i][j] is the index of the station that follows i in the
+            route from i to j (-1 when j can not be reached from i)
+    self.step_cost: N x N float64 matrix with the cost of every single connection, used to fill the g of
+            the routes exactly as calculate_cost does
+    Usage:
+        # >>> table = precompute_route_table(map, type_preference=1)
+        # >>> path = table.route(9, 3)
+    """
+
+    def __init__(self, ids, cost, hops, next_hop, step_cost, type_preference):
+        self.ids = np.asarray(ids, dtype=np.int32)
+        self.cost = cost
+        self.hops = hops
+        self.next_hop = np.asarray(next_hop, dtype=np.int32)
+        self.step_cost = step_cost
+        self.type_preference = type_preference
+        self.index = {station: ix for ix, station in enumerate(self.ids.tolist())}
+
+    def route(self, origin_id, destination_id):
+        """
+         Optimal route from origin_id to destination_id, rebuilt in O(route length) from the next hops
+         Format of the parameter is:
+            Args:
+                origin_id (int): Starting station id
+                destination_id (int): Final station id
+            Returns:
+                path (Path Class): The route that goes from origin_id to destination_id, [] if there is none
+        """
+        i, j = self.index[origin_id], self.index[destination_id]
+        if self.next_hop[i, j] < 0:
+            return []
+        path = Path([origin_id])
+        while i != j:
+            k = self.next_hop[i, j]
+            path.add_route(int(self.ids[k]))
+            path.update_g(self.step_cost[i, k])
+            i = k
+        path.update_f()
+        return path
+
+
+def precompute_route_table(map, type_preference=0):
+    """
+     Floyd-Warshall over map.graph, vectorized with NumPy: one N x N update per intermediate station.
+     Routes with the same cost are broken by the number of connections, so for the same cost the route with
+     less stations is kept.
+     Format of the parameter is:
+        Args:
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected:
+                            0 - Adjacency
+                            1 - minimum Time
+                            2 - minimum Distance
+                            3 - minimum Transfers
+        Returns:
+            table (RouteTable Class): The routes between every pair of stations
+    """
+    graph = map.graph
+    n = len(graph)
+    sources = np.repeat(np.arange(n), np.diff(graph.offsets))
+    targets = graph.neighbors_index
+    costs = calculate_edge_costs(map, type_preference)
+
+    step_cost = np.full((n, n), np.inf)
+    step_cost[sources, targets] = costs
+    cost = step_cost.copy()
+    hops = np.full((n, n), np.inf)
+    hops[sources, targets] = 1
+    next_hop = np.full((n, n), -1, dtype=np.int32)
+    next_hop[sources, targets] = targets
+    diagonal = np.arange(n)
+    cost[diagonal, diagonal] = 0
+    hops[diagonal, diagonal] = 0
+    next_hop[diagonal, diagonal] = diagonal
+
+    for k in range(n):
+        new_cost = cost[:, k, None] + cost[None, k, :]
+        new_hops = hops[:, k, None] + hops[None, k, :]
+        better = (new_cost < cost) | ((new_cost == cost) & (new_hops < hops))
+        cost = np.where(better, new_cost, cost)
+        hops = np.where(better, new_hops, hops)
+        next_hop = np.where(better, next_hop[:, k, None], next_hop)
+
+    return RouteTable(graph.ids, cost, hops, next_hop, step_cost, type_preference)
+
+
+def precompute_route_tables(map, type_preferences=(0, 1, 2, 3)):
+    # precompute_route_tables: A RouteTable for every type preference, {type_preference: table}
+    return {type_preference: precompute_route_table(map, type_preference) for type_preference in type_preferences}
+
+
+def route_query(origin_id, destination_id, tables, type_preference=0):
+    """
+     Answers a station to station query from the precomputed tables instead of running a search
+     Format of the parameter is:
+        Args:
+            origin_id (int): Starting station id
+            destination_id (int): Final station id
+            tables (dict): {type_preference: RouteTable}, as returned by precompute_route_tables
+            type_preference: INTEGER Value to indicate the preference selected
+        Returns:
+            path (Path Class): The route that goes from origin_id to destination_id, with g and f filled
+    """
+    return tables[type_preference].route(origin_id, destination_id)
+
+
+def save_route_tables(tables, filename):
+    arrays = {}
+    for type_preference, table in tables.items():
+        arrays['ids_{}'.format(type_preference)] = table.ids
+        arrays['cost_{}'.format(type_preference)] = table.cost
+        arrays['hops_{}'.format(type_preference)] = table.hops
+        arrays['next_hop_{}'.format(type_preference)] = table.next_hop
+        arrays['step_cost_{}'.format(type_preference)] = table.step_cost
+    np.savez(filename, **arrays)
+
+
+def load_route_tables(filename):
+    with np.load(filename) as arrays:
+        type_preferences = sorted(int(key.split('_')[-1]) for key in arrays.files if key.startswith('ids_'))
+        return {p: RouteTable(arrays['ids_{}'.format(p)], arrays['cost_{}'.format(p)], arrays['hops_{}'.format(p)],
+                              arrays['next_hop_{}'.format(p)], arrays['step_cost_{}'.format(p)], p)
+                for p in type_preferences}
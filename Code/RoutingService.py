@@ -0,0 +1,299 @@
+# This file contains a local HTTP/JSON routing service that keeps a city loaded between requests.
+#
+# _________________________________________________________________________________________
+# Intel.ligencia Artificial
+# Curs 2023 - 2024
+# Universitat Autonoma de Barcelona
+# _______________________________________________________________________________________
+
+from SearchAlgorithm import Astar_improved
+from MapSnapshot import compile_city, is_fresh
+from SubwayMap import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+import BatchRouting
+import argparse
+import asyncio
+import bisect
+import json
+import time
+
+STATION_ALGORITHMS = ('Astar', 'uniform_cost_search')
+# Upper bounds (seconds) of the buckets of the latency histograms, the last bucket has no bound
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5)
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 408: 'Request Timeout',
+               413: 'Payload Too Large', 500: 'Internal Server Error'}
+# Limits of a request: bytes of the body, number of header lines and seconds to read it whole
+MAX_BODY = 1 << 16
+MAX_HEADERS = 100
+READ_TIMEOUT = 10
+
+
+def route_coordinates(origin_coord, destination_coord):
+    # Runs in the workers of the service, with the map loaded by BatchRouting.init_worker
+    return Astar_improved(origin_coord, destination_coord, BatchRouting.WORKER_MAP)
+
+
+class LatencyHistogram:
+    """
+    Number of observations of every bucket of LATENCY_BUCKETS, with their count and sum
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def as_dict(self):
+        bounds = [str(bound) for bound in LATENCY_BUCKETS] + ['inf']
+        return {'buckets': dict(zip(bounds, self.buckets)), 'count': self.count, 'sum': self.sum}
+
+
+class RequestError(Exception):
+    # Error of a request, answered with its HTTP status
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class RoutingService:
+    """
+    An asyncio HTTP/JSON service that loads a CityInformation city once and answers routing requests:
+        GET /route?origin=9&destination=4&type_preference=1&algorithm=Astar
+            algorithm is Astar (default) or uniform_cost_search
+        GET /route_coordinates?origin=80,100&destination=100,240
+            Astar_improved between two coordinates
+        GET /metrics
+            Counters and latency histograms of the requests and of the searches
+    The parameters can also be sent with POST as a JSON object, of at most max_body bytes. A request that is not
+    read whole in read_timeout seconds is answered with 408. The searches run in an executor (a pool of processes
+    initialized with BatchRouting.init_worker by default), so the event loop keeps answering while they run.
+    Identical requests that arrive while the first one is being computed wait for its result instead of computing
+    it again.
+    Usage:
+        # >>> asyncio.run(serve('../CityInformation/Lyon_bigCity', port=8080))
+        # $ curl 'http://127.0.0.1:8080/route?origin=9&destination=4&type_preference=1'
+    """
+
+    def __init__(self, city_folder, max_workers=None, processes=True, max_body=MAX_BODY, read_timeout=READ_TIMEOUT):
+        # The snapshot is compiled here once instead of by every worker
+        if not is_fresh(city_folder):
+            compile_city(city_folder)
+        BatchRouting.init_worker(city_folder)
+        self.map = BatchRouting.WORKER_MAP
+        if processes:
+            self.executor = ProcessPoolExecutor(max_workers=max_workers, initializer=BatchRouting.init_worker,
+                                                initargs=(city_folder,))
+            # The workers are started now: forked later, they would keep open the sockets of the connections
+            # accepted before, and closing a connection would not end it
+            self.executor.submit(int).result()
+        else:
+            # The threads share the map of this process
+            self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.max_body = max_body
+        self.read_timeout = read_timeout
+        self.in_flight = {}
+        self.latency = {}
+        self.search_latency = LatencyHistogram()
+        self.counters = {'requests': 0, 'searches': 0, 'coalesced': 0, 'errors': 0}
+
+    def close(self):
+        self.executor.shutdown()
+
+    async def compute(self, key, function, *args):
+        # Result of function(*args) in the executor, shared by all the identical requests in flight
+        if key in self.in_flight:
+            self.counters['coalesced'] += 1
+            return await asyncio.shield(self.in_flight[key])
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        future = loop.run_in_executor(self.executor, function, *args)
+        self.in_flight[key] = future
+        self.counters['searches'] += 1
+        try:
+            return await asyncio.shield(future)
+        finally:
+            del self.in_flight[key]
+            self.search_latency.observe(time.perf_counter() - start)
+
+    async def route(self, origin_id, destination_id, type_preference=0, algorithm='Astar'):
+        """
+         Route between two stations
+         Format of the parameter is:
+            Args:
+                origin_id (int): Starting station id
+                destination_id (int): Final station id
+                type_preference: INTEGER Value to indicate the preference selected
+                algorithm (str): 'Astar' or 'uniform_cost_search'
+            Returns:
+                path (Path Class): The route, [] when there is no route
+        """
+        if algorithm not in STATION_ALGORITHMS:
+            raise RequestError(400, 'Unknown algorithm {}, use one of {}'.format(algorithm, list(STATION_ALGORITHMS)))
+        for station in (origin_id, destination_id):
+            if station not in self.map.stations:
+                raise RequestError(400, 'Unknown station {}'.format(station))
+        if type_preference not in (0, 1, 2, 3):
+            raise RequestError(400, 'Unknown type_preference {}'.format(type_preference))
+        key = ('route', origin_id, destination_id, type_preference, algorithm)
+        [(_, path)] = await self.compute(key, BatchRouting.route_chunk,
+                                         [(0, origin_id, destination_id, type_preference)], algorithm)
+        return path
+
+    async def route_coordinates(self, origin_coord, destination_coord):
+        """
+         Route between two coordinates with Astar_improved
+         Format of the parameter is:
+            Args:
+                origin_coord (list): Two REAL values, which refer to the coordinates of the starting position
+                destination_coord (list): Two REAL values, which refer to the coordinates of the final position
+            Returns:
+                path (Path Class): The route, whose first station is 0 (origin) and last one -1 (destination)
+        """
+        key = ('route_coordinates', tuple(origin_coord), tuple(destination_coord))
+        return await self.compute(key, route_coordinates, list(origin_coord), list(destination_coord))
+
+    def metrics(self):
+        return dict(self.counters, in_flight=len(self.in_flight), search_latency=self.search_latency.as_dict(),
+                    latency={endpoint: histogram.as_dict() for endpoint, histogram in self.latency.items()})
+
+    async def answer(self, method, target, body):
+        # JSON answer of a request
+        url = urlsplit(target)
+        params = dict(parse_qsl(url.query))
+        if method == 'POST' and body:
+            try:
+                values = json.loads(body)
+            except ValueError:
+                values = None
+            if not isinstance(values, dict):
+                raise RequestError(400, 'The body is not a JSON object')
+            params.update(values)
+        elif method not in ('GET', 'POST'):
+            raise RequestError(405, 'Use GET or POST')
+
+        if url.path == '/metrics':
+            return self.metrics()
+        if url.path == '/route':
+            try:
+                origin, destination = int(params['origin']), int(params['destination'])
+                type_preference = int(params.get('type_preference', 0))
+            except (KeyError, ValueError, TypeError):
+                raise RequestError(400, 'origin, destination and type_preference must be integers')
+            algorithm = params.get('algorithm', 'Astar')
+            path = await self.route(origin, destination, type_preference, algorithm)
+            return {'algorithm': algorithm, 'origin': origin, 'destination': destination,
+                    'type_preference': type_preference, **path_as_dict(path)}
+        if url.path == '/route_coordinates':
+            try:
+                origin, destination = parse_coord(params['origin']), parse_coord(params['destination'])
+            except (KeyError, ValueError, TypeError):
+                raise RequestError(400, 'origin and destination must be two numbers, such as 80,100')
+            path = await self.route_coordinates(origin, destination)
+            return {'origin': origin, 'destination': destination, **path_as_dict(path)}
+        raise RequestError(404, 'Unknown path {}'.format(url.path))
+
+    async def read_request(self, reader):
+        # (method, target, body) of the next request
+        request_line = (await reader.readline()).decode('latin-1').split()
+        if len(request_line) != 3:
+            raise RequestError(400, 'Bad request line')
+        method, target, _ = request_line
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            if len(headers) == MAX_HEADERS:
+                raise RequestError(400, 'More than {} headers'.format(MAX_HEADERS))
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if not 0 <= length <= self.max_body:
+            raise RequestError(413 if length > 0 else 400, 'The body must have at most {} bytes'.format(self.max_body))
+        return method, target, await reader.readexactly(length)
+
+    async def handle(self, reader, writer):
+        # One HTTP/1.1 request per connection
+        start = time.perf_counter()
+        endpoint = None
+        try:
+            try:
+                method, target, body = await asyncio.wait_for(self.read_request(reader), self.read_timeout)
+            except asyncio.TimeoutError:
+                raise RequestError(408, 'The request was not read in {} seconds'.format(self.read_timeout))
+            endpoint = urlsplit(target).path
+            self.counters['requests'] += 1
+            status, answer = 200, await self.answer(method, target, body)
+        except RequestError as error:
+            status, answer = error.status, {'error': str(error)}
+        except (ValueError, asyncio.IncompleteReadError) as error:
+            status, answer = 400, {'error': str(error)}
+        except Exception as error:
+            status, answer = 500, {'error': repr(error)}
+        if status != 200:
+            self.counters['errors'] += 1
+
+        content = json.dumps(answer).encode('utf-8')
+        writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n'
+                     'Connection: close\r\n\r\n'.format(status, STATUS_TEXT[status], len(content)).encode('latin-1'))
+        writer.write(content)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            # The client is gone
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+        if endpoint in ('/route', '/route_coordinates', '/metrics'):
+            self.latency.setdefault(endpoint, LatencyHistogram()).observe(time.perf_counter() - start)
+
+    async def start(self, host='127.0.0.1', port=8080):
+        return await asyncio.start_server(self.handle, host, port)
+
+
+def parse_coord(value):
+    # '80,100' or [80, 100]
+    values = value.split(',') if isinstance(value, str) else value
+    x, y = (float(v) for v in values)
+    return [x, y]
+
+
+def path_as_dict(path):
+    if isinstance(path, Path):
+        return {'route': [int(station) for station in path.route], 'cost': float(path.g)}
+    return {'route': None, 'cost': None}
+
+
+async def serve(city_folder, host='127.0.0.1', port=8080, max_workers=None):
+    service = RoutingService(city_folder, max_workers)
+    server = await service.start(host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='HTTP/JSON routing service of a CityInformation city')
+    parser.add_argument('city_folder')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes, by default the number of CPUs')
+    arguments = parser.parse_args(arguments)
+    asyncio.run(serve(arguments.city_folder, arguments.host, arguments.port, arguments.workers))
+
+
+if __name__ == "__main__":
+    # python RoutingService.py ../CityInformation/Lyon_bigCity/ --port 8080
+    main()
@@ -10,9 +10,16 @@ __author__ = '1665571'
 
 from SubwayMap import *
 from utils import *
+from SpatialIndex import spatial_index
 import os
 import math
 import copy
+import heapq
+import itertools
+import numpy as np
+import time
+from collections import deque, namedtuple
+from array import array
 
 
 def expand(path, map):
@@ -26,11 +33,9 @@ def expand(path, map):
             path_list (list): List of paths that are connected to the given path.
     """
     path_list=[]
-    for key in map.connections[path.last].keys():
-        auxPath=Path(list(path.route))
-        auxPath.g=path.g
-        auxPath.add_route(key)
-        path_list.append(auxPath)
+    for key in map.neighbors(path.last):
+        #Path copia la ruta, LinkedPath solo enlaza con el camino padre
+        path_list.append(path.extend(key))
         
     return path_list
 
@@ -46,15 +51,170 @@ def remove_cycles(path_list):
     """
     noCycleList=[]
     for path in path_list:
-        cicle=False
-        for valor in path.route:
-            if path.route.count(valor) > 1:
-                cicle=True
-        if not cicle:
+        if not path.has_cycle():
             noCycleList.append(path)
     return noCycleList
 
 
+# Event yielded by the search generators (iter_depth_first_search, iter_breadth_first_search,
+# iter_uniform_cost_search and iter_Astar):
+#   kind: 'expanded' after a path is expanded, 'incumbent' when a better route to the destination is generated
+#         and 'goal' when the search finishes
+#   path: the path expanded, the new incumbent, or the route found by the search (None if there is none)
+#   expanded: number of paths expanded so far
+#   frontier: number of paths in the frontier
+#   incumbent: best route to the destination generated so far, by (g, len), None until there is one
+SearchEvent=namedtuple('SearchEvent', ['kind', 'path', 'expanded', 'frontier', 'incumbent'])
+
+
+def as_path(path):
+    # The Path of a LinkedPath, the hooks of SearchStats get one single type
+    if isinstance(path, LinkedPath):
+        return path.to_path()
+    return path
+
+
+class SearchStats(dict):
+    """
+    Counters and timers of a search, passed as stats to depth_first_search, breadth_first_search,
+    uniform_cost_search, Astar or Astar_improved (only some counters, see Astar_improved). The searches that take
+    a dict (bidirectional_search, pareto_search, ...) fill in their own keys. The searches only measure what they
+    can when they get a SearchStats, with a plain dict or None they run as before.
+        expanded: paths expanded
+        cycles: paths dropped by remove_cycles
+        redundant: paths dropped by remove_redundant_paths, or dropped from the frontier because a cheaper path to
+                   their station was found later
+        frontier_peak: largest number of paths in the frontier
+        cost_time, heuristic_time: seconds spent in calculate_cost and in the heuristics (with vectorized=True,
+                   expand_vectorized computes both and its time goes to cost_time)
+    The hooks, if given, are called as on_expand(path), on_prune(path, reason) with reason 'cycles' or
+    'redundant', and on_goal(path) with the route found, None if there is none. They always get a Path, also
+    from the searches that work with LinkedPath.
+    Usage:
+        # >>> stats = SearchStats(on_prune=lambda path, reason: print(path.route, reason))
+        # >>> path = Astar(9, 4, map, 1, stats=stats)
+        # >>> stats['expanded'], stats['redundant'], stats['cost_time']
+    """
+
+    def __init__(self, on_expand=None, on_prune=None, on_goal=None):
+        super().__init__(expanded=0, cycles=0, redundant=0, frontier_peak=0, cost_time=0.0, heuristic_time=0.0)
+        self.on_expand=on_expand
+        self.on_prune=on_prune
+        self.on_goal=on_goal
+
+    def record(self, event):
+        # Called with every SearchEvent of the search
+        if event.frontier > self['frontier_peak']:
+            self['frontier_peak']=event.frontier
+        if event.kind=='expanded' and self.on_expand is not None:
+            self.on_expand(as_path(event.path))
+        elif event.kind=='goal' and self.on_goal is not None:
+            self.on_goal(as_path(event.path))
+
+    def pruned(self, path, reason):
+        self[reason]+=1
+        if self.on_prune is not None:
+            self.on_prune(as_path(path), reason)
+
+    def timed(self, key, function):
+        # function, adding the time of every call to self[key]
+        def timed_function(*args):
+            start=time.perf_counter()
+            result=function(*args)
+            self[key]+=time.perf_counter() - start
+            return result
+        return timed_function
+
+    def remove_cycles(self, path_list):
+        noCycleList=remove_cycles(path_list)
+        if len(noCycleList) < len(path_list):
+            for path in path_list:
+                if path.has_cycle():
+                    self.pruned(path, 'cycles')
+        return noCycleList
+
+    def remove_redundant_paths(self, expand_paths, list_of_path, visited_stations_cost):
+        before=list(expand_paths) + list(list_of_path)
+        result=remove_redundant_paths(expand_paths, list_of_path, visited_stations_cost)
+        if len(expand_paths) + len(list_of_path) < len(before):
+            kept=set(map(id, expand_paths)) | set(map(id, list_of_path))
+            for path in before:
+                if id(path) not in kept:
+                    self.pruned(path, 'redundant')
+        return result
+
+    def is_stale(self, is_stale):
+        # is_stale, counting the paths it drops from the frontier as redundant
+        def counted_is_stale(path):
+            if is_stale(path):
+                self.pruned(path, 'redundant')
+                return True
+            return False
+        return counted_is_stale
+
+
+def best_incumbent(expand_paths, destination_id, incumbent):
+    # The best of incumbent and the paths of expand_paths that reach the destination, by (g, len)
+    for path in expand_paths:
+        if path.last==destination_id and (incumbent is None or (path.g, len(path)) < (incumbent.g, len(incumbent))):
+            incumbent=path
+    return incumbent
+
+
+def search_result(events, stats=None):
+    """
+     Runs a search generator until it finishes
+     Format of the parameter is:
+        Args:
+            events (generator): SearchEvent generator, e.g. iter_Astar(...)
+            stats (dict): If given, stats['expanded'] is increased by the number of paths expanded. A SearchStats
+                          also records every event
+        Returns:
+            path (Path Class): The route found by the search, [] if there is none
+    """
+    if isinstance(stats, SearchStats):
+        for event in events:
+            stats.record(event)
+    else:
+        for event in events:
+            pass
+    if stats is not None:
+        stats['expanded']=stats.get('expanded', 0) + event.expanded
+    if event.path is not None:
+        return event.path.to_path()
+    else:
+        return []
+
+
+def anytime_search(events, time_budget=None, max_expansions=None):
+    """
+     Runs a search generator until it finishes or until a budget is spent. In the second case the search is
+     stopped and the best route to the destination generated so far is returned. The search is stopped before
+     the expansion max_expansions + 1, or at the first event after time_budget seconds.
+     Format of the parameter is:
+        Args:
+            events (generator): SearchEvent generator, e.g. iter_Astar(...)
+            time_budget (float): Maximum number of seconds
+            max_expansions (int): Maximum number of paths expanded
+        Returns:
+            path (Path Class): The route found, or the best incumbent, [] if there is none
+            finished (bool): True if the search finished, so path is the route the search returns
+    """
+    start=time.perf_counter()
+    incumbent=None
+    for event in events:
+        if event.kind=='goal':
+            return (event.path.to_path() if event.path is not None else []), True
+        if max_expansions is not None and event.expanded > max_expansions:
+            events.close()
+            break
+        incumbent=event.incumbent
+        if time_budget is not None and time.perf_counter() - start >= time_budget:
+            events.close()
+            break
+    return (incumbent.to_path() if incumbent is not None else []), False
+
+
 def insert_depth_first_search(expand_paths, list_of_path):
     """
      expand_paths is inserted to the list_of_path according to DEPTH FIRST SEARCH algorithm
@@ -68,7 +228,7 @@ def insert_depth_first_search(expand_paths, list_of_path):
     return expand_paths + list_of_path
 
 
-def depth_first_search(origin_id, destination_id, map):
+def depth_first_search(origin_id, destination_id, map, stats=None):
     """
      Depth First Search algorithm
      Format of the parameter is:
@@ -76,21 +236,44 @@ def depth_first_search(origin_id, destination_id, map):
             origin_id (int): Starting station id
             destination_id (int): Final station id
             map (object of Map class): All the map information
+            stats (SearchStats): If given, the counters, timers and hooks of the search
         Returns:
             list_of_path[0] (Path Class): the route that goes from origin_id to destination_id
     """
-    stack=[Path([origin_id])]
+    return search_result(iter_depth_first_search(origin_id, destination_id, map, stats), stats)
+
+
+def iter_depth_first_search(origin_id, destination_id, map, stats=None):
+    """
+     Depth First Search algorithm, as a generator of SearchEvent
+     Format of the parameter is:
+        Args:
+            origin_id (int): Starting station id
+            destination_id (int): Final station id
+            map (object of Map class): All the map information
+            stats (SearchStats): If given, it counts the paths dropped by remove_cycles
+        Returns:
+            (generator): SearchEvent after every expansion and new incumbent, and a last 'goal' event
+    """
+    removeCycles=stats.remove_cycles if isinstance(stats, SearchStats) else remove_cycles
+    stack=[LinkedPath(origin_id)]
+    expanded=0
+    incumbent=None
     while len(stack)>0 and stack[0].last!=destination_id:
             head=stack[0]
             expanded_paths=expand(head, map)
-            expanded_paths=remove_cycles(expanded_paths)
+            expanded_paths=removeCycles(expanded_paths)
             stack.remove(stack[0])
             stack=insert_depth_first_search(expanded_paths, stack)
-        
-    if len(stack)>0:
-        return stack[0]
-    else:
-        return []
+            expanded+=1
+            yield SearchEvent('expanded', head, expanded, len(stack), incumbent)
+            best=best_incumbent(expanded_paths, destination_id, incumbent)
+            if best is not incumbent:
+                incumbent=best
+                yield SearchEvent('incumbent', incumbent, expanded, len(stack), incumbent)
+
+    route=stack[0] if len(stack)>0 else None
+    yield SearchEvent('goal', route, expanded, len(stack), route if route is not None else incumbent)
 
 
 def insert_breadth_first_search(expand_paths, list_of_path):
@@ -106,7 +289,7 @@ def insert_breadth_first_search(expand_paths, list_of_path):
     return list_of_path + expand_paths
 
 
-def breadth_first_search(origin_id, destination_id, map):
+def breadth_first_search(origin_id, destination_id, map, stats=None):
     """
      Breadth First Search algorithm
      Format of the parameter is:
@@ -114,21 +297,44 @@ def breadth_first_search(origin_id, destination_id, map):
             origin_id (int): Starting station id
             destination_id (int): Final station id
             map (object of Map class): All the map information
+            stats (SearchStats): If given, the counters, timers and hooks of the search
         Returns:
             list_of_path[0] (Path Class): The route that goes from origin_id to destination_id
     """
-    queue=[Path([origin_id])]
+    return search_result(iter_breadth_first_search(origin_id, destination_id, map, stats), stats)
+
+
+def iter_breadth_first_search(origin_id, destination_id, map, stats=None):
+    """
+     Breadth First Search algorithm, as a generator of SearchEvent
+     Format of the parameter is:
+        Args:
+            origin_id (int): Starting station id
+            destination_id (int): Final station id
+            map (object of Map class): All the map information
+            stats (SearchStats): If given, it counts the paths dropped by remove_cycles
+        Returns:
+            (generator): SearchEvent after every expansion and new incumbent, and a last 'goal' event
+    """
+    removeCycles=stats.remove_cycles if isinstance(stats, SearchStats) else remove_cycles
+    queue=[LinkedPath(origin_id)]
+    expanded=0
+    incumbent=None
     while len(queue)>0 and queue[0].last!=destination_id:
             head=queue[0]
             expanded_paths=expand(head, map)
-            expanded_paths=remove_cycles(expanded_paths)
+            expanded_paths=removeCycles(expanded_paths)
             queue.remove(queue[0])
             queue=insert_breadth_first_search(expanded_paths, queue)
-            
-    if len(queue)>0:
-        return queue[0]
-    else:
-        return []
+            expanded+=1
+            yield SearchEvent('expanded', head, expanded, len(queue), incumbent)
+            best=best_incumbent(expanded_paths, destination_id, incumbent)
+            if best is not incumbent:
+                incumbent=best
+                yield SearchEvent('incumbent', incumbent, expanded, len(queue), incumbent)
+
+    route=queue[0] if len(queue)>0 else None
+    yield SearchEvent('goal', route, expanded, len(queue), route if route is not None else incumbent)
 
 
 def calculate_cost(expand_paths, map, type_preference=0):
@@ -154,18 +360,68 @@ def calculate_cost(expand_paths, map, type_preference=0):
             path.update_g(map.connections[path.penultimate][path.last])
             
         if type_preference == 2:
-            transfer = map.stations[path.penultimate]['name'] == map.stations[path.last]['name']
+            transfer = map.is_transfer(path.penultimate, path.last)
             if not transfer:
                 path.update_g(map.connections[path.penultimate][path.last] * map.stations[path.penultimate]['velocity']) #Tiempo * velocidad = Espacio
           
     
         if type_preference == 3:
-            transfer = map.stations[path.penultimate]['name'] == map.stations[path.last]['name']
+            transfer = map.is_transfer(path.penultimate, path.last)
             if transfer:
                 path.update_g(1)    
 
     return expand_paths
 
+
+def transfer_flags(map):
+    """
+         For every connection of map.graph, whether it is a transfer (both stations share the same name)
+         Format of the parameter is:
+            Args:
+                map (object of Map class): All the map information
+            Returns:
+                (numpy array of bool): One value per connection, in the order of map.graph.neighbors_index
+    """
+    if 'transfer_flags' not in map.precomputed:
+        graph=map.graph
+        group=map.stations.column('group', graph.ids.tolist())
+        sources=np.repeat(np.arange(len(graph)), np.diff(graph.offsets))
+        map.precomputed['transfer_flags']=group[sources]==group[graph.neighbors_index]
+    return map.precomputed['transfer_flags']
+
+
+def calculate_edge_costs(map, type_preference=0):
+    """
+         Vectorized version of calculate_cost: the cost of every connection according to type preference
+         Format of the parameter is:
+            Args:
+                map (object of Map class): All the map information
+                type_preference: INTEGER Value to indicate the preference selected:
+                                0 - Adjacency
+                                1 - minimum Time
+                                2 - minimum Distance
+                                3 - minimum Transfers
+            Returns:
+                (numpy array of float): Cost of every connection, in the order of map.graph.neighbors_index
+    """
+    key=('edge_costs', type_preference)
+    if key not in map.precomputed:
+        graph=map.graph
+        transfer=transfer_flags(map)
+        if type_preference == 0:
+            costs=np.ones(len(graph.weights))
+        elif type_preference == 1:
+            costs=np.array(graph.weights, dtype=np.float64)
+        elif type_preference == 2:
+            velocity=map.stations.column('velocity', graph.ids.tolist())
+            sources=np.repeat(np.arange(len(graph)), np.diff(graph.offsets))
+            costs=np.where(transfer, 0.0, graph.weights * velocity[sources])
+        else:
+            costs=transfer.astype(np.float64)
+        map.precomputed[key]=costs
+    return map.precomputed[key]
+
+
 def insert_cost(expand_paths, list_of_path):
     """
         expand_paths is inserted to the list_of_path according to COST VALUE
@@ -177,12 +433,12 @@ def insert_cost(expand_paths, list_of_path):
                list_of_path (LIST of Path Class): List of Paths where expanded_path is inserted according to cost
     """
     auxList=expand_paths+list_of_path
-    auxList=sorted(auxList, key=lambda x:(x.g, len(x.route)))
+    auxList=sorted(auxList, key=lambda x:(x.g, len(x)))
     return auxList
 
  
 
-def uniform_cost_search(origin_id, destination_id, map, type_preference=0):
+def uniform_cost_search(origin_id, destination_id, map, type_preference=0, stats=None):
     """
      Uniform Cost Search algorithm
      Format of the parameter is:
@@ -195,24 +451,50 @@ def uniform_cost_search(origin_id, destination_id, map, type_preference=0):
                             1 - minimum Time
                             2 - minimum Distance
                             3 - minimum Transfers
+            stats (SearchStats): If given, the counters, timers and hooks of the search
         Returns:
             list_of_path[0] (Path Class): The route that goes from origin_id to destination_id
     """
-    pathList=[Path([origin_id])]
-    while len(pathList)>0 and pathList[0].last!=destination_id:
-            head=pathList[0]
+    return search_result(iter_uniform_cost_search(origin_id, destination_id, map, type_preference, stats), stats)
+
+
+def iter_uniform_cost_search(origin_id, destination_id, map, type_preference=0, stats=None):
+    """
+     Uniform Cost Search algorithm, as a generator of SearchEvent
+     Format of the parameter is:
+        Args:
+            origin_id (int): Starting station id
+            destination_id (int): Final station id
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected
+            stats (SearchStats): If given, it counts the paths dropped by remove_cycles and times calculate_cost
+        Returns:
+            (generator): SearchEvent after every expansion and new incumbent, and a last 'goal' event
+    """
+    removeCycles, costs=remove_cycles, calculate_cost
+    if isinstance(stats, SearchStats):
+        removeCycles, costs=stats.remove_cycles, stats.timed('cost_time', calculate_cost)
+    #Frontera ordenada por (g, len(route)), igual que insert_cost
+    frontier=PathFrontier(lambda x:(x.g, len(x)), [LinkedPath(origin_id)])
+    expanded=0
+    incumbent=None
+    head=frontier.pop()
+    while head is not None and head.last!=destination_id:
             expanded_paths=expand(head, map)
-            expanded_paths=remove_cycles(expanded_paths)
+            expanded_paths=removeCycles(expanded_paths)
             
-            expanded_paths=calculate_cost(expanded_paths, map, type_preference)
+            expanded_paths=costs(expanded_paths, map, type_preference)
             
-            pathList.remove(pathList[0])
-            pathList=insert_cost(expanded_paths, pathList)
-        
-    if len(pathList)>0:
-        return pathList[0]
-    else:
-        return []
+            frontier.push_batch(expanded_paths)
+            expanded+=1
+            yield SearchEvent('expanded', head, expanded, len(frontier), incumbent)
+            best=best_incumbent(expanded_paths, destination_id, incumbent)
+            if best is not incumbent:
+                incumbent=best
+                yield SearchEvent('incumbent', incumbent, expanded, len(frontier), incumbent)
+            head=frontier.pop()
+
+    yield SearchEvent('goal', head, expanded, len(frontier), head if head is not None else incumbent)
 
 
 def calculate_heuristics(expand_paths, map, destination_id, type_preference=0):
@@ -233,6 +515,9 @@ def calculate_heuristics(expand_paths, map, destination_id, type_preference=0):
         Returns:
             expand_paths (LIST of Path Class): Expanded paths with updated heuristics
     """
+    #La velocidad maxima de las lineas se busca una sola vez para todos los caminos
+    if type_preference == 1:
+        maxVelocity=max(map.velocity.values())
     for path in expand_paths:
         if type_preference == 0:
             desti = path.last == destination_id 
@@ -245,13 +530,12 @@ def calculate_heuristics(expand_paths, map, destination_id, type_preference=0):
             desti = path.last == destination_id 
             if not desti:
                 #Recogemos las cordenadas de la ultima estacion del Path
-                lastCoord=[map.stations[path.last]['x'], map.stations[path.last]['y']] 
+                lastCoord=map.stations.coord(path.last)
                 #Recogemos las coordenadas de la estacin destino
-                destinationCoord=[map.stations[destination_id]['x'], map.stations[destination_id]['y']]
+                destinationCoord=map.stations.coord(destination_id)
                 #Calculamos la distancia euclideana entre las dos estaciones y actualizamos la heurstica
                 #En este caso dividimos la distancia en linea recta desde la estacion hasta el destino entre la velocidad de la linea
-                maxVelocityKey=max(map.velocity, key=map.velocity.get)
-                path.update_h(euclidean_dist(lastCoord, destinationCoord) / map.velocity[maxVelocityKey])
+                path.update_h(euclidean_dist(lastCoord, destinationCoord) / maxVelocity)
             else:
                 path.update_h(0)
 
@@ -259,9 +543,9 @@ def calculate_heuristics(expand_paths, map, destination_id, type_preference=0):
             desti = path.last == destination_id 
             if not desti:
                 #Recogemos las cordenadas de la ultima estacion del Path
-                lastCoord=[map.stations[path.last]['x'], map.stations[path.last]['y']] 
+                lastCoord=map.stations.coord(path.last)
                 #Recogemos las coordenadas de la estacin destino
-                destinationCoord=[map.stations[destination_id]['x'], map.stations[destination_id]['y']]
+                destinationCoord=map.stations.coord(destination_id)
                 #Calculamos la distancia euclideana entre las dos estaciones y actualizamos la heurstica
                 path.update_h(euclidean_dist(lastCoord, destinationCoord))
             else:
@@ -269,7 +553,7 @@ def calculate_heuristics(expand_paths, map, destination_id, type_preference=0):
                 
         if type_preference == 3:
             desti = path.last == destination_id 
-            transfer = map.stations[path.penultimate]['name'] == map.stations[path.last]['name'] 
+            transfer = map.is_transfer(path.penultimate, path.last)
             if not desti and transfer:
                 path.update_h(1)
             elif desti:
@@ -277,6 +561,105 @@ def calculate_heuristics(expand_paths, map, destination_id, type_preference=0):
     return expand_paths
     
 
+def shortest_path_costs(map, source, type_preference=0, reverse=False):
+    """
+     Dijkstra from one station to all the others over map.graph
+     Format of the parameter is:
+        Args:
+            map (object of Map class): All the map information
+            source (int): Index of the starting station in map.graph
+            type_preference: INTEGER Value to indicate the preference selected
+            reverse (bool): If True, the costs are the ones from every station to source
+        Returns:
+            (numpy array): Cost of the optimal route for every station index, inf when there is no route
+    """
+    adjacency=adjacency_lists(map, type_preference, reverse)
+    cost=[math.inf] * len(adjacency)
+    cost[source]=0
+    frontier=[(0, source)]
+    while frontier:
+        g, station=heapq.heappop(frontier)
+        if g > cost[station]:
+            continue
+        for key, edgeCost in adjacency[station]:
+            if g + edgeCost < cost[key]:
+                cost[key]=g + edgeCost
+                heapq.heappush(frontier, (g + edgeCost, key))
+    return np.array(cost)
+
+
+def precompute_landmarks(map, type_preference=0, count=4):
+    """
+     Chooses count landmark stations and computes the exact cost from every landmark to every station and from
+     every station to every landmark. Landmarks are chosen one by one as the station furthest from the ones
+     already chosen. The result is kept in map.precomputed.
+     Format of the parameter is:
+        Args:
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected
+            count (int): Number of landmarks
+        Returns:
+            (dict): {'type_preference', 'landmarks': station ids, 'from': L x N costs from every landmark,
+                     'to': L x N costs to every landmark}
+    """
+    key=('landmarks', type_preference, count)
+    if key not in map.precomputed:
+        graph=map.graph
+        count=min(count, len(graph))
+        landmarks, costsFrom, costsTo=[], [], []
+        #Distancia de cada estacion al conjunto de landmarks elegidos, empezando por la estacion 0
+        closest=shortest_path_costs(map, 0, type_preference)
+        for _ in range(count):
+            reachable=np.where(np.isfinite(closest), closest, -1)
+            reachable[landmarks]=-1
+            landmark=int(np.argmax(reachable))
+            landmarks.append(landmark)
+            costsFrom.append(shortest_path_costs(map, landmark, type_preference))
+            costsTo.append(shortest_path_costs(map, landmark, type_preference, reverse=True))
+            closest=np.minimum(closest, costsFrom[-1]) if len(landmarks) > 1 else costsFrom[-1]
+        map.precomputed[key]={'type_preference': type_preference, 'landmarks': graph.ids[landmarks].tolist(),
+                              'from': np.array(costsFrom), 'to': np.array(costsTo)}
+    return map.precomputed[key]
+
+
+def landmark_bounds(landmarks, map, destination_id):
+    """
+     ALT heuristic of every station for one destination. By the triangle inequality, for every landmark L:
+         cost(v, t) >= cost(L, t) - cost(L, v)   and   cost(v, t) >= cost(v, L) - cost(t, L)
+     so the largest of these bounds never overestimates the real cost, and it is consistent.
+     Format of the parameter is:
+        Args:
+            landmarks (dict): As returned by precompute_landmarks
+            map (object of Map class): All the map information
+            destination_id (int): Final station id
+        Returns:
+            (list): Heuristic of every station index of map.graph
+    """
+    destination=map.graph.index[destination_id]
+    costsFrom, costsTo=landmarks['from'], landmarks['to']
+    with np.errstate(invalid='ignore'):
+        bounds=np.concatenate([costsFrom[:, destination, None] - costsFrom, costsTo - costsTo[:, destination, None]])
+    bounds=np.where(np.isnan(bounds), 0, bounds)
+    return np.maximum(bounds.max(axis=0), 0).tolist()
+
+
+def calculate_heuristics_alt(expand_paths, map, bounds):
+    """
+     Calculate and UPDATE the heuristics of the paths with the ALT bounds of landmark_bounds
+     Format of the parameter is:
+        Args:
+            expand_paths (LIST of Path Class): Expanded paths
+            map (object of Map class): All the map information
+            bounds (list): Heuristic of every station index, as returned by landmark_bounds
+        Returns:
+            expand_paths (LIST of Path Class): Expanded paths with updated heuristics
+    """
+    index=map.graph.index
+    for path in expand_paths:
+        path.update_h(bounds[index[path.last]])
+    return expand_paths
+
+
 def update_f(expand_paths):
     """
       Update the f of a path
@@ -305,13 +688,14 @@ def remove_redundant_paths(expand_paths, list_of_path, visited_stations_cost):
              list_of_path (LIST of Path Class): list_of_path without redundant paths
              visited_stations_cost (dict): Updated visited stations cost
     """
-    for path in expand_paths:
+    #Recorremos copias de las listas para no saltarnos elementos al eliminar
+    for path in list(expand_paths):
         if path.last in visited_stations_cost and path.g > visited_stations_cost[path.last]:
                 expand_paths.remove(path)
         else:
             visited_stations_cost[path.last]=path.g
     
-    for path in list_of_path:
+    for path in list(list_of_path):
         if path.last in visited_stations_cost and path.g > visited_stations_cost[path.last]:
                 list_of_path.remove(path)
         else:
@@ -331,7 +715,7 @@ def insert_cost_f(expand_paths, list_of_path):
                list_of_path (LIST of Path Class): List of Paths where expanded_path is inserted according to f
     """
     auxList=expand_paths+list_of_path
-    auxList=sorted(auxList, key=lambda x:(x.f, len(x.route)))
+    auxList=sorted(auxList, key=lambda x:(x.f, len(x)))
     return auxList
 
 
@@ -346,18 +730,83 @@ def distance_to_stations(coord, map):
             (dict): Dictionary containing as keys, all the Indexes of all the stations in the map, and as values, the
             distance between each station and the coord point
     """
+    #Todas las distancias se calculan de una vez con el indice espacial del mapa, ordenadas de menor a mayor
+    #distancia y, en caso de empate, de menor a mayor id de estacion
     auxDict={}
-    for key, value in map.stations.items(): #Recorremos los elementos del diccionario
-        auxCoord=[value['x'],value['y']]
-        distance=euclidean_dist(auxCoord, coord) #Calculamos la distance entre el punto en que nos encontramos y el punto donde esta la estacion, redondeado a las centesimas
+    for distance, key in spatial_index(map).sorted_distances(coord):
         auxDict[key]=distance
-    
-    auxDict=dict(sorted(auxDict.items(), key=lambda x: (x[1],x[0]))) #Ordenamos el diccionario de menor a mayor valor, y en caso de empate de menor a mayor id de estacion
     return auxDict
-    pass
 
 
-def Astar(origin_id, destination_id, map, type_preference=0):
+def expansion_arrays(map, destination_id, type_preference=0, bounds=None):
+    """
+     The arrays used by expand_vectorized for one search: the cost and the heuristic of the path that ends with
+     every connection of map.graph. The heuristic is the one of calculate_heuristics, computed for all the
+     stations at once from the coordinates of spatial_index(map), or the one given by bounds.
+     Format of the parameter is:
+        Args:
+            map (object of Map class): All the map information
+            destination_id (int): Final station id
+            type_preference: INTEGER Value to indicate the preference selected
+            bounds (list): If given, heuristic of every station index, as returned by landmark_bounds
+        Returns:
+            (tuple): (index of every station id, offsets, station id of every connection, cost of every connection,
+                      heuristic of every connection)
+    """
+    graph=map.graph
+    targets=graph.neighbors_index
+    costs=calculate_edge_costs(map, type_preference)
+    transfer=transfer_flags(map)
+    #Preferencias 0 y 3 con costes enteros, como calculate_cost
+    if type_preference in (0, 3):
+        costs=costs.astype(np.int64)
+    notDestination=graph.ids != destination_id
+    if bounds is not None:
+        stationH=np.asarray(bounds)
+    elif type_preference == 0:
+        stationH=notDestination.astype(np.int64)
+    elif type_preference in (1, 2):
+        index=spatial_index(map)
+        destination=index.ids.index(destination_id)
+        stationH=np.where(notDestination, index.distances([index.xs[destination], index.ys[destination]]), 0.0)
+        if type_preference == 1:
+            stationH=stationH / max(map.velocity.values())
+    else:
+        stationH=None
+    if stationH is None:
+        edgeH=(transfer & notDestination[targets]).astype(np.int64)
+    else:
+        edgeH=stationH[targets]
+    return graph.index, graph.offsets.tolist(), graph.neighbor_ids.tolist(), costs, edgeH
+
+
+def expand_vectorized(path, arrays):
+    """
+     expand, remove_cycles, calculate_cost, calculate_heuristics and update_f in one step: the g, h and f of all
+     the children of path are computed with one NumPy operation each, over the slice of its connections
+     Format of the parameter is:
+        Args:
+            path (LinkedPath Class): Path to be expanded
+            arrays (tuple): As returned by expansion_arrays
+        Returns:
+            path_list (list of LinkedPath Class): Expanded paths without cycles, with g, h and f
+    """
+    index, offsets, neighbors, costs, edgeH=arrays
+    station=index[path.last]
+    start, end=offsets[station], offsets[station + 1]
+    g=path.g + costs[start:end]
+    h=edgeH[start:end]
+    path_list=[]
+    for key, childG, childH, childF in zip(neighbors[start:end], g.tolist(), h.tolist(), (g + h).tolist()):
+        if not path.visits(key):
+            child=LinkedPath(key, path)
+            child.g, child.h, child.f=childG, childH, childF
+            path_list.append(child)
+    return path_list
+
+
+def Astar(origin_id, destination_id, map, type_preference=0, stats=None, heuristic=None, landmarks=4,
+          vectorized=False):
     """
      A* Search algorithm
      Format of the parameter is:
@@ -370,98 +819,795 @@ def Astar(origin_id, destination_id, map, type_preference=0):
                             1 - minimum Time
                             2 - minimum Distance
                             3 - minimum Transfers
+            stats (dict): If given, stats['expanded'] is increased by the number of paths expanded (a station
+                          can be expanded by more than one path). A SearchStats also gets the other counters,
+                          timers and hooks of the search
+            heuristic (str): None for calculate_heuristics, 'alt' for the landmark bounds of landmark_bounds
+            landmarks (int): Number of landmarks of the 'alt' heuristic
+            vectorized (bool): If True, the children are expanded with expand_vectorized. The route, g, h and f
+                               are the same ones
         Returns:
             list_of_path[0] (Path Class): The route that goes from origin_id to destination_id
     """
-    pathList=[Path([origin_id])]
+    return search_result(iter_Astar(origin_id, destination_id, map, type_preference, heuristic, landmarks,
+                                    vectorized, stats), stats)
+
+
+def iter_Astar(origin_id, destination_id, map, type_preference=0, heuristic=None, landmarks=4, vectorized=False,
+               stats=None):
+    """
+     A* Search algorithm, as a generator of SearchEvent. The arguments are the ones of Astar
+     Format of the parameter is:
+        Args:
+            origin_id (int): Starting station id
+            destination_id (int): Final station id
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected
+            heuristic (str): None for calculate_heuristics, 'alt' for the landmark bounds of landmark_bounds
+            landmarks (int): Number of landmarks of the 'alt' heuristic
+            vectorized (bool): If True, the children are expanded with expand_vectorized
+            stats (SearchStats): If given, it counts the paths dropped and times the costs and heuristics
+        Returns:
+            (generator): SearchEvent after every expansion and new incumbent, and a last 'goal' event
+    """
+    bounds=None
+    if heuristic=='alt':
+        bounds=landmark_bounds(precompute_landmarks(map, type_preference, landmarks), map, destination_id)
+        heuristics=lambda paths: calculate_heuristics_alt(paths, map, bounds)
+    elif heuristic is None:
+        heuristics=lambda paths: calculate_heuristics(paths, map, destination_id, type_preference)
+    else:
+        raise ValueError('Unknown heuristic {}, use None or \'alt\''.format(heuristic))
+    if vectorized:
+        arrays=expansion_arrays(map, destination_id, type_preference, bounds)
+    #Frontera ordenada por (f, len(route)), igual que insert_cost_f
+    frontier=PathFrontier(lambda x:(x.f, len(x)), [LinkedPath(origin_id)])
     stationsCost={}
-    while pathList and pathList[0].last!=destination_id:
-            head=pathList.pop(0)
-            expanded_paths=expand(head, map)
-            expanded_paths=remove_cycles(expanded_paths)
-            
-            expanded_paths=calculate_cost(expanded_paths, map, type_preference)
-            expanded_paths=calculate_heuristics(expanded_paths, map, destination_id, type_preference)
-            expanded_paths=update_f(expanded_paths)
-            expanded_paths, pathList, stationsCost=remove_redundant_paths(expanded_paths, pathList, stationsCost)
+    #Los caminos redundantes de la frontera se descartan al sacarlos, sin buscarlos en la lista
+    is_stale=lambda x: x.g > stationsCost[x.last]
+    removeCycles, costs, removeRedundant, expandVectorized=(remove_cycles, calculate_cost, remove_redundant_paths,
+                                                            expand_vectorized)
+    if isinstance(stats, SearchStats):
+        removeCycles, removeRedundant=stats.remove_cycles, stats.remove_redundant_paths
+        is_stale=stats.is_stale(is_stale)
+        costs, heuristics=stats.timed('cost_time', calculate_cost), stats.timed('heuristic_time', heuristics)
+        expandVectorized=stats.timed('cost_time', expand_vectorized)
+    expanded=0
+    incumbent=None
+    head=frontier.pop()
+    while head is not None and head.last!=destination_id:
+            if vectorized:
+                expanded_paths=expandVectorized(head, arrays)
+            else:
+                expanded_paths=expand(head, map)
+                expanded_paths=removeCycles(expanded_paths)
+
+                expanded_paths=costs(expanded_paths, map, type_preference)
+                expanded_paths=heuristics(expanded_paths)
+                expanded_paths=update_f(expanded_paths)
+            expanded_paths, _, stationsCost=removeRedundant(expanded_paths, [], stationsCost)
             
-            pathList=insert_cost_f(expanded_paths, pathList)
-        
-    if pathList:
-        return pathList[0]
-    else:
+            frontier.push_batch(expanded_paths)
+            expanded+=1
+            yield SearchEvent('expanded', head, expanded, len(frontier), incumbent)
+            best=best_incumbent(expanded_paths, destination_id, incumbent)
+            if best is not incumbent:
+                incumbent=best
+                yield SearchEvent('incumbent', incumbent, expanded, len(frontier), incumbent)
+            head=frontier.pop(is_stale)
+
+    yield SearchEvent('goal', head, expanded, len(frontier), head if head is not None else incumbent)
+
+
+def adjacency_lists(map, type_preference=0, reverse=False):
+    """
+     The connections of map.graph as Python lists with the cost of calculate_edge_costs. Searches that work on
+     the dense station indices use them. They are kept in map.precomputed.
+     Format of the parameter is:
+        Args:
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected
+            reverse (bool): If True, the list of every station holds the connections that arrive to it
+        Returns:
+            (list): For every station index, a list of tuples (connected station index, cost)
+    """
+    key=('adjacency_lists', type_preference, reverse)
+    if key not in map.precomputed:
+        graph=map.graph
+        sources=np.repeat(np.arange(len(graph)), np.diff(graph.offsets))
+        targets=graph.neighbors_index
+        if reverse:
+            sources, targets=targets, sources
+        lists=[[] for _ in range(len(graph))]
+        for source, target, cost in zip(sources.tolist(), targets.tolist(),
+                                        calculate_edge_costs(map, type_preference).tolist()):
+            lists[source].append((target, cost))
+        map.precomputed[key]=lists
+    return map.precomputed[key]
+
+
+def path_from_indices(indices, map, type_preference=0):
+    """
+     Builds the Path of a route given as dense station indices. The g is accumulated connection by connection
+     from the origin, in the same order as calculate_cost, so it is exactly the g that Astar would give.
+    """
+    graph=map.graph
+    forward=adjacency_lists(map, type_preference)
+    path=Path([int(graph.ids[indices[0]])])
+    for previous, station in zip(indices, indices[1:]):
+        path.add_route(int(graph.ids[station]))
+        path.update_g(min(cost for target, cost in forward[previous] if target == station))
+    path.update_f()
+    return path
+
+
+def bidirectional_search(origin_id, destination_id, map, type_preference=1, stats=None):
+    """
+     Bidirectional Dijkstra. A forward search from the origin and a backward search from the destination (over
+     the connections reversed) are run at the same time, always advancing the one with the smallest cost in its
+     frontier. The search stops when the two smallest costs of the frontiers add up to the best route found
+     joining both searches, so the route is optimal. Thought for type_preference 1 and 2, where the frontier of
+     Astar grows the most, but valid for all of them.
+     Format of the parameter is:
+        Args:
+            origin_id (int): Starting station id
+            destination_id (int): Final station id
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected
+            stats (dict): If given, stats['expanded'] is increased by the number of stations expanded
+        Returns:
+            list_of_path[0] (Path Class): The route that goes from origin_id to destination_id
+    """
+    graph=map.graph
+    origin, destination=graph.index[origin_id], graph.index[destination_id]
+    adjacency=[adjacency_lists(map, type_preference), adjacency_lists(map, type_preference, reverse=True)]
+    cost=[{origin: 0}, {destination: 0}]
+    parent=[{origin: None}, {destination: None}]
+    settled=[set(), set()]
+    frontier=[[(0, origin)], [(0, destination)]]
+    best=0 if origin == destination else math.inf
+    meeting=origin if origin == destination else None
+    expanded=0
+    while frontier[0] and frontier[1] and frontier[0][0][0] + frontier[1][0][0] < best:
+        side=0 if frontier[0][0][0] <= frontier[1][0][0] else 1
+        g, station=heapq.heappop(frontier[side])
+        if station in settled[side]:
+            continue
+        settled[side].add(station)
+        expanded+=1
+        other=cost[1 - side]
+        for key, edgeCost in adjacency[side][station]:
+            newG=g + edgeCost
+            if newG < cost[side].get(key, math.inf):
+                cost[side][key]=newG
+                parent[side][key]=station
+                heapq.heappush(frontier[side], (newG, key))
+            if key in other and cost[side][key] + other[key] < best:
+                best=cost[side][key] + other[key]
+                meeting=key
+    if stats is not None:
+        stats['expanded']=stats.get('expanded', 0) + expanded
+    if meeting is None:
+        return []
+
+    #Ruta desde el origen hasta el punto de encuentro y desde alli hasta el destino
+    route=[]
+    station=meeting
+    while station is not None:
+        route.append(station)
+        station=parent[0][station]
+    route.reverse()
+    station=parent[1][meeting]
+    while station is not None:
+        route.append(station)
+        station=parent[1][station]
+    return path_from_indices(route, map, type_preference)
+
+
+def compare_expansions(origin_id, destination_id, map, type_preference=1):
+    """
+     Number of paths expanded by Astar and of stations expanded by bidirectional_search for the same query
+     Format of the parameter is:
+        Args:
+            origin_id (int): Starting station id
+            destination_id (int): Final station id
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected
+        Returns:
+            (dict): {'Astar': paths expanded, 'bidirectional_search': stations expanded}
+    """
+    astarStats, bidirectionalStats={}, {}
+    Astar(origin_id, destination_id, map, type_preference, stats=astarStats)
+    bidirectional_search(origin_id, destination_id, map, type_preference, stats=bidirectionalStats)
+    return {'Astar': astarStats.get('expanded', 0), 'bidirectional_search': bidirectionalStats.get('expanded', 0)}
+
+
+def compare_heuristics(origin_id, destination_id, map, type_preference=1, landmarks=4):
+    """
+     Number of paths expanded by Astar with calculate_heuristics and with the ALT landmark heuristic
+     Format of the parameter is:
+        Args:
+            origin_id (int): Starting station id
+            destination_id (int): Final station id
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected
+            landmarks (int): Number of landmarks of the 'alt' heuristic
+        Returns:
+            (dict): {'default': paths expanded, 'alt': paths expanded}
+    """
+    defaultStats, altStats={}, {}
+    Astar(origin_id, destination_id, map, type_preference, stats=defaultStats)
+    Astar(origin_id, destination_id, map, type_preference, stats=altStats, heuristic='alt', landmarks=landmarks)
+    return {'default': defaultStats.get('expanded', 0), 'alt': altStats.get('expanded', 0)}
+
+
+def transfer_lists(map):
+    """
+     The connections of map.graph as Python lists with an INTEGER flag, 1 for a transfer and 0 otherwise. They
+     are kept in map.precomputed.
+     Format of the parameter is:
+        Args:
+            map (object of Map class): All the map information
+        Returns:
+            (list): For every station index, a list of tuples (connected station index, transfer flag)
+    """
+    if 'transfer_lists' not in map.precomputed:
+        graph=map.graph
+        targets, flags=graph.neighbors_index.tolist(), transfer_flags(map).astype(np.int8).tolist()
+        offsets=graph.offsets.tolist()
+        map.precomputed['transfer_lists']=[list(zip(targets[start:end], flags[start:end]))
+                                            for start, end in zip(offsets, offsets[1:])]
+    return map.precomputed['transfer_lists']
+
+
+def zero_one_bfs(origin_id, destination_id, map):
+    """
+     Minimum Transfers search in linear time (type_preference 3). Every connection costs 0 or 1, so the stations
+     are reached in order of (transfers, connections) with two queues per number of transfers: the stations
+     reached with a connection of cost 0 and the ones reached with a transfer from the previous number of
+     transfers. Both queues are in order of connections, so the smallest of their two heads is always the next
+     station.
+     uniform_cost_search returns, among all the routes of minimum (transfers, connections), the first one taken
+     out of its frontier: the child of the most recently expanded parent. So for every station the first and the
+     last route popped by uniform_cost_search are tracked, level by level, and the first route to the destination
+     is rebuilt from them. The route returned is the same one as uniform_cost_search(..., 3).
+     Format of the parameter is:
+        Args:
+            origin_id (int): Starting station id
+            destination_id (int): Final station id
+            map (object of Map class): All the map information
+        Returns:
+            path (Path Class): The route that goes from origin_id to destination_id, [] if there is none
+    """
+    graph=map.graph
+    rows=transfer_lists(map)
+    origin, destination=graph.index[origin_id], graph.index[destination_id]
+    #Estaciones en orden de (transbordos, conexiones)
+    cost={}
+    order=[]
+    level=deque([(0, origin)])
+    transfers=0
+    while level and destination not in cost:
+        same, nextLevel=deque(), deque()
+        while (level or same) and destination not in cost:
+            if not same or (level and level[0][0] <= same[0][0]):
+                hops, station=level.popleft()
+            else:
+                hops, station=same.popleft()
+            if station in cost:
+                continue
+            cost[station]=(transfers, hops)
+            order.append(station)
+            for key, flag in rows[station]:
+                if key not in cost:
+                    (nextLevel if flag else same).append((hops + 1, key))
+        level=nextLevel
+        transfers+=1
+    if destination not in cost:
         return []
 
+    #Conexiones u -> v de coste minimo: (u, posicion de v entre los hijos de u)
+    parents={station: [] for station in order}
+    for station in order:
+        g, hops=cost[station]
+        for child, (key, flag) in enumerate(rows[station]):
+            if cost.get(key) == (g + flag, hops + 1):
+                parents[key].append((station, child))
+
+    #Posicion en la que uniform_cost_search saca la primera y la ultima ruta de cada estacion
+    first, last={origin: 0}, {origin: 0}
+    firstParent, lastParent={}, {}
+    position=1
+    for _, group in itertools.groupby(order[1:], key=cost.get):
+        routes=[]
+        for station in group:
+            if station == destination:
+                firstParent[station]=max(parents[station], key=lambda p: last[p[0]])[0]
+                break
+            #Los hijos del padre sacado mas tarde salen antes
+            u, child=max(parents[station], key=lambda p: last[p[0]])
+            routes.append(((-last[u], child), first, station))
+            firstParent[station]=u
+            u, child=min(parents[station], key=lambda p: first[p[0]])
+            routes.append(((-first[u], child), last, station))
+            lastParent[station]=u
+        routes.sort(key=lambda r: r[0])
+        for rank, (key, positions, station) in enumerate(routes):
+            positions[station]=position + rank
+        position+=len(routes)
+
+    #La primera ruta de una estacion sigue a la ultima de su padre, y la ultima a la primera
+    route=[destination]
+    parentOf, other=firstParent, lastParent
+    while route[-1] != origin:
+        route.append(parentOf[route[-1]])
+        parentOf, other=other, parentOf
+    route.reverse()
+    path=Path([int(s) for s in graph.ids[route]])
+    path.update_g(cost[destination][0])
+    return path
+
+
+def dominates(a, b):
+    # a is at least as good as b in every cost
+    return a[0] <= b[0] and a[1] <= b[1] and a[2] <= b[2]
+
+
+def pareto_search(origin_id, destination_id, map, max_labels=None, stats=None):
+    """
+     Multi-criteria search over (time, transfers, distance), with the costs of calculate_cost for type_preference
+     1, 3 and 2. Every label is a route to a station with its three costs; a label is dropped when another label
+     of the same station, or of the destination, is at least as good in the three costs. Labels are taken out in
+     order of (time, transfers, distance), so a label that is not dominated when it is taken out is in the front.
+     Labels are stored in flat arrays (costs, station and parent label), the routes are only rebuilt for the
+     labels of the destination.
+     Format of the parameter is:
+        Args:
+            origin_id (int): Starting station id
+            destination_id (int): Final station id
+            map (object of Map class): All the map information
+            max_labels (int): If given, maximum number of labels kept at every station. New labels of a full
+                              station are dropped, so the front returned can miss some routes
+            stats (dict): If given, stats['expanded'] is increased by the number of labels expanded and
+                          stats['capped'] by the number of labels dropped by max_labels
+        Returns:
+            (list): tuples (path, (time, transfers, distance)) of the Pareto front, in order of time. The g and f
+                    of every path are its time
+    """
+    graph=map.graph
+    origin, destination=graph.index[origin_id], graph.index[destination_id]
+    edges=[list(zip(time, transfer, distance)) for time, transfer, distance in
+           zip(adjacency_lists(map, 1), adjacency_lists(map, 3), adjacency_lists(map, 2))]
+    #Etiquetas: costes, estacion y etiqueta padre de cada una
+    times, transfers, distances=array('d', [0.0]), array('l', [0]), array('d', [0.0])
+    stations, parents=array('l', [origin]), array('l', [-1])
+    bags=[[] for _ in range(len(graph))]
+    bags[origin].append(0)
+    alive={0}
+    frontier=[(0.0, 0, 0.0, 0)]
+    front=[]
+    expanded=capped=0
+    while frontier:
+        time, transfer, distance, label=heapq.heappop(frontier)
+        if label not in alive:
+            continue
+        station=stations[label]
+        if station == destination:
+            front.append(label)
+            continue
+        costs=(time, transfer, distance)
+        if any(dominates((times[d], transfers[d], distances[d]), costs) for d in front):
+            continue
+        expanded+=1
+        for (key, timeCost), (_, transferCost), (_, distanceCost) in edges[station]:
+            new=(time + timeCost, transfer + int(transferCost), distance + distanceCost)
+            bag=bags[key]
+            if any(dominates((times[b], transfers[b], distances[b]), new) for b in bag) or \
+                    any(dominates((times[d], transfers[d], distances[d]), new) for d in front):
+                continue
+            for b in [b for b in bag if dominates(new, (times[b], transfers[b], distances[b]))]:
+                bag.remove(b)
+                alive.discard(b)
+            if max_labels is not None and len(bag) >= max_labels:
+                capped+=1
+                continue
+            newLabel=len(stations)
+            times.append(new[0])
+            transfers.append(new[1])
+            distances.append(new[2])
+            stations.append(key)
+            parents.append(label)
+            bag.append(newLabel)
+            alive.add(newLabel)
+            heapq.heappush(frontier, new + (newLabel,))
+    if stats is not None:
+        stats['expanded']=stats.get('expanded', 0) + expanded
+        stats['capped']=stats.get('capped', 0) + capped
+
+    result=[]
+    for label in front:
+        costs=(times[label], transfers[label], distances[label])
+        route=[]
+        while label >= 0:
+            route.append(stations[label])
+            label=parents[label]
+        path=Path([int(s) for s in graph.ids[route[::-1]]])
+        path.update_g(costs[0])
+        path.update_f()
+        result.append((path, costs))
+    return result
+
+
+def shortest_path_tree(map, destination, type_preference=0):
+    """
+     Dijkstra from every station to destination over the connections reversed
+     Format of the parameter is:
+        Args:
+            map (object of Map class): All the map information
+            destination (int): Index of the final station in map.graph
+            type_preference: INTEGER Value to indicate the preference selected
+        Returns:
+            cost (list): Cost of the optimal route from every station index to destination, inf if there is none
+            next_hop (list): Station index that follows every station in that route (-1 for destination and for
+                             the stations without route)
+    """
+    backward=adjacency_lists(map, type_preference, reverse=True)
+    cost=[math.inf] * len(backward)
+    nextHop=[-1] * len(backward)
+    cost[destination]=0
+    frontier=[(0, destination)]
+    while frontier:
+        g, station=heapq.heappop(frontier)
+        if g > cost[station]:
+            continue
+        for key, edgeCost in backward[station]:
+            if g + edgeCost < cost[key]:
+                cost[key]=g + edgeCost
+                nextHop[key]=station
+                heapq.heappush(frontier, (g + edgeCost, key))
+    return cost, nextHop
+
+
+def k_shortest_paths(origin_id, destination_id, map, type_preference=0, stats=None):
+    """
+     Yen's algorithm: the routes without cycles from origin_id to destination_id, yielded one by one in order of
+     cost (calculate_cost), so only the routes that are taken are computed, e.g.
+     itertools.islice(k_shortest_paths(9, 4, map, 1), 3) for the best 3.
+     Every new route deviates from a route already yielded at a spur station: the part before the spur station is
+     kept, the stations of that part and the connections taken at the spur station by the routes already yielded
+     are blocked, and the rest is searched again. The blocks are flags in two bytearrays, set and cleared in place.
+     All the spur searches share the shortest path tree to the destination computed at the start: its costs are
+     the heuristic of an A* (blocking only makes routes more expensive, so they never overestimate), and as soon
+     as the A* takes out a station whose tree route is not blocked, the rest of the route is taken from the tree:
+     its cost is exactly the heuristic, so no other route can be cheaper.
+     Format of the parameter is:
+        Args:
+            origin_id (int): Starting station id
+            destination_id (int): Final station id
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected:
+                            0 - Adjacency
+                            1 - minimum Time
+                            2 - minimum Distance
+                            3 - minimum Transfers
+            stats (dict): If given, stats['expanded'] is increased by the number of stations expanded by the spur
+                          searches and stats['reused'] by the spur routes completed with the tree
+        Returns:
+            (generator): Path Class objects with their g and f, in order of cost
+    """
+    graph=map.graph
+    origin, destination=graph.index[origin_id], graph.index[destination_id]
+    forward=adjacency_lists(map, type_preference)
+    offsets=graph.offsets.tolist()
+    distance, nextHop=shortest_path_tree(map, destination, type_preference)
+    if distance[origin] == math.inf:
+        return
+    blockedStation=bytearray(len(graph))
+    blockedEdge=bytearray(len(graph.neighbors_index))
+    if stats is not None:
+        stats.setdefault('expanded', 0)
+        stats.setdefault('reused', 0)
+
+    #Conexion del arbol que sale de cada estacion
+    treeEdge=[offsets[station] + next(p for p, (key, _) in enumerate(forward[station]) if key == nextHop[station])
+              if nextHop[station] >= 0 else -1 for station in range(len(graph))]
+
+    def tree_route(spur, valid=None):
+        #Ruta del arbol desde spur, si no pasa por nada bloqueado. valid guarda las estaciones ya comprobadas
+        valid={} if valid is None else valid
+        route=[spur]
+        while route[-1] != destination and route[-1] not in valid:
+            station=route[-1]
+            if blockedEdge[treeEdge[station]] or blockedStation[nextHop[station]]:
+                break
+            route.append(nextHop[station])
+        ok=route[-1] == destination or valid.get(route[-1], False)
+        for station in route:
+            valid[station]=ok
+        if not ok:
+            return None
+        while route[-1] != destination:
+            route.append(nextHop[route[-1]])
+        return route
+
+    def spur_search(spur):
+        #A* desde spur con las distancias del arbol como heuristica
+        cost={spur: 0}
+        parent={spur: None}
+        frontier=[(distance[spur], 0, spur)]
+        valid={}
+        while frontier:
+            _, g, station=heapq.heappop(frontier)
+            if g > cost[station]:
+                continue
+            tail=tree_route(station, valid)
+            if tail is not None:
+                if stats is not None and station != destination:
+                    stats['reused']+=1
+                route=[]
+                while station is not None:
+                    route.append(station)
+                    station=parent[station]
+                return route[:0:-1] + tail
+            if stats is not None:
+                stats['expanded']+=1
+            for position, (key, edgeCost) in enumerate(forward[station]):
+                if blockedEdge[offsets[station] + position] or blockedStation[key] or distance[key] == math.inf:
+                    continue
+                if g + edgeCost < cost.get(key, math.inf):
+                    cost[key]=g + edgeCost
+                    parent[key]=station
+                    heapq.heappush(frontier, (g + edgeCost + distance[key], g + edgeCost, key))
+        return None
+
+    def route_cost(route):
+        #Coste acumulado desde el origen, conexion a conexion, como calculate_cost
+        g=0
+        for previous, station in zip(route, route[1:]):
+            g+=min(edgeCost for key, edgeCost in forward[previous] if key == station)
+        return g
+
+    route=tree_route(origin)
+    found=[route]
+    candidates=[]
+    seen={tuple(route)}
+    while True:
+        yield path_from_indices(route, map, type_preference)
+        for i in range(len(route) - 1):
+            root=route[:i + 1]
+            spur=route[i]
+            blocked=[]
+            for previous in found:
+                if previous[:i + 1] == root:
+                    position=next(p for p, (target, _) in enumerate(forward[spur]) if target == previous[i + 1])
+                    blocked.append(offsets[spur] + position)
+                    blockedEdge[blocked[-1]]=1
+            for station in root[:-1]:
+                blockedStation[station]=1
+            spurRoute=spur_search(spur)
+            for edge in blocked:
+                blockedEdge[edge]=0
+            for station in root[:-1]:
+                blockedStation[station]=0
+            if spurRoute is not None:
+                candidate=root[:-1] + spurRoute
+                if tuple(candidate) not in seen:
+                    seen.add(tuple(candidate))
+                    heapq.heappush(candidates, (route_cost(candidate), len(candidate), candidate))
+        if not candidates:
+            return
+        _, _, route=heapq.heappop(candidates)
+        found.append(route)
+
+
+# Searches by name, and the ones among them that take a type_preference
+SEARCH_ALGORITHMS={
+    'depth_first_search': depth_first_search,
+    'breadth_first_search': breadth_first_search,
+    'uniform_cost_search': uniform_cost_search,
+    'Astar': Astar,
+    'bidirectional_search': bidirectional_search,
+    'zero_one_bfs': zero_one_bfs,
+}
+WEIGHTED_SEARCHES={'uniform_cost_search', 'Astar', 'bidirectional_search'}
+
+
+def run_search(algorithm, origin_id, destination_id, map, type_preference=0):
+    """
+     Runs one of the station to station searches by name
+     Format of the parameter is:
+        Args:
+            algorithm (str): Name of the search in SEARCH_ALGORITHMS
+            origin_id (int): Starting station id
+            destination_id (int): Final station id
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected, ignored by the searches
+                             that are not in WEIGHTED_SEARCHES
+        Returns:
+            list_of_path[0] (Path Class): The route that goes from origin_id to destination_id
+    """
+    if algorithm not in SEARCH_ALGORITHMS:
+        raise ValueError('Unknown algorithm {}, use one of {}'.format(algorithm, sorted(SEARCH_ALGORITHMS)))
+    if algorithm in WEIGHTED_SEARCHES:
+        return SEARCH_ALGORITHMS[algorithm](origin_id, destination_id, map, type_preference)
+    return SEARCH_ALGORITHMS[algorithm](origin_id, destination_id, map)
+
 
+def max_speed(map):
+    """
+        Highest speed (distance / time) of any connection of the map or of walking. Dividing a straight line
+        distance by it never overestimates the time needed to travel it, so it gives a consistent heuristic.
+        The value is kept in map.precomputed.
+    """
+    if 'max_speed' not in map.precomputed:
+        graph=map.graph
+        index=spatial_index(map)
+        xs=map.stations.column('x', graph.ids.tolist())
+        ys=map.stations.column('y', graph.ids.tolist())
+        sources=np.repeat(np.arange(len(graph)), np.diff(graph.offsets))
+        targets=graph.neighbors_index
+        distance=np.sqrt((xs[sources]-xs[targets])**2 + (ys[sources]-ys[targets])**2)
+        if np.any((graph.weights <= 0) & (distance > 0)):
+            speed=math.inf
+        else:
+            moving=distance > 0
+            speed=max([WALKING_SPEED] + (distance[moving] / graph.weights[moving]).tolist())
+        map.precomputed['max_speed']=speed
+    return map.precomputed['max_speed']
 
-def Astar_improved(origin_coord, destination_coord, map):
+
+def Astar_improved(origin_coord, destination_coord, map, nearest=None, stats=None):
     """
      A* Search algorithm
+     The origin (station 0) and the destination (station -1) are added to the subway as virtual stations: from the
+     origin we can walk to any station, from any station we can walk to the destination, and we can also walk
+     straight from the origin to the destination. Walking is done at WALKING_SPEED and one single search is run
+     over this graph with the minimum time as cost.
      Format of the parameter is:
         Args:
             origin_coord (list): Two REAL values, which refer to the coordinates of the starting position
             destination_coord (list): Two REAL values, which refer to the coordinates of the final position
             map (object of Map class): All the map information
+            nearest (int): If given, we only walk from the origin and to the destination to their nearest stations
+            stats (dict): If given, stats['expanded'] is increased by the number of stations expanded. A
+                          SearchStats also gets redundant and frontier_peak and its on_goal hook is called (there
+                          are no paths to give to the other hooks)
 
         Returns:
             list_of_path[0] (Path Class): The route that goes from origin_coord to destination_coord
     """
-    def Astar_improved(origin_coord:list[int], destination_coord:list[int], map:Map) -> Path:
-        visited_stations_cost = {}
-        results = []
-
-        minimum_dist = euclidean_dist(origin_coord,destination_coord)/5
-        more_prox = distance_to_stations(origin_coord,map)
-
-        for i,j in more_prox.items():
-            new_list = []
-            list_b = [Path(0)]
-            list_b[0].add_route(i)
-            list_b[0].g = j/5
-            while list_b and list_b[0].route[-1] != -1:
-                new_list = expand(list_b[0],map)
-                new_list = remove_cycles(new_list)
-                for path in new_list:
-                    time_train = map.connections[path.penultimate][path.last]
-                    time_path_1 = euclidean_dist([map.stations[path.penultimate]['x'],map.stations[path.penultimate]['y']],destination_coord)/5
-                    time_path_2 = euclidean_dist([map.stations[path.last]['x'],map.stations[path.last]['y']],destination_coord)/5
-                    if time_path_2 + time_train > time_path_1:
-                        path.update_g(time_path_1)
-                        path.route[-1] = -1
-                        path.last = path.route[-1]
-                    elif time_path_1 > time_train:
-                        path.update_g(time_train)   
-                    else:
-                        path.update_g(time_path_1)
-                        path.route[-1] = -1
-                        path.last = path.route[-1]
-
-                for path in new_list:
-                    if path.last == -1:
-                        path.h = 0
-                    else:
-                        path.h = euclidean_dist([map.stations[path.last]['x'],map.stations[path.last]['y']],destination_coord)/45
-                
-                new_list = update_f(new_list)
-                new_list,list_b,visited_stations_cost = remove_redundant_paths(new_list,list_b,visited_stations_cost)
-                list_b = insert_cost_f(new_list,list_b[1:])
+    index=spatial_index(map)
+    #Tiempo andando desde cada estacion hasta el destino, que tambien sirve para la heuristica
+    destinationWalk={s: d / WALKING_SPEED for s, d in zip(index.ids, index.distances(destination_coord).tolist())}
+    if nearest is None:
+        originWalk=zip(index.ids, index.distances(origin_coord).tolist())
+        exits=destinationWalk
+    else:
+        originWalk=[(s, d) for d, s in index.nearest(origin_coord, nearest)]
+        exits={s: destinationWalk[s] for d, s in index.nearest(destination_coord, nearest)}
+    speed=max_speed(map)
+    heuristic=lambda station: 0 if station == -1 else destinationWalk[station] * WALKING_SPEED / speed
 
-            if list_b:
-                results.append(list_b[0])
-            
-        
-        path = Path([0,-1])
-        path.f = minimum_dist
-        for k in results:
-            if k.f == minimum_dist:
-                if len(k.route) < len(path.route):
-                    path = k
-                    minimum_dist = k.f
-            elif k.f <= minimum_dist:
-                minimum_dist = k.f
-                path = k
-
-        return path
-    
-   
+    #Cada entrada de la frontera es (f, numero de estaciones, orden de insercion, g, estacion, estacion anterior)
+    order=itertools.count()
+    g=euclidean_dist(origin_coord, destination_coord) / WALKING_SPEED
+    frontier=[(g, 2, next(order), g, -1, 0)]
+    for station, distance in originWalk:
+        g=distance / WALKING_SPEED
+        frontier.append((g + heuristic(station), 2, next(order), g, station, 0))
+    heapq.heapify(frontier)
+    parent={0: None}
+    path=[]
+    peak=len(frontier)
+    redundant=0
+    while frontier:
+        if len(frontier) > peak:
+            peak=len(frontier)
+        f, length, _, g, station, previous=heapq.heappop(frontier)
+        if station in parent:
+            redundant+=1
+            continue
+        parent[station]=previous
+        if station == -1:
+            route=[]
+            while station is not None:
+                route.append(station)
+                station=parent[station]
+            path=Path(route[::-1])
+            path.g=g
+            path.update_f()
+            break
+        if station in exits:
+            newG=g + exits[station]
+            heapq.heappush(frontier, (newG, length + 1, next(order), newG, -1, station))
+        for key in map.neighbors(station):
+            if key not in parent:
+                newG=g + map.connections[station][key]
+                heapq.heappush(frontier, (newG + heuristic(key), length + 1, next(order), newG, key, station))
+
+    if stats is not None:
+        #Se expanden todas las estaciones alcanzadas menos el origen (0) y, si se ha alcanzado, el destino (-1)
+        expanded=len(parent) - 1
+        if -1 in parent:
+            expanded-=1
+        stats['expanded']=stats.get('expanded', 0) + expanded
+    if isinstance(stats, SearchStats):
+        stats['redundant']+=redundant
+        stats['frontier_peak']=max(stats['frontier_peak'], peak)
+        if stats.on_goal is not None:
+            stats.on_goal(path if isinstance(path, Path) else None)
+    return path
+
+
+def isochrone(origin, map, budget=math.inf, type_preference=1, tree=False, stats=None):
+    """
+     One-to-all search: the cost of the optimal route from origin to every station that can be reached with a
+     cost of at most budget, with one single Dijkstra over the connections of the map instead of one search per
+     station. The costs are accumulated connection by connection with the cost of calculate_cost, so they are the
+     g that uniform_cost_search would give.
+     When origin is a coordinate, the route starts walking at WALKING_SPEED from it to any station (the origin is
+     the virtual station 0, as in Astar_improved) and the cost is the time, so type_preference must be 1.
+     Format of the parameter is:
+        Args:
+            origin (int or list): Starting station id, or two REAL values with the coordinates of the starting
+                                  position
+            map (object of Map class): All the map information
+            budget (float): Highest cost of the stations returned
+            type_preference: INTEGER Value to indicate the preference selected
+            tree (bool): If True, the shortest path tree is also returned
+            stats (dict): If given, stats['expanded'] is increased by the number of stations expanded. A
+                          SearchStats also gets redundant and frontier_peak
+        Returns:
+            cost (dict): Cost of the optimal route to every station id reached within budget
+            parent (dict): Only if tree is True, the station that comes before every station in its optimal
+                           route (None for the origin station, 0 for the stations reached walking)
+    """
+    graph=map.graph
+    ids=graph.ids.tolist()
+    adjacency=adjacency_lists(map, type_preference)
+    if isinstance(origin, (list, tuple, np.ndarray)):
+        if type_preference != 1:
+            raise ValueError('A coordinate origin needs type_preference 1 (minimum time)')
+        #Tiempo andando desde el origen hasta todas las estaciones de una vez
+        xs=map.stations.column('x', ids)
+        ys=map.stations.column('y', ids)
+        walk=np.sqrt((xs - origin[0])**2 + (ys - origin[1])**2) / WALKING_SPEED
+        reached=np.flatnonzero(walk <= budget)
+        frontier=list(zip(walk[reached].tolist(), reached.tolist(), itertools.repeat(-1)))
+    else:
+        if origin not in graph.index:
+            raise KeyError(origin)
+        frontier=[(0, graph.index[origin], None)]
+    heapq.heapify(frontier)
+
+    #Cada entrada de la frontera es (g, indice de la estacion, indice de la estacion anterior)
+    cost={}
+    parent={}
+    peak=len(frontier)
+    redundant=0
+    while frontier:
+        if len(frontier) > peak:
+            peak=len(frontier)
+        g, station, previous=heapq.heappop(frontier)
+        if station in cost:
+            redundant+=1
+            continue
+        cost[station]=g
+        parent[station]=previous
+        for key, edgeCost in adjacency[station]:
+            newG=g + edgeCost
+            if newG <= budget and key not in cost:
+                heapq.heappush(frontier, (newG, key, station))
 
+    if stats is not None:
+        stats['expanded']=stats.get('expanded', 0) + len(cost)
+    if isinstance(stats, SearchStats):
+        stats['redundant']+=redundant
+        stats['frontier_peak']=max(stats['frontier_peak'], peak)
+    result={ids[station]: g for station, g in cost.items()}
+    if not tree:
+        return result
+    #Los indices se traducen a ids, el origen andando es la estacion virtual 0
+    names={None: None, -1: 0}
+    return result, {ids[station]: names[previous] if previous in names else ids[previous]
+                    for station, previous in parent.items()}
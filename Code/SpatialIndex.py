@@ -0,0 +1,150 @@
+# This file contains a spatial index over the coordinates of the stations of a map.
+#
+# _________________________________________________________________________________________
+# Intel.ligencia Artificial
+# Curs 2023 - 2024
+# Universitat Autonoma de Barcelona
+# _______________________________________________________________________________________
+
+import numpy as np
+import math
+
+
+class SpatialIndex:
+    """
+    A uniform grid over the (x, y) coordinates of the stations. Every cell keeps the stations inside it, so the
+    nearest and within-radius queries only look at the cells around the query point.
+    Results are lists of (distance, station_id) sorted by distance and then by station id, the same order used
+    by distance_to_stations, and the distances are computed exactly as euclidean_dist does.
+    Usage:
+        # >>> index = spatial_index(map)
+        # The 3 stations closest to the point (100, 200) and the stations at 60 or less from it
+        # >>> index.nearest([100, 200], 3), index.within([100, 200], 60)
+    """
+
+    def __init__(self, ids, xs, ys, cell_size=None):
+        self.ids = list(ids)
+        self.xs = np.asarray(xs, dtype=np.float64)
+        self.ys = np.asarray(ys, dtype=np.float64)
+        self.coords = list(zip(self.xs.tolist(), self.ys.tolist()))
+        if len(self.ids):
+            self.min_x, self.min_y = float(self.xs.min()), float(self.ys.min())
+            width, height = float(self.xs.max()) - self.min_x, float(self.ys.max()) - self.min_y
+        else:
+            self.min_x = self.min_y = width = height = 0.0
+        if cell_size is None:
+            # Around one station per cell
+            cell_size = math.sqrt(max(width * height, 1.0) / max(len(self.ids), 1))
+        self.cell_size = max(float(cell_size), 1e-9)
+        self.columns = int(width // self.cell_size) + 1
+        self.rows = int(height // self.cell_size) + 1
+        self.cells = {}
+        for ix, (x, y) in enumerate(self.coords):
+            self.cells.setdefault(self.cell_of(x, y), []).append(ix)
+
+    @classmethod
+    def from_map(cls, map, cell_size=None):
+        ids = sorted(map.stations)
+        return cls(ids, map.stations.column('x', ids), map.stations.column('y', ids), cell_size)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def cell_of(self, x, y):
+        return int((x - self.min_x) // self.cell_size), int((y - self.min_y) // self.cell_size)
+
+    def distance(self, ix, coord):
+        x, y = self.coords[ix]
+        return math.sqrt((x - coord[0]) ** 2 + (y - coord[1]) ** 2)
+
+    def ring(self, cx, cy, r):
+        # Cells whose Chebyshev distance to (cx, cy) is exactly r
+        if r == 0:
+            yield cx, cy
+            return
+        for i in range(cx - r, cx + r + 1):
+            yield i, cy - r
+            yield i, cy + r
+        for j in range(cy - r + 1, cy + r):
+            yield cx - r, j
+            yield cx + r, j
+
+    def nearest(self, coord, k=1):
+        """
+         The k stations closest to coord
+         Format of the parameter is:
+            Args:
+                coord (list): Two REAL values, which refer to the coordinates of a point in the city
+                k (int): Number of stations
+            Returns:
+                (list): k tuples (distance, station_id) sorted by distance and station id
+        """
+        k = min(k, len(self.ids))
+        if k <= 0:
+            return []
+        cx, cy = self.cell_of(coord[0], coord[1])
+        # First ring that touches the grid and number of rings needed to cover it from the cell of coord
+        r = max(0, -cx, cx - self.columns + 1, -cy, cy - self.rows + 1)
+        max_ring = max(abs(cx), abs(cy), abs(cx - self.columns + 1), abs(cy - self.rows + 1))
+        found = []
+        while True:
+            for cell in self.ring(cx, cy, r):
+                for ix in self.cells.get(cell, ()):
+                    found.append((self.distance(ix, coord), self.ids[ix]))
+            # Stations in the cells not visited yet are further than r * cell_size
+            if len(found) >= k:
+                found.sort()
+                if found[k - 1][0] <= r * self.cell_size or r >= max_ring:
+                    return found[:k]
+            r += 1
+
+    def within(self, coord, radius):
+        """
+         The stations at distance radius or less from coord
+         Format of the parameter is:
+            Args:
+                coord (list): Two REAL values, which refer to the coordinates of a point in the city
+                radius (float): Maximum distance
+            Returns:
+                (list): tuples (distance, station_id) sorted by distance and station id
+        """
+        x0, y0 = self.cell_of(coord[0] - radius, coord[1] - radius)
+        x1, y1 = self.cell_of(coord[0] + radius, coord[1] + radius)
+        x0, y0, x1, y1 = max(x0, 0), max(y0, 0), min(x1, self.columns - 1), min(y1, self.rows - 1)
+        found = []
+        for i in range(x0, x1 + 1):
+            for j in range(y0, y1 + 1):
+                for ix in self.cells.get((i, j), ()):
+                    distance = self.distance(ix, coord)
+                    if distance <= radius:
+                        found.append((distance, self.ids[ix]))
+        found.sort()
+        return found
+
+    def distances(self, coord):
+        """
+         Vectorized fallback: the distance from coord to every station in one array operation. For coordinates
+         that are not integers the result can differ from euclidean_dist in the last bit.
+         Format of the parameter is:
+            Args:
+                coord (list): Two REAL values, which refer to the coordinates of a point in the city
+            Returns:
+                (numpy array): Distance to every station, in the order of self.ids
+        """
+        return np.sqrt((self.xs - coord[0]) ** 2 + (self.ys - coord[1]) ** 2)
+
+    def sorted_distances(self, coord):
+        # (distance, station_id) for every station, sorted by distance and station id
+        distances = self.distances(coord)
+        order = np.lexsort((np.asarray(self.ids), distances))
+        values = distances.tolist()
+        return [(values[ix], self.ids[ix]) for ix in order.tolist()]
+
+
+def spatial_index(map):
+    """
+        The SpatialIndex of a map. It is built the first time and kept in map.precomputed.
+    """
+    if 'spatial_index' not in map.precomputed:
+        map.precomputed['spatial_index'] = SpatialIndex.from_map(map)
+    return map.precomputed['spatial_index']
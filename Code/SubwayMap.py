@@ -4,12 +4,26 @@
 # Universitat Autonoma de Barcelona
 # _________________________________________________________________________________________
 
+import heapq
+from collections import deque
+from collections.abc import Mapping
+from array import array
+import numpy as np
+
+# Bits of the fingerprint of the stations of a LinkedPath (see LinkedPath), minus one
+FINGERPRINT_MASK = 255
+# Every node of a station set (see station_set_add) has 2 ** STATION_SET_BITS slots, chosen by STATION_SET_BITS bits of the station id
+STATION_SET_BITS = 4
+STATION_SET_MASK = (1 << STATION_SET_BITS) - 1
+
+
 class Map:
     """
     A class for keeping all the data regarding stations and their connections
 
     self.stations: is a dictionary of dictionary with the format of
             {station_id: {"name": name_value, "line": line_value, ...}
+            It is stored as a StationTable, a read-only view with that format over one typed array per field.
 
     self.connections: is a dictionary of dictionary holding all the connection information with the format of
             {
@@ -17,26 +31,439 @@ class Map:
                 station_2 : {first_connection_to_station_2: cost_2_1, second_connection_to_station_1: cost_2_2}
                 ....
             }
+            It is stored as a ConnectionTable, a dict whose every change is seen by the map: writing a cost
+            (map.connections[station_1][station_2] = cost, or with update, setdefault, ...) is the same as calling
+            update_connection, and replacing or removing a whole row counts as a change of the map.
+            When the connections are stored as a CSRGraph (see add_connection and use_csr), self.connections is a
+            read-only view with the same format and self.csr holds the graph, so update_connection is the only way
+            to change a cost.
+
+    self.precomputed: data derived from the map (the CSR graph of the connections, ...). It is emptied every time
+            the stations, connections or velocities change.
+
+    self.version: counter increased every time the stations, connections or velocities change, so the results
+            computed with an older version of the map can be discarded.
+
+    self.connection_updates: the last changes of the cost of one connection (update_connection, or a write to a
+            row of self.connections), as (version, station_1, station_2). Every one of them increases the version
+            by one and adds one entry, so the changes since a version are all known when the version grew as much
+            as the number of entries after it.
     """
 
     def __init__(self):
-        self.stations = {}
+        self.stations = StationTable()
         self.connections = {}
         self.velocity = {}
+        self.csr = None
+        self.precomputed = {}
+        self.version = 0
+        self.connection_updates = deque(maxlen=1024)
+
+    def changed(self):
+        self.precomputed.clear()
+        self.version += 1
 
     def add_station(self, id, name, line, x, y):
-        self.stations[id] = {'name': name, 'line': int(line), 'x': x, 'y': y}
+        self.stations.add(id, name, line, x, y)
+        self.changed()
+
+    def set_stations(self, stations):
+        # Replaces all the stations with a StationTable
+        self.stations = stations
+        self.changed()
+
+    def is_transfer(self, station_1, station_2):
+        # Both stations have the same name, they are the same place on different lines
+        index, group = self.stations.index, self.stations.group
+        return group[index[station_1]] == group[index[station_2]]
 
     def add_connection(self, connections):
-        self.connections = connections
+        # connections is either the dictionary of dictionary or a CSRGraph
+        if isinstance(connections, CSRGraph):
+            self.csr = connections
+            self.connections = CSRConnections(connections)
+        else:
+            self.csr = None
+            self.connections = ConnectionTable(self, connections)
+        self.changed()
+
+    def connection_changed(self, station_1, station_2):
+        # The cost of the connection station_1 -> station_2 changed
+        self.changed()
+        self.connection_updates.append((self.version, station_1, station_2))
+
+    def update_connection(self, station_1, station_2, cost):
+        # Changes the cost of the connection station_1 -> station_2 (it is added if it does not exist). Only that
+        # direction changes: for a symmetric change call it again with station_2 -> station_1
+        if self.csr is None:
+            if station_1 not in self.connections:
+                dict.__setitem__(self.connections, station_1, ConnectionRow(self, station_1))
+            # The row logs the change
+            self.connections[station_1][station_2] = cost
+            return
+        else:
+            graph = self.csr
+            ix = graph.index[station_1]
+            start, end = graph.offsets[ix], graph.offsets[ix + 1]
+            positions = np.flatnonzero(graph.neighbor_ids[start:end] == station_2)
+            if len(positions):
+                # The weights of a memory-mapped snapshot are read-only, they are copied the first time
+                if not graph.weights.flags.writeable:
+                    graph.weights = np.array(graph.weights)
+                graph.weights[start + positions[0]] = cost
+            else:
+                connections = {s: dict(row) for s, row in self.connections.items()}
+                connections.setdefault(station_1, {})[station_2] = cost
+                self.csr = CSRGraph.from_connections(connections, ids=graph.ids)
+                self.connections = CSRConnections(self.csr)
+        self.connection_changed(station_1, station_2)
+
+    def use_csr(self):
+        # Replaces the dictionary of connections with its compressed sparse row graph
+        if self.csr is None:
+            self.add_connection(CSRGraph.from_connections(self.connections, ids=sorted(self.stations)))
+
+    @property
+    def graph(self):
+        # The connections as a CSRGraph, built once from the dictionary when they are not stored as CSR
+        if self.csr is not None:
+            return self.csr
+        if 'graph' not in self.precomputed:
+            self.precomputed['graph'] = CSRGraph.from_connections(self.connections, ids=sorted(self.stations))
+        return self.precomputed['graph']
+
+    def neighbors(self, station):
+        if self.csr is not None:
+            return self.csr.neighbors(station)
+        return self.connections[station].keys()
 
     def combine_dicts(self):
-        for k, v in self.stations.items():
-            v.update({'velocity': self.velocity[v['line']]})
+        self.stations.set_velocity(self.velocity)
 
     def add_velocity(self, velocity):
         self.velocity = {ix + 1: v for ix, v in enumerate(velocity)}
         self.combine_dicts()
+        self.changed()
+
+
+class StationTable(Mapping):
+    """
+    The stations of a map as one typed array per field, over dense indices in order of insertion.
+
+    self.ids: int32 array with the station id of every index
+    self.group: int32 array with the transfer group of every index. Names are interned, stations with the same
+            name share the group, so transfer checks compare two integers
+    self.line: int16 array with the line of every index
+    self.x, self.y: float64 arrays with the coordinates of every index
+    self.velocity: float64 array with the velocity of the line of every index (nan before set_velocity)
+    self.names: the name of every group
+    self.index: dictionary {station_id: index}
+    Reading map.stations[id]['x'] works as with the dictionary of dictionary, through a StationView.
+    Usage:
+        # >>> table = StationTable()
+        # >>> table.add(1, 'MASSENA', 1, 80, 100)
+        # >>> table[1]['name'], table.column('x')
+    """
+
+    def __init__(self):
+        self.ids = array('i')
+        self.group = array('i')
+        self.line = array('h')
+        self.x = array('d')
+        self.y = array('d')
+        self.velocity = array('d')
+        self.names = []
+        self.groups = {}
+        self.index = {}
+        self.velocity_of_line = None
+
+    @classmethod
+    def from_arrays(cls, ids, names, group, line, x, y):
+        # Builds the table from whole columns, names is the name of every group
+        table = cls()
+        table.ids = array('i', np.asarray(ids, dtype=np.int32).tobytes())
+        table.group = array('i', np.asarray(group, dtype=np.int32).tobytes())
+        table.line = array('h', np.asarray(line, dtype=np.int16).tobytes())
+        table.x = array('d', np.asarray(x, dtype=np.float64).tobytes())
+        table.y = array('d', np.asarray(y, dtype=np.float64).tobytes())
+        table.velocity = array('d', [float('nan')]) * len(table.ids)
+        table.names = list(names)
+        table.groups = {name: group for group, name in enumerate(table.names)}
+        table.index = {station: ix for ix, station in enumerate(table.ids)}
+        return table
+
+    def add(self, id, name, line, x, y):
+        group = self.groups.setdefault(name, len(self.names))
+        if group == len(self.names):
+            self.names.append(name)
+        line = int(line)
+        velocity = self.velocity_of_line.get(line, float('nan')) if self.velocity_of_line else float('nan')
+        if id in self.index:
+            ix = self.index[id]
+            self.group[ix], self.line[ix], self.x[ix], self.y[ix], self.velocity[ix] = group, line, x, y, velocity
+        else:
+            self.index[id] = len(self.ids)
+            self.ids.append(id)
+            self.group.append(group)
+            self.line.append(line)
+            self.x.append(x)
+            self.y.append(y)
+            self.velocity.append(velocity)
+
+    def set_velocity(self, velocity):
+        # velocity is the dictionary {line: velocity}
+        self.velocity_of_line = dict(velocity)
+        self.velocity = array('d', [velocity[line] for line in self.line])
+
+    def column(self, field, ids=None):
+        """
+            A NumPy copy of one field ('ids', 'group', 'line', 'x', 'y' or 'velocity'), in order of index or, if
+            ids is given, in the order of ids
+        """
+        values = np.array(getattr(self, field))
+        if ids is not None:
+            values = values[[self.index[station] for station in ids]]
+        return values
+
+    def coord(self, station):
+        ix = self.index[station]
+        return self.x[ix], self.y[ix]
+
+    def __getitem__(self, station):
+        if station not in self.index:
+            raise KeyError(station)
+        return StationView(self, self.index[station])
+
+    def __contains__(self, station):
+        return station in self.index
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class StationView(Mapping):
+    """
+    Read-only view of one station of a StationTable: {'name', 'line', 'x', 'y', 'velocity'}
+    """
+
+    def __init__(self, table, ix):
+        self.table = table
+        self.ix = ix
+
+    def keys(self):
+        if self.table.velocity_of_line is None:
+            return ['name', 'line', 'x', 'y']
+        return ['name', 'line', 'x', 'y', 'velocity']
+
+    def __getitem__(self, field):
+        if field == 'name':
+            return self.table.names[self.table.group[self.ix]]
+        if field in ('line', 'x', 'y') or (field == 'velocity' and self.table.velocity_of_line is not None):
+            return getattr(self.table, field)[self.ix]
+        raise KeyError(field)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class CSRGraph:
+    """
+    A compressed sparse row adjacency of the connections over dense station indices 0..N-1.
+
+    self.ids: int32 array with the station id of every index
+    self.offsets: int32 array of N+1 values, the connections of index i are the positions offsets[i]:offsets[i+1]
+    self.neighbors: int32 array with the index of the destination station of every connection
+    self.weights: float64 array with the cost of every connection
+    self.index: dictionary {station_id: index}
+    Usage:
+        # >>> graph = CSRGraph.from_connections({1: {2: 9.05}, 2: {1: 9.05}})
+        # Station ids connected to station 1 and their costs (slices of the arrays)
+        # >>> graph.neighbors(1), graph.row(1)
+    """
+
+    def __init__(self, ids, offsets, neighbors, weights):
+        self.ids = np.asarray(ids, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int32)
+        self.neighbors_index = np.asarray(neighbors, dtype=np.int32)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.neighbor_ids = self.ids[self.neighbors_index]
+        self.index = {station: ix for ix, station in enumerate(self.ids.tolist())}
+
+    @classmethod
+    def from_edges(cls, sources, targets, weights, ids):
+        # sources and targets are station ids, ids is the list of all the station ids
+        ids = np.asarray(ids, dtype=np.int32)
+        position = np.full(int(ids.max()) + 1 if len(ids) else 1, -1, dtype=np.int64)
+        position[ids] = np.arange(len(ids))
+        rows = position[np.asarray(sources, dtype=np.int64)]
+        cols = position[np.asarray(targets, dtype=np.int64)]
+        order = np.lexsort((cols, rows))
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(ids)), out=offsets[1:])
+        return cls(ids, offsets, cols[order], np.asarray(weights, dtype=np.float64)[order])
+
+    @classmethod
+    def from_connections(cls, connections, ids=None):
+        if ids is None:
+            ids = sorted(set(connections).union(*(row.keys() for row in connections.values())))
+        sources = [s for s, row in connections.items() for _ in row]
+        targets = [t for row in connections.values() for t in row]
+        weights = [c for row in connections.values() for c in row.values()]
+        return cls.from_edges(sources, targets, weights, ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, station):
+        return station in self.index
+
+    def neighbors(self, station):
+        ix = self.index[station]
+        return self.neighbor_ids[self.offsets[ix]:self.offsets[ix + 1]].tolist()
+
+    def row(self, station):
+        ix = self.index[station]
+        start, end = self.offsets[ix], self.offsets[ix + 1]
+        return self.neighbor_ids[start:end], self.weights[start:end]
+
+
+class LoggedDict(dict):
+    """
+    A dict whose methods that change it (update, setdefault, pop, popitem, clear, |=) all go through __setitem__
+    and __delitem__, so a subclass only overrides those two to see every change. copy and pickle rebuild it with
+    __reduce__ instead of __setitem__.
+    """
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key not in self:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        value = dict.__getitem__(self, key)
+        del self[key]
+        return value
+
+    def popitem(self):
+        if not self:
+            raise KeyError('popitem(): dictionary is empty')
+        key = next(reversed(self))
+        return key, self.pop(key)
+
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+
+class ConnectionTable(LoggedDict):
+    """
+    The dictionary of dictionary of Map.connections. Its rows are ConnectionRow, so a cost written in a row is
+    logged in the map. Setting or deleting a whole row (also with update, pop, ...) changes the map, without an
+    entry in map.connection_updates.
+    """
+
+    def __init__(self, map, connections=()):
+        super().__init__()
+        self.map = map
+        for station, row in dict(connections).items():
+            dict.__setitem__(self, station, ConnectionRow(map, station, row))
+
+    def __reduce__(self):
+        return ConnectionTable, (self.map, {station: dict(row) for station, row in self.items()})
+
+    def __setitem__(self, station, row):
+        dict.__setitem__(self, station, ConnectionRow(self.map, station, row))
+        self.map.changed()
+
+    def __delitem__(self, station):
+        dict.__delitem__(self, station)
+        self.map.changed()
+
+
+class ConnectionRow(LoggedDict):
+    """
+    The connections of one station of Map.connections: {connected_station: cost}. Every cost written or deleted
+    (also with update, pop, clear, ...) is logged in the map as update_connection does.
+    """
+
+    def __init__(self, map, station, row=()):
+        super().__init__(row)
+        self.map = map
+        self.station = station
+
+    def __reduce__(self):
+        return ConnectionRow, (self.map, self.station, dict(self))
+
+    def __setitem__(self, station, cost):
+        dict.__setitem__(self, station, cost)
+        self.map.connection_changed(self.station, station)
+
+    def __delitem__(self, station):
+        dict.__delitem__(self, station)
+        self.map.connection_changed(self.station, station)
+
+
+class CSRConnections(Mapping):
+    """
+    Read-only view of a CSRGraph with the format of Map.connections: {station: {connected_station: cost}}
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __getitem__(self, station):
+        if station not in self.graph.index:
+            raise KeyError(station)
+        return CSRRow(*self.graph.row(station))
+
+    def __iter__(self):
+        return iter(self.graph.ids.tolist())
+
+    def __len__(self):
+        return len(self.graph)
+
+
+class CSRRow(Mapping):
+    """
+    Read-only view of the connections of one station: {connected_station: cost}
+    """
+
+    def __init__(self, neighbor_ids, weights):
+        self.ids = neighbor_ids.tolist()
+        self.weights = weights
+
+    def __getitem__(self, station):
+        try:
+            return self.weights[self.ids.index(station)]
+        except ValueError:
+            raise KeyError(station)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
 
 
 class Path:
@@ -74,6 +501,9 @@ class Path:
         if other is not None:
             return self.route == other.route
 
+    def __len__(self):
+        return len(self.route)
+
     def update_h(self, h):
         self.h = h
 
@@ -88,3 +518,204 @@ class Path:
         self.route.append(children)
         self.penultimate = self.route[-2]
         self.last = self.route[-1]
+
+    def extend(self, children):
+        # New path with a copy of the route plus the children station, keeping the real cost
+        path = Path(list(self.route))
+        path.g = self.g
+        path.add_route(children)
+        return path
+
+    def has_cycle(self):
+        return len(set(self.route)) != len(self.route)
+
+
+# Empty node of a station set
+STATION_SET = (None,) * (1 << STATION_SET_BITS)
+
+
+def station_set_add(node, station, shift=0):
+    """
+     Persistent set of station ids, kept as a hash trie: every node is a tuple with one slot per STATION_SET_BITS
+     bits of the ids, holding None, a station id or the node of the stations that share those bits. Adding a
+     station copies only the nodes from the root to its slot and shares all the others, so the set of a path and
+     the one of the path it was extended from share almost all their nodes. Adding and looking for a station
+     visit as many nodes as bits are needed to tell it apart from the other stations of the set (about log16 of
+     their number), never the whole set.
+     Format of the parameter is:
+        Args:
+            node (tuple): The set, STATION_SET when it is empty
+            station (int): Station id
+        Returns:
+            (tuple): The set with station, node itself if station was already in it
+    """
+    slot = station >> shift & STATION_SET_MASK
+    entry = node[slot]
+    if entry is None:
+        entry = station
+    elif type(entry) is tuple:
+        child = station_set_add(entry, station, shift + STATION_SET_BITS)
+        if child is entry:
+            return node
+        entry = child
+    elif entry == station:
+        return node
+    else:
+        # Two stations in the same slot, they go one level down
+        entry = station_set_add(station_set_add(STATION_SET, entry, shift + STATION_SET_BITS), station,
+                                shift + STATION_SET_BITS)
+    return node[:slot] + (entry,) + node[slot + 1:]
+
+
+def station_set_contains(node, station):
+    shift = 0
+    while True:
+        entry = node[station >> shift & STATION_SET_MASK]
+        if type(entry) is not tuple:
+            return entry == station
+        node, shift = entry, shift + STATION_SET_BITS
+
+
+class LinkedPath:
+    """
+    A compact alternative to Path for the searches. Instead of copying the whole route, every path keeps a
+    pointer to the path it was extended from, so extending a path only creates one small object.
+    Every path keeps a fingerprint of its stations: a 256 bit mask with the bit station_id % 256 of every
+    station. A station whose bit is not set is not in the route, which answers most cycle checks with a single
+    AND, and while all the ids of the route are below 256 (exact) a bit that is set means that the station is in
+    it. Otherwise the station is looked for in the station set of the route (see station_set_add).
+    The set is built the first time it is needed, from the set of the closest parent that has one, so every path
+    adds its station to a set at most once and both extending a path and the cycle check take a time that does
+    not depend on the length of the route nor on the range of the station ids.
+    Usage:
+        # path is initialized with starting station number 2
+        # >>> path = LinkedPath(2)
+        # A new path ending at station 5 is created, path is not modified
+        # >>> child = path.extend(5)
+        # The route is rebuilt on demand and can be converted to a plain Path
+        # >>> child.route, child.to_path()
+    """
+    __slots__ = ('parent', 'head', 'last', 'length', 'fingerprint', 'exact', 'stations', 'cycle', 'g', 'h', 'f')
+
+    def __init__(self, station, parent=None):
+        self.parent = parent
+        self.last = station
+        self.stations = None
+        if parent is None:
+            self.head = station
+            self.length = 1
+            self.fingerprint = 1 << (int(station) & FINGERPRINT_MASK)
+            self.exact = 0 <= station <= FINGERPRINT_MASK
+            self.cycle = False
+            self.g = 0
+        else:
+            self.head = parent.head
+            self.length = parent.length + 1
+            bit = 1 << (int(station) & FINGERPRINT_MASK)
+            self.fingerprint = parent.fingerprint | bit
+            self.exact = parent.exact and 0 <= station <= FINGERPRINT_MASK
+            self.cycle = parent.cycle or (parent.fingerprint & bit != 0 and parent.visits(station))
+            self.g = parent.g
+        self.h = 0
+        self.f = 0
+
+    @property
+    def penultimate(self):
+        return self.parent.last
+
+    @property
+    def route(self):
+        route = []
+        path = self
+        while path is not None:
+            route.append(path.last)
+            path = path.parent
+        route.reverse()
+        return route
+
+    def __eq__(self, other):
+        if other is not None:
+            return self.route == other.route
+
+    def __len__(self):
+        return self.length
+
+    def update_h(self, h):
+        self.h = h
+
+    def update_g(self, g):
+        self.g += g
+
+    def update_f(self):
+        self.f = self.g + self.h
+
+    def extend(self, children):
+        return LinkedPath(children, self)
+
+    def has_cycle(self):
+        return self.cycle
+
+    def visits(self, station):
+        # Whether station is in the route
+        if not self.fingerprint >> (int(station) & FINGERPRINT_MASK) & 1:
+            return False
+        if self.exact and 0 <= station <= FINGERPRINT_MASK:
+            return True
+        return station_set_contains(self.station_set(), int(station))
+
+    def station_set(self):
+        # The station set of the route, built from the closest parent that has one
+        if self.stations is None:
+            pending = []
+            path = self
+            while path is not None and path.stations is None:
+                pending.append(path)
+                path = path.parent
+            node = STATION_SET if path is None else path.stations
+            for path in reversed(pending):
+                node = station_set_add(node, int(path.last))
+                path.stations = node
+        return self.stations
+
+    def to_path(self):
+        path = Path(self.route)
+        path.g, path.h, path.f = self.g, self.h, self.f
+        return path
+
+
+class PathFrontier:
+    """
+    A binary-heap priority queue holding the paths to be visited by the cost based searches.
+    Paths are ordered by key(path); ties are broken exactly like the stable sort used by insert_cost and
+    insert_cost_f: paths pushed in a later batch come first and, inside a batch, they keep their order.
+    Usage:
+        # frontier is initialized ordering paths by (g, number of stations)
+        # >>> frontier = PathFrontier(lambda path: (path.g, len(path.route)), [Path(2)])
+        # The paths returned by expand() are pushed together as one batch
+        # >>> frontier.push_batch(expanded_paths)
+        # Pop the cheapest path, skipping the entries that is_stale(path) reports as outdated
+        # >>> head = frontier.pop(is_stale)
+    """
+
+    def __init__(self, key, paths=None):
+        self.key = key
+        self.heap = []
+        self.batch = 0
+        if paths:
+            self.push_batch(paths)
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push_batch(self, paths):
+        # Batches are numbered downwards so that the newest one wins the ties
+        self.batch -= 1
+        for ix, path in enumerate(paths):
+            heapq.heappush(self.heap, (self.key(path), self.batch, ix, path))
+
+    def pop(self, is_stale=None):
+        while self.heap:
+            path = heapq.heappop(self.heap)[-1]
+            if is_stale is None or not is_stale(path):
+                return path
+        return None
@@ -1,10 +1,34 @@
 import unittest
 from SearchAlgorithm import (
     __author__, expand, calculate_cost, calculate_heuristics, remove_cycles, depth_first_search,
-    breadth_first_search, uniform_cost_search, remove_redundant_paths, distance_to_stations, Astar, Astar_improved)
-from SubwayMap import Path
-from utils import print_list_of_path_with_cost, read_station_information, read_cost_table, read_information
+    breadth_first_search, uniform_cost_search, remove_redundant_paths, distance_to_stations, Astar, Astar_improved,
+    insert_cost, bidirectional_search, compare_expansions, compare_heuristics, precompute_landmarks,
+    zero_one_bfs, pareto_search, k_shortest_paths, iter_depth_first_search, iter_breadth_first_search,
+    iter_uniform_cost_search, iter_Astar, anytime_search, shortest_path_costs, SearchStats, isochrone)
+from SubwayMap import Path, LinkedPath, PathFrontier, StationTable
+from utils import (print_list_of_path_with_cost, read_station_information, read_cost_table, read_cost_graph,
+                   read_cost_edges, read_information, euclidean_dist, WALKING_SPEED)
+from MapSnapshot import load_city, is_fresh
+from RouteTables import precompute_route_tables, route_query, save_route_tables, load_route_tables
+from SpatialIndex import spatial_index
+from BatchRouting import route_batch
+from RouteCache import RouteCache
+from ContractionHierarchy import contraction_hierarchy, save_contraction_hierarchy, load_contraction_hierarchy
+from IncrementalPlanner import IncrementalPlanner
+from Benchmark import run_benchmark, compare_benchmarks
+from CityGenerator import generate_city
+from RoutingService import RoutingService
+import numpy as np
+import asyncio
+import copy
+import itertools
+import json
 import os
+import pickle
+import random
+import shutil
+import tempfile
+import time
 
 
 def create_path_with_cost_g(list_nodes, cost_g):
@@ -31,6 +55,7 @@ def get_cost(path, subway_map, type_preference):
 
 class TestCases(unittest.TestCase):
     ROOT_FOLDER = 'CityInformation/Lyon_smallCity/'
+    BIG_CITY_FOLDER = 'CityInformation/Lyon_bigCity/'
 
     def setUp(self):
         subway_map = read_station_information(os.path.join(self.ROOT_FOLDER, 'Stations.txt'))
@@ -74,6 +99,87 @@ class TestCases(unittest.TestCase):
         expanded_paths = remove_cycles(expanded_paths)
         self.assertEqual(expanded_paths, [Path([14, 13, 8, 12, 11])])
 
+    def test_LinkedPath(self):
+        path = LinkedPath(14)
+        for station in [13, 8, 12]:
+            path = path.extend(station)
+        self.assertEqual(path, Path([14, 13, 8, 12]))
+        self.assertEqual((path.head, path.penultimate, path.last, len(path)), (14, 8, 12, 4))
+
+        expanded_paths = expand(path, self.map)
+        self.assertEqual(expanded_paths, [Path([14, 13, 8, 12, 8]),
+                                          Path([14, 13, 8, 12, 11]),
+                                          Path([14, 13, 8, 12, 13])])
+        self.assertEqual([p.has_cycle() for p in expanded_paths], [True, False, True])
+        self.assertEqual(remove_cycles(expanded_paths), [Path([14, 13, 8, 12, 11])])
+        self.assertEqual(path.route, [14, 13, 8, 12])
+
+        # Stations with the same bit in the fingerprint are told apart through the route, whatever their ids are
+        path = LinkedPath(100000).extend(100256).extend(356)
+        self.assertEqual([path.has_cycle(), path.extend(100000).has_cycle()], [False, True])
+        self.assertEqual([path.visits(100256), path.visits(512)], [True, False])
+        self.assertLess(path.fingerprint, 1 << 256)
+
+        # On a single line the route of depth_first_search grows to every station: the time per station must not
+        # grow with the length of the route
+        with tempfile.TemporaryDirectory() as folder:
+            time_per_station = []
+            for stations in [300, 6000]:
+                generate_city(folder, lines=1, stations_per_line=stations, seed=1, edge_list=True)
+                line_map = read_station_information(os.path.join(folder, 'Stations.txt'))
+                line_map.add_connection(read_cost_table(os.path.join(folder, 'Time.txt')))
+                times = []
+                for _ in range(3):
+                    start = time.perf_counter()
+                    self.assertEqual(len(depth_first_search(1, stations, line_map)), stations)
+                    times.append(time.perf_counter() - start)
+                time_per_station.append(min(times) / stations)
+            self.assertLess(time_per_station[1], 4 * time_per_station[0])
+
+    def test_CSRGraph(self):
+        connections = self.map.connections
+        graph = read_cost_graph(os.path.join(self.ROOT_FOLDER, 'Time.txt'))
+        self.assertEqual(graph.neighbors(12), [8, 11, 13])
+        self.assertEqual(self.map.graph.neighbor_ids.tolist(), graph.neighbor_ids.tolist())
+
+        self.map.add_connection(graph)
+        self.assertEqual({k: dict(self.map.connections[k]) for k in connections}, connections)
+        self.assertEqual(self.map.connections[7][8], connections[7][8])
+        self.assertNotIn(9, self.map.connections[7])
+        self.assertEqual(expand(Path([13, 12]), self.map), [Path([13, 12, 8]), Path([13, 12, 11]), Path([13, 12, 13])])
+        self.assertEqual(uniform_cost_search(9, 3, self.map, 1), Path([9, 8, 12, 11, 10, 2, 3]))
+        self.assertEqual(Astar(9, 4, self.map, 2).f, 326.53992)
+
+    def test_map_snapshot(self):
+        with tempfile.TemporaryDirectory() as folder:
+            for filename in ['Stations.txt', 'Time.txt', 'InfoVelocity.txt']:
+                shutil.copy(os.path.join(self.ROOT_FOLDER, filename), folder)
+            self.assertFalse(is_fresh(folder))
+            snapshot_map = load_city(folder)
+            self.assertTrue(is_fresh(folder))
+            self.assertEqual(snapshot_map.stations, self.map.stations)
+            self.assertEqual(snapshot_map.velocity, self.map.velocity)
+            self.assertEqual({k: dict(v) for k, v in snapshot_map.connections.items()}, self.map.connections)
+            self.assertEqual(Astar(9, 4, snapshot_map, 2).f, 326.53992)
+
+            # Same content with a new mtime keeps the snapshot, a new content invalidates it
+            time_file = os.path.join(folder, 'Time.txt')
+            os.utime(time_file, ns=(0, 0))
+            self.assertTrue(is_fresh(folder))
+            with open(time_file) as fp:
+                content = fp.read()
+            with open(time_file, 'w') as fp:
+                fp.write(content.replace('4.21603', '5.00000'))
+            self.assertFalse(is_fresh(folder))
+            self.assertEqual(load_city(folder).connections[2][3], 5)
+
+            # A source file that is gone makes the snapshot stale instead of failing
+            velocity_file = os.path.join(folder, 'InfoVelocity.txt')
+            os.rename(velocity_file, velocity_file + '.old')
+            self.assertFalse(is_fresh(folder))
+            os.rename(velocity_file + '.old', velocity_file)
+            self.assertTrue(is_fresh(folder))
+
     def test_depth_first_search(self):
         route1 = depth_first_search(2, 7, self.map)
         route2 = depth_first_search(13, 1, self.map)
@@ -128,6 +234,20 @@ class TestCases(unittest.TestCase):
         route = uniform_cost_search(9, 3, self.map, 3)
         self.assertEqual(route, Path([9, 8, 7, 6, 5, 2, 3]))
 
+    def test_PathFrontier(self):
+        first_batch = [create_path_with_cost_g([7, 6], 4), create_path_with_cost_g([7, 8], 6)]
+        second_batch = [create_path_with_cost_g([7, 8, 9], 6), create_path_with_cost_g([7, 6, 5], 4),
+                        create_path_with_cost_g([7, 8, 12], 6)]
+        frontier = PathFrontier(lambda x: (x.g, len(x.route)))
+        frontier.push_batch(first_batch)
+        frontier.push_batch(second_batch)
+        popped = [frontier.pop() for _ in range(len(frontier))]
+        self.assertEqual(popped, insert_cost(second_batch, insert_cost(first_batch, [])))
+        self.assertIsNone(frontier.pop())
+
+        frontier = PathFrontier(lambda x: (x.g, len(x.route)), first_batch)
+        self.assertEqual(frontier.pop(lambda x: x.last == 6), Path([7, 8]))
+
     def test_calculate_heuristics(self):
         expanded_paths = [Path([12, 8, 7]), Path([12, 8, 9]), Path([12, 8, 13])]
         updated_paths = calculate_heuristics(expanded_paths, self.map, destination_id=9, type_preference=0)
@@ -187,6 +307,20 @@ class TestCases(unittest.TestCase):
         distances = distance_to_stations([10, 11], self.map)
         self.assertEqual(round(distances[1], 6), 88.729927)
 
+    def test_spatial_index(self):
+        index = spatial_index(self.map)
+        self.assertIs(index, spatial_index(self.map))
+        nearest = index.nearest([100, 200], 4)
+        self.assertEqual([(round(d, 2), s) for d, s in nearest], [(10.0, 8), (10.0, 12), (10.0, 13), (24.76, 9)])
+        self.assertEqual([s for d, s in index.within([100, 200], 60)], [8, 12, 13, 9, 7])
+        self.assertEqual(index.within([1000, 1000], 10), [])
+
+        for coord in [[300, 111], [10, 11], [-50, 400], [140.5, 56.25]]:
+            distances = [(d, s) for s, d in distance_to_stations(coord, self.map).items()]
+            self.assertEqual([s for d, s in index.nearest(coord, 5)], [s for d, s in distances[:5]])
+            self.assertEqual([s for d, s in index.within(coord, 100)], [s for d, s in distances if d <= 100])
+            self.assertEqual(len(index.nearest(coord, 20)), len(self.map.stations))
+
     def test_Astar(self):
         # If you want to see the optimal_path's route and f-cost,
         # uncomment the print functions below
@@ -212,6 +346,540 @@ class TestCases(unittest.TestCase):
                         optimal_path == Path([3, 2, 5, 6, 7, 8, 13, 14]))
         self.assertEqual(optimal_path.f, 2)
 
+    def test_route_tables(self):
+        tables = precompute_route_tables(self.map)
+        stations = sorted(self.map.stations)
+        for origin in stations:
+            for destination in stations:
+                if origin == destination:
+                    continue
+                for type_preference in [1, 2]:
+                    optimal_path = Astar(origin, destination, self.map, type_preference)
+                    path = route_query(origin, destination, tables, type_preference)
+                    self.assertEqual(path, optimal_path)
+                    self.assertEqual((path.g, path.f), (optimal_path.g, optimal_path.f))
+                self.assertEqual(route_query(origin, destination, tables, 0).g,
+                                 Astar(origin, destination, self.map, 0).g)
+
+        self.assertEqual(route_query(3, 14, tables, 3).g, 2)
+        with tempfile.TemporaryDirectory() as folder:
+            save_route_tables(tables, os.path.join(folder, 'tables.npz'))
+            loaded = load_route_tables(os.path.join(folder, 'tables.npz'))
+        self.assertEqual(route_query(9, 4, loaded, 2).f, 326.53992)
+
+    def test_contraction_hierarchy(self):
+        stations = sorted(self.map.stations)
+        for type_preference in [1, 2]:
+            hierarchy = contraction_hierarchy(self.map, type_preference)
+            for origin in stations:
+                for destination in stations:
+                    optimal_path = Astar(origin, destination, self.map, type_preference)
+                    path = hierarchy.route(origin, destination)
+                    self.assertEqual(path, optimal_path)
+                    self.assertEqual((path.g, path.f), (optimal_path.g, optimal_path.f))
+
+        with tempfile.TemporaryDirectory() as folder:
+            save_contraction_hierarchy(hierarchy, os.path.join(folder, 'hierarchy.npz'))
+            loaded = load_contraction_hierarchy(os.path.join(folder, 'hierarchy.npz'))
+        self.assertEqual(loaded.type_preference, 2)
+        self.assertEqual(loaded.route(9, 4), Path([9, 8, 12, 11, 10, 5, 4]))
+        self.assertEqual(loaded.route(9, 4).f, 326.53992)
+
+        # A sample of the routes of the big city
+        big_map = read_station_information(os.path.join(self.BIG_CITY_FOLDER, 'Stations.txt'))
+        big_map.add_connection(read_cost_table(os.path.join(self.BIG_CITY_FOLDER, 'Time.txt')))
+        big_map.add_velocity(read_information(os.path.join(self.BIG_CITY_FOLDER, 'InfoVelocity.txt')))
+        generator = random.Random(0)
+        stations = sorted(big_map.stations)
+        for type_preference in [1, 2]:
+            hierarchy = contraction_hierarchy(big_map, type_preference)
+            for _ in range(200):
+                origin, destination = generator.choice(stations), generator.choice(stations)
+                optimal_path = uniform_cost_search(origin, destination, big_map, type_preference)
+                path = hierarchy.route(origin, destination)
+                self.assertEqual(path, optimal_path)
+                self.assertEqual(path.g, optimal_path.g)
+
+    def test_route_batch(self):
+        queries = [(origin, destination, (origin + destination) % 4)
+                   for origin in self.map.stations for destination in self.map.stations if origin != destination]
+        with tempfile.TemporaryDirectory() as folder:
+            for filename in ['Stations.txt', 'Time.txt', 'InfoVelocity.txt']:
+                shutil.copy(os.path.join(self.ROOT_FOLDER, filename), folder)
+            results = list(route_batch(queries, folder, max_workers=2, chunksize=16))
+            self.assertEqual([query_id for query_id, _ in results], list(range(len(queries))))
+            for (query_id, path), (origin, destination, type_preference) in zip(results, queries):
+                self.assertEqual(path, Astar(origin, destination, self.map, type_preference))
+
+            results = dict(route_batch(queries[:40], folder, 'breadth_first_search', max_workers=2, chunksize=8,
+                                       ordered=False))
+            self.assertEqual(results[5], breadth_first_search(queries[5][0], queries[5][1], self.map))
+            self.assertEqual(len(results), 40)
+
+    def test_routing_service(self):
+        async def request(port, target, body=None):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            content = json.dumps(body).encode() if body is not None else b''
+            writer.write('{} {} HTTP/1.1\r\nContent-Length: {}\r\n\r\n'.format(
+                'GET' if body is None else 'POST', target, len(content)).encode() + content)
+            response = await reader.read()
+            writer.close()
+            head, _, content = response.partition(b'\r\n\r\n')
+            return int(head.split()[1]), json.loads(content)
+
+        async def run(service):
+            server = await service.start(port=0)
+            port = server.sockets[0].getsockname()[1]
+            answers = await asyncio.gather(*[request(port, '/route?origin=9&destination=4&type_preference=2')
+                                             for _ in range(5)])
+            self.assertEqual(answers[0], (200, {'algorithm': 'Astar', 'origin': 9, 'destination': 4,
+                                                'type_preference': 2, 'route': Astar(9, 4, self.map, 2).route,
+                                                'cost': Astar(9, 4, self.map, 2).g}))
+            self.assertTrue(all(answer == answers[0] for answer in answers))
+            status, answer = await request(port, '/route', {'origin': 1, 'destination': 14, 'type_preference': 1,
+                                                            'algorithm': 'uniform_cost_search'})
+            self.assertEqual(answer['route'], uniform_cost_search(1, 14, self.map, 1).route)
+            status, answer = await request(port, '/route_coordinates?origin=80,100&destination=100,240')
+            self.assertEqual(answer['route'], Astar_improved([80, 100], [100, 240], self.map).route)
+            self.assertEqual((await request(port, '/route?origin=9&destination=99'))[0], 400)
+            self.assertEqual((await request(port, '/route?origin=9&destination=4&algorithm=dfs'))[0], 400)
+            self.assertEqual((await request(port, '/unknown'))[0], 404)
+            # A body over the limit is not read, a request that is not sent whole times out
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'POST /route HTTP/1.1\r\nContent-Length: 1000000000\r\n\r\n')
+            self.assertTrue((await reader.read()).startswith(b'HTTP/1.1 413'))
+            writer.close()
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'POST /route HTTP/1.1\r\nContent-Length: 10\r\n\r\n{')
+            self.assertTrue((await reader.read()).startswith(b'HTTP/1.1 408'))
+            writer.close()
+            status, metrics = await request(port, '/metrics')
+            server.close()
+            await server.wait_closed()
+            return metrics
+
+        # The service compiles the snapshot of the city, a copy is used so nothing is written in ROOT_FOLDER
+        with tempfile.TemporaryDirectory() as folder:
+            for filename in ['Stations.txt', 'Time.txt', 'InfoVelocity.txt']:
+                shutil.copy(os.path.join(self.ROOT_FOLDER, filename), folder)
+            service = RoutingService(folder, max_workers=1, read_timeout=0.5)
+            try:
+                metrics = asyncio.run(run(service))
+            finally:
+                service.close()
+
+            # Identical requests in flight are computed once
+            service = RoutingService(folder, processes=False)
+            try:
+                async def identical():
+                    return await asyncio.gather(*[service.route(9, 4, 1) for _ in range(4)])
+                paths = asyncio.run(identical())
+            finally:
+                service.close()
+        self.assertEqual((metrics['requests'], metrics['errors'], metrics['in_flight']), (11, 5, 0))
+        self.assertEqual(metrics['searches'] + metrics['coalesced'], 7)
+        self.assertEqual(metrics['latency']['/route']['count'], 8)
+        self.assertEqual(sum(metrics['search_latency']['buckets'].values()), metrics['searches'])
+        self.assertEqual(paths, [Astar(9, 4, self.map, 1)] * 4)
+        self.assertEqual((service.counters['searches'], service.counters['coalesced']), (1, 3))
+
+    def test_route_cache(self):
+        cache = RouteCache(self.map, maxsize=2)
+        path = cache.route(2, 6, 1)
+        self.assertEqual(path, Path([2, 5, 6]))
+        self.assertEqual(path.f, 27.14286)
+        path.update_g(100)
+        path.add_route(7)
+        cached_path = cache.route(2, 6, 1)
+        self.assertEqual((cached_path, cached_path.g), (Path([2, 5, 6]), 27.14286))
+        self.assertEqual(cache.route(9, 3, algorithm='uniform_cost_search'), Path([9, 8, 7, 6, 5, 2, 3]))
+        self.assertEqual(cache.route(13, 1, algorithm='breadth_first_search'), Path([13, 12, 11, 10, 2, 1]))
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 3, 'evictions': 1, 'invalidations': 0,
+                                         'size': 2, 'maxsize': 2})
+
+        # Changing the connections empties the cache
+        connections = {k: dict(v) for k, v in self.map.connections.items()}
+        connections[2][5] = connections[5][2] = 100
+        self.map.add_connection(connections)
+        self.assertEqual(cache.route(2, 6, 1), Path([2, 10, 5, 6]))
+        self.assertEqual((cache.invalidations, len(cache)), (1, 1))
+
+    def test_bidirectional_search(self):
+        stations = sorted(self.map.stations)
+        for type_preference in [1, 2]:
+            for origin in stations:
+                for destination in stations:
+                    optimal_path = Astar(origin, destination, self.map, type_preference)
+                    path = bidirectional_search(origin, destination, self.map, type_preference)
+                    self.assertEqual(path, optimal_path)
+                    self.assertEqual((path.g, path.f), (optimal_path.g, optimal_path.f))
+
+        stats = {}
+        self.assertEqual(bidirectional_search(9, 4, self.map, 2, stats=stats).f, 326.53992)
+        self.assertEqual(compare_expansions(9, 4, self.map, 2), {'Astar': 22, 'bidirectional_search': 12})
+        self.assertEqual(stats['expanded'], 12)
+
+    def test_zero_one_bfs(self):
+        stations = sorted(self.map.stations)
+        for origin in stations:
+            for destination in stations:
+                optimal_path = uniform_cost_search(origin, destination, self.map, 3)
+                path = zero_one_bfs(origin, destination, self.map)
+                self.assertEqual(path, optimal_path)
+                self.assertEqual((path.g, path.f), (optimal_path.g, optimal_path.f))
+
+        self.assertEqual(zero_one_bfs(3, 14, self.map).g, 2)
+        self.assertEqual(zero_one_bfs(9, 9, self.map), Path([9]))
+
+    def test_pareto_search(self):
+        stations = sorted(self.map.stations)
+        for origin in stations:
+            for destination in stations:
+                front = pareto_search(origin, destination, self.map)
+                times, transfers, distances = zip(*(costs for _, costs in front))
+                self.assertEqual(min(times), Astar(origin, destination, self.map, 1).g)
+                self.assertEqual(min(transfers), uniform_cost_search(origin, destination, self.map, 3).g)
+                self.assertAlmostEqual(min(distances), Astar(origin, destination, self.map, 2).g)
+                self.assertEqual(list(times), sorted(times))
+
+        front = pareto_search(9, 4, self.map)
+        self.assertEqual([path for path, _ in front], [Path([9, 8, 7, 6, 5, 4]), Path([9, 8, 12, 11, 10, 5, 4])])
+        self.assertEqual([costs for _, costs in front], [(25.33962, 0, 354.75468), (32.72972, 2, 326.53992)])
+        stats = {}
+        self.assertEqual(len(pareto_search(9, 4, self.map, max_labels=1, stats=stats)), 1)
+        self.assertEqual(stats['capped'], 3)
+
+    def test_Astar_vectorized(self):
+        stations = sorted(self.map.stations)
+        for heuristic in [None, 'alt']:
+            for type_preference in [0, 1, 2, 3]:
+                for origin in stations:
+                    for destination in stations:
+                        stats, vectorized_stats = {}, {}
+                        optimal_path = Astar(origin, destination, self.map, type_preference, stats=stats,
+                                             heuristic=heuristic)
+                        path = Astar(origin, destination, self.map, type_preference, stats=vectorized_stats,
+                                     heuristic=heuristic, vectorized=True)
+                        self.assertEqual(path, optimal_path)
+                        self.assertEqual((path.g, path.h, path.f), (optimal_path.g, optimal_path.h, optimal_path.f))
+                        self.assertEqual(vectorized_stats, stats)
+
+    def test_station_table(self):
+        stations = self.map.stations
+        self.assertIsInstance(stations, StationTable)
+        self.assertEqual(stations[1], {'name': 'MASSENA', 'line': 1, 'x': 67, 'y': 79, 'velocity': 10})
+        self.assertEqual(stations[2]['name'], stations[5]['name'])
+        self.assertEqual(stations.coord(2), (140, 56))
+        self.assertEqual(sorted(stations), list(range(1, 15)))
+        self.assertNotIn(15, stations)
+        self.assertRaises(KeyError, lambda: stations[15])
+        with self.assertRaises(TypeError):
+            stations[1]['x'] = 0
+
+        self.assertTrue(self.map.is_transfer(2, 5))
+        self.assertTrue(self.map.is_transfer(2, 10))
+        self.assertFalse(self.map.is_transfer(2, 3))
+        self.assertEqual(stations.column('group', [2, 5, 10, 3]).tolist(), [1, 1, 1, 2])
+        self.assertEqual(stations.column('line').dtype, np.int16)
+
+        self.map.add_station(1, 'CHARPENNES', 2, 60, 70)
+        self.assertEqual(len(stations), 14)
+        self.assertEqual(stations[1]['velocity'], 14)
+        self.assertTrue(self.map.is_transfer(1, 2))
+
+    def test_incremental_planner(self):
+        for type_preference in [0, 1, 2, 3]:
+            planner = IncrementalPlanner(self.map, 9, 4, type_preference)
+            self.assertEqual(planner.route().g, Astar(9, 4, self.map, type_preference).g)
+
+        planner = IncrementalPlanner(self.map, 9, 4, 1)
+        stats = {}
+        path = planner.route(stats)
+        first = stats['expanded']
+        station_1, station_2 = path.route[1], path.route[2]
+        self.map.update_connection(station_1, station_2, 100)
+        self.assertEqual(self.map.connections[station_1][station_2], 100)
+        stats = {}
+        path = planner.route(stats)
+        self.assertEqual(path, Astar(9, 4, self.map, 1))
+        self.assertLess(stats['expanded'], first)
+        # Like the searches, the planner adds its expansions to the ones already in stats
+        repaired = stats['expanded']
+        self.assertEqual(planner.route(stats), path)
+        self.assertEqual(stats['expanded'], repaired)
+        Astar(9, 4, self.map, 1, stats=stats)
+        self.assertGreater(stats['expanded'], repaired)
+        # Writing a cost in the connections is the same as update_connection, for one direction only
+        station_1, station_2 = path.route[1], path.route[2]
+        reverse = self.map.connections[station_2][station_1]
+        self.map.connections[station_1][station_2] = 1000
+        self.assertEqual(self.map.connections[station_2][station_1], reverse)
+        self.assertEqual(planner.route(), Astar(9, 4, self.map, 1))
+        self.assertEqual((planner.resets, planner.repairs), (1, 2))
+        self.map.connections[station_1].update({station_2: 1})
+        self.assertEqual(planner.route(), Astar(9, 4, self.map, 1))
+        self.assertEqual((planner.resets, planner.repairs), (1, 3))
+
+        # use_csr is not a connection update, the search starts again
+        self.map.use_csr()
+        self.map.update_connection(station_1, station_2, 1)
+        self.assertEqual(planner.route(), Astar(9, 4, self.map, 1))
+        self.map.update_connection(4, 9, 1)
+        self.assertEqual(planner.route(), Astar(9, 4, self.map, 1))
+        self.assertEqual((planner.resets, planner.repairs), (2, 4))
+        # The connections stored as CSR can only be changed with update_connection
+        with self.assertRaises(TypeError):
+            self.map.connections[station_1][station_2] = 1
+
+    def test_connection_table(self):
+        # Copies of the map keep logging the changes of their own connections
+        for copied in [copy.deepcopy(self.map), pickle.loads(pickle.dumps(self.map))]:
+            self.assertEqual(copied.connections, self.map.connections)
+            self.assertEqual(copied.version, self.map.version)
+            copied.connections[9][8] = 1000
+            self.assertEqual(copied.connection_updates[-1], (copied.version, 9, 8))
+            self.assertNotEqual(self.map.connections[9][8], 1000)
+            self.assertEqual(Astar(9, 4, copied, 1), uniform_cost_search(9, 4, copied, 1))
+
+        # The methods of dict that change a row log every cost they change
+        version = self.map.version
+        row = self.map.connections[9]
+        row.update({8: 30})
+        self.assertEqual(row.setdefault(8, 0), 30)
+        cost = row.pop(8)
+        self.assertEqual((cost, row.pop(8, None)), (30, None))
+        row |= {8: cost}
+        self.assertEqual(self.map.version, version + 3)
+        self.assertEqual([change[1:] for change in list(self.map.connection_updates)[-3:]], [(9, 8)] * 3)
+        self.map.connections.setdefault(15, {})[9] = 1
+        self.assertEqual(self.map.connection_updates[-1][1:], (15, 9))
+        row.clear()
+        self.assertEqual(self.map.connections[9], {})
+        self.assertEqual(self.map.connection_updates[-1][1:], (9, 8))
+
+    def test_benchmark(self):
+        algorithms = ['breadth_first_search', 'Astar/1', 'Astar_improved']
+        report = run_benchmark(['Lyon_smallCity'], count=5, seed=3, algorithms=algorithms, repeat=1)
+        self.assertEqual(sorted(report['results']), sorted('Lyon_smallCity|' + name for name in algorithms))
+        result = report['results']['Lyon_smallCity|Astar/1']
+        self.assertEqual(result['queries'], 5)
+        self.assertLessEqual(result['time']['p50'], result['time']['max'])
+        self.assertGreater(result['expanded']['mean'], 0)
+        self.assertGreater(result['frontier']['max'], 0)
+        self.assertIsNone(report['results']['Lyon_smallCity|Astar_improved']['expanded'])
+        again = run_benchmark(['Lyon_smallCity'], count=5, seed=3, algorithms=['Astar/1'], repeat=1)
+        self.assertEqual(again['results']['Lyon_smallCity|Astar/1']['expanded'], result['expanded'])
+        # The snapshot backend gives the same searches and does not write in the folder of the city
+        files = sorted(os.listdir(self.ROOT_FOLDER))
+        snapshot = run_benchmark(['Lyon_smallCity'], count=5, seed=3, algorithms=['Astar/1'], repeat=1,
+                                 backend='snapshot')
+        self.assertEqual(snapshot['results']['Lyon_smallCity|Astar/1']['expanded'], result['expanded'])
+        self.assertEqual((report['meta']['backend'], snapshot['meta']['backend']), ('dict', 'snapshot'))
+        self.assertEqual(sorted(os.listdir(self.ROOT_FOLDER)), files)
+
+        self.assertEqual(compare_benchmarks(report, report), [])
+        slower = {'results': {'Lyon_smallCity|Astar/1': dict(result, time={'p50': 1.0, 'p90': 1.0})}}
+        self.assertEqual([(key, metric) for key, metric, old, new in compare_benchmarks(report, slower)],
+                         [('Lyon_smallCity|Astar/1', 'time.p50'), ('Lyon_smallCity|Astar/1', 'time.p90')])
+        self.assertRaises(ValueError, run_benchmark, ['Lyon_smallCity'], algorithms=['Astar/4'])
+
+    def test_city_generator(self):
+        with tempfile.TemporaryDirectory() as folder:
+            counts = generate_city(folder, lines=4, stations_per_line=20, transfer_density=0.3, extent=200, seed=5)
+            city_map = read_station_information(os.path.join(folder, 'Stations.txt'))
+            city_map.add_connection(read_cost_table(os.path.join(folder, 'Time.txt')))
+            city_map.add_velocity(read_information(os.path.join(folder, 'InfoVelocity.txt')))
+            self.assertEqual(counts['stations'], 80)
+            self.assertEqual(sorted(city_map.stations), list(range(1, 81)))
+            self.assertEqual(sum(len(row) for row in city_map.connections.values()), counts['connections'])
+            self.assertEqual(len(city_map.velocity), 4)
+            self.assertTrue(all(0 <= station['x'] <= 200 and 0 <= station['y'] <= 200
+                                for station in city_map.stations.values()))
+            for station_1, row in city_map.connections.items():
+                for station_2, cost in row.items():
+                    self.assertEqual(city_map.connections[station_2][station_1], cost)
+                    lines = city_map.stations[station_1]['line'], city_map.stations[station_2]['line']
+                    self.assertEqual(city_map.is_transfer(station_1, station_2), lines[0] != lines[1])
+            self.assertGreater(counts['transfers'], 0)
+            self.assertTrue(np.isfinite(shortest_path_costs(city_map, 0)).all())
+
+            with open(os.path.join(folder, 'Time.txt')) as file:
+                content = file.read()
+            generate_city(folder, lines=4, stations_per_line=20, transfer_density=0.3, extent=200, seed=5)
+            with open(os.path.join(folder, 'Time.txt')) as file:
+                self.assertEqual(file.read(), content)
+
+    def test_search_stats(self):
+        searches = [lambda stats=None: depth_first_search(9, 4, self.map, stats),
+                    lambda stats=None: breadth_first_search(9, 4, self.map, stats),
+                    lambda stats=None: uniform_cost_search(9, 4, self.map, 2, stats),
+                    lambda stats=None: Astar(9, 4, self.map, 2, stats),
+                    lambda stats=None: Astar(9, 4, self.map, 2, stats, heuristic='alt'),
+                    lambda stats=None: Astar(9, 4, self.map, 2, stats, vectorized=True)]
+        for search in searches:
+            events = []
+            types = set()
+            stats = SearchStats(on_expand=lambda path: events.append('expand') or types.add(type(path)),
+                                on_prune=lambda path, reason: events.append(reason) or types.add(type(path)),
+                                on_goal=lambda path: events.append(path.route) or types.add(type(path)))
+            path = search(stats)
+            self.assertEqual(path, search())
+            self.assertEqual(events.count('expand'), stats['expanded'])
+            self.assertEqual(events.count('cycles'), stats['cycles'])
+            self.assertEqual(events.count('redundant'), stats['redundant'])
+            self.assertEqual(events[-1], path.route)
+            self.assertEqual(types, {Path})
+            self.assertGreater(stats['frontier_peak'], 0)
+
+        stats = SearchStats()
+        Astar(9, 4, self.map, 2, stats=stats)
+        self.assertEqual((stats['expanded'], stats['cycles'], stats['redundant']), (22, 27, 5))
+        self.assertGreater(stats['cost_time'], 0)
+        self.assertGreater(stats['heuristic_time'], 0)
+        stats = {}
+        Astar(9, 4, self.map, 2, stats=stats)
+        self.assertEqual(stats, {'expanded': 22})
+
+        stats = SearchStats(on_goal=lambda path: self.assertEqual(path.route[0], 0))
+        Astar_improved([80, 100], [100, 240], self.map, stats=stats)
+        self.assertTrue(0 < stats['expanded'] <= len(self.map.stations))
+        # With a plain dict only the expansions are counted, added to the ones already there
+        expanded = stats['expanded']
+        plain = {'expanded': 1}
+        Astar_improved([80, 100], [100, 240], self.map, stats=plain)
+        self.assertEqual(plain, {'expanded': expanded + 1})
+        stats = SearchStats()
+        isochrone(9, self.map, 30, stats=stats)
+        plain = {}
+        isochrone(9, self.map, 30, stats=plain)
+        isochrone(9, self.map, 30, stats=plain)
+        self.assertEqual(plain, {'expanded': 2 * stats['expanded']})
+        self.assertEqual(stats['expanded'], len(isochrone(9, self.map, 30)))
+        self.assertGreater(stats['frontier_peak'], 0)
+
+    def test_read_cost_edges(self):
+        count, sources, targets, costs = read_cost_edges(os.path.join(self.ROOT_FOLDER, 'Time.txt'))
+        self.assertEqual((count, len(sources)), (14, 32))
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'Time.txt')
+            with open(filename, 'w') as file:
+                file.write('# from to cost\n\n')
+                for station_1, station_2, cost in zip(sources, targets, costs):
+                    file.write('{} {} {}\n'.format(station_1, station_2, cost))
+            self.assertEqual(read_cost_table(filename), self.map.connections)
+            graph = read_cost_graph(filename)
+            self.assertEqual(len(graph), 14)
+            self.assertEqual(graph.neighbors(2), [1, 3, 5, 10])
+
+            generate_city(folder, lines=3, stations_per_line=10, seed=2)
+            dense = read_cost_table(filename)
+            generate_city(folder, lines=3, stations_per_line=10, seed=2, edge_list=True)
+            self.assertEqual(read_cost_table(filename), dense)
+
+            with open(filename, 'w') as file:
+                file.write('0 1 2\n1 0\n')
+            self.assertRaises(ValueError, read_cost_table, filename)
+
+            # The stations without connections are counted from the '# stations' comment or from stations
+            with open(filename, 'w') as file:
+                file.write('# from to cost\n# stations: 5\n1 2 3.5\n2 1 3.5\n')
+            self.assertEqual(len(read_cost_graph(filename)), 5)
+            self.assertEqual(read_cost_edges(filename, stations=4)[0], 5)
+            with open(filename, 'w') as file:
+                file.write('1 2 3.5\n2 1 3.5\n')
+            self.assertEqual([read_cost_edges(filename)[0], len(read_cost_graph(filename, stations=4))], [2, 4])
+            self.assertRaises(ValueError, read_cost_edges, filename, 1)
+            with open(filename, 'w') as file:
+                file.write('# from to cost\n')
+            count, sources, targets, costs = read_cost_edges(filename)
+            self.assertEqual((count, len(sources)), (0, 0))
+            self.assertEqual(len(read_cost_graph(filename, stations=3)), 3)
+            self.assertEqual(read_cost_table(filename), {})
+
+    def test_isochrone(self):
+        for type_preference in [0, 1, 2, 3]:
+            cost = isochrone(9, self.map, type_preference=type_preference)
+            self.assertEqual(cost[9], 0)
+            for station in self.map.stations:
+                if station != 9:
+                    self.assertEqual(cost[station], uniform_cost_search(9, station, self.map, type_preference).g)
+
+        cost, parent = isochrone(9, self.map, budget=30, tree=True)
+        self.assertTrue(all(value <= 30 for value in cost.values()))
+        self.assertLess(len(cost), len(self.map.stations))
+        self.assertEqual(set(parent), set(cost))
+        self.assertIsNone(parent[9])
+        for station in cost:
+            route = [station]
+            while parent[route[-1]] is not None:
+                route.append(parent[route[-1]])
+            self.assertEqual(uniform_cost_search(9, station, self.map, 1).route if station != 9 else [9], route[::-1])
+
+        stats = SearchStats()
+        cost, parent = isochrone([80, 100], self.map, tree=True, stats=stats)
+        self.assertEqual(stats['expanded'], len(self.map.stations))
+        for station in cost:
+            walk = min(euclidean_dist([80, 100], [self.map.stations[other]['x'], self.map.stations[other]['y']]) /
+                       WALKING_SPEED + (0 if other == station else uniform_cost_search(other, station, self.map, 1).g)
+                       for other in self.map.stations)
+            self.assertAlmostEqual(cost[station], walk)
+        self.assertIn(0, parent.values())
+        self.assertRaises(ValueError, isochrone, [80, 100], self.map, 10, 2)
+
+    def test_k_shortest_paths(self):
+        stations = sorted(self.map.stations)
+        for type_preference in [0, 1, 2, 3]:
+            for origin in stations:
+                for destination in stations:
+                    paths = list(itertools.islice(k_shortest_paths(origin, destination, self.map, type_preference), 6))
+                    costs = [path.g for path in paths]
+                    self.assertEqual(costs, sorted(costs))
+                    self.assertEqual(len(set(tuple(path.route) for path in paths)), len(paths))
+                    self.assertTrue(all(len(set(path.route)) == len(path) for path in paths))
+                    self.assertAlmostEqual(costs[0], uniform_cost_search(origin, destination, self.map,
+                                                                         type_preference).g)
+
+        paths = list(k_shortest_paths(9, 4, self.map, 1))
+        self.assertEqual(len(paths), 5)
+        self.assertEqual(paths[:3], [Path([9, 8, 7, 6, 5, 4]), Path([9, 8, 12, 11, 10, 5, 4]),
+                                     Path([9, 8, 13, 12, 11, 10, 5, 4])])
+        self.assertEqual([path.g for path in paths[:3]], [25.33962, 32.72972, 41.72972])
+
+    def test_search_events(self):
+        events = list(iter_Astar(9, 4, self.map, 2))
+        self.assertEqual([event.kind for event in events if event.kind != 'expanded'], ['incumbent', 'goal'])
+        self.assertEqual(events[-1].path.route, [9, 8, 12, 11, 10, 5, 4])
+        self.assertEqual((events[-1].expanded, events[-1].frontier), (22, 11))
+        self.assertEqual([event.expanded for event in events if event.kind == 'expanded'], list(range(1, 23)))
+        for search in [iter_depth_first_search, iter_breadth_first_search]:
+            events = list(search(9, 4, self.map))
+            self.assertEqual(events[-1].kind, 'goal')
+        self.assertEqual(list(iter_uniform_cost_search(9, 9, self.map, 1)),
+                         [('goal', LinkedPath(9), 0, 0, LinkedPath(9))])
+
+        self.assertEqual(anytime_search(iter_Astar(9, 4, self.map, 2), max_expansions=12), ([], False))
+        path, finished = anytime_search(iter_Astar(9, 4, self.map, 2), max_expansions=13)
+        self.assertEqual((path, path.g, finished), (Path([9, 8, 12, 11, 10, 5, 4]), 326.53992, False))
+        path, finished = anytime_search(iter_Astar(9, 4, self.map, 2), max_expansions=22)
+        self.assertEqual((path, finished), (Astar(9, 4, self.map, 2), True))
+        path, finished = anytime_search(iter_depth_first_search(9, 4, self.map), time_budget=60)
+        self.assertEqual((path, finished), (depth_first_search(9, 4, self.map), True))
+
+    def test_Astar_alt(self):
+        tables = precompute_route_tables(self.map)
+        stations = sorted(self.map.stations)
+        for type_preference in [0, 1, 2, 3]:
+            table = tables[type_preference]
+            for origin in stations:
+                for destination in stations:
+                    path = Astar(origin, destination, self.map, type_preference, heuristic='alt')
+                    self.assertAlmostEqual(path.g, table.cost[table.index[origin], table.index[destination]])
+
+        self.assertEqual(precompute_landmarks(self.map, 2)['landmarks'], [14, 1, 6, 11])
+        self.assertEqual(Astar(9, 4, self.map, 2, heuristic='alt'), Astar(9, 4, self.map, 2))
+        self.assertEqual(compare_heuristics(9, 4, self.map, 2), {'default': 22, 'alt': 14})
+        self.assertRaises(ValueError, Astar, 9, 4, self.map, 2, heuristic='euclidean')
+
     def test_Astar_improved(self):
         # If you want to see the optimal_path's route and f-cost,
         # uncomment the print functions below
@@ -236,6 +904,15 @@ class TestCases(unittest.TestCase):
         self.assertEqual(optimal_path, Path([0, -1]))
         self.assertEqual(round(optimal_path.f, 6), 16.124515)
 
+    def test_Astar_improved_nearest(self):
+        optimal_path = Astar_improved([80, 100], [100, 240], self.map, nearest=3)
+        self.assertEqual(optimal_path, Path([0, 11, 12, -1]))
+        self.assertEqual(round(optimal_path.f, 6), 18.417006)
+
+        optimal_path = Astar_improved([7, 250], [184, 127], self.map, nearest=1)
+        self.assertEqual(optimal_path, Path([0, 9, 8, 7, 6, -1]))
+        self.assertGreater(optimal_path.f, Astar_improved([7, 250], [184, 127], self.map).f)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,9 +1,15 @@
-from SubwayMap import Map
+from SubwayMap import Map, CSRGraph
+from array import array
 import numpy as np
+import itertools
 import math
 
 # Infinite cost represented by INF
 INF = 9999
+# Walking speed used to go from a coordinate to a station and from a station to a coordinate
+WALKING_SPEED = 5
+# Number of values of a cost file parsed at a time by read_cost_edges
+COST_CHUNK_VALUES = 1 << 20
 
 
 def euclidean_dist(x, y):
@@ -31,19 +37,94 @@ def read_information(filename):
     return vector
 
 
+def read_cost_edges(filename, stations=None):
+    """
+        Reads the connections of a cost file by blocks of rows, without building the whole matrix. Two formats are
+        accepted, and the format is detected from the first value of the first line that is not a comment:
+            - A dense matrix (the Time.txt of the Lyon cities): row i has the cost from station i to every
+              station, 0 when they are not connected. Its first value (from station 1 to itself) is 0.
+            - An edge list: one connection 'from to cost' per line, stations numbered from 1. It may start with
+              comments such as '# from to cost' and '# stations: 120', which gives the number of stations, also
+              the ones without connections.
+        Lines starting with '#' and empty lines are skipped in both formats.
+        Format of the parameter is:
+        Args:
+            filename (str): The cost file
+            stations (int): Number of stations of an edge list (e.g. the highest id of Stations.txt), used when it
+                            has no '# stations' comment
+        Returns:
+            count (int): Number of stations: rows of the matrix or, for an edge list, its '# stations' comment,
+                         stations, or its highest station (0 if it has no connections), in this order
+            sources, targets (numpy array of int): Stations of every connection, in the order of the file
+            costs (numpy array of float): Cost of every connection
+    """
+    sources, targets, costs = array('i'), array('i'), array('d')
+    count = 0
+    declared = {}
+
+    def data_lines(fp):
+        # Lines with values, the comment '# stations: N' is kept in declared
+        for line in fp:
+            stripped = line.strip()
+            if stripped.startswith('#'):
+                key, _, value = stripped[1:].partition(':')
+                if key.strip() == 'stations':
+                    declared['stations'] = int(value)
+            elif stripped:
+                yield line
+
+    with open(filename, 'r', encoding='utf-8') as fp:
+        lines = data_lines(fp)
+        first = next(lines, None)
+        dense = first is not None and float(first.split()[0]) == 0
+        if first is not None:
+            columns = len(first.split())
+            lines = itertools.chain([first], lines)
+            # The file is parsed in blocks of about COST_CHUNK_VALUES values
+            for block in iter(lambda: list(itertools.islice(lines, max(1, COST_CHUNK_VALUES // columns))), []):
+                values = np.loadtxt(block, ndmin=2)
+                if values.shape[1] != columns:
+                    raise ValueError('{}: rows with {} values instead of {}'.format(filename, values.shape[1],
+                                                                                    columns))
+                if dense:
+                    rows, cols = values.nonzero()
+                    sources.extend((rows + count + 1).tolist())
+                    targets.extend((cols + 1).tolist())
+                    costs.extend(values[rows, cols].tolist())
+                    count += len(values)
+                else:
+                    sources.extend(values[:, 0].astype(np.int32).tolist())
+                    targets.extend(values[:, 1].astype(np.int32).tolist())
+                    costs.extend(values[:, 2].tolist())
+    if not dense:
+        highest = max(max(sources, default=0), max(targets, default=0))
+        count = declared.get('stations', stations if stations is not None else highest)
+        if highest > count:
+            raise ValueError('{}: station {} in a city of {} stations'.format(filename, highest, count))
+    return (count, np.frombuffer(sources, dtype=np.int32), np.frombuffer(targets, dtype=np.int32),
+            np.frombuffer(costs, dtype=np.float64))
+
+
 def read_cost_table(filename):
-    adj_matrix = np.loadtxt(filename)
-    row, col = adj_matrix.nonzero()
+    # read_cost_table: Given a cost file (see read_cost_edges), the dictionary of dictionary of the connections
+    count, sources, targets, costs = read_cost_edges(filename)
     connections = {}
-    for r, c in zip(row, col):
-        if r + 1 not in connections:
-            connections[r + 1] = {c + 1: adj_matrix[r][c]}
+    for r, c, cost in zip(sources.tolist(), targets.tolist(), costs):
+        if r not in connections:
+            connections[r] = {c: cost}
         else:
-            connections[r + 1].update({c + 1: adj_matrix[r][c]})
+            connections[r][c] = cost
 
     return connections
 
 
+def read_cost_graph(filename, stations=None):
+    # read_cost_graph: Like read_cost_table, but the connections are returned as a CSRGraph with every station
+    # from 1 to the number of stations given by read_cost_edges
+    count, sources, targets, costs = read_cost_edges(filename, stations)
+    return CSRGraph.from_edges(sources, targets, costs, np.arange(1, count + 1))
+
+
 def print_list_of_path(path_list):
     for p in path_list:
         print("Route: {}".format(p.route))